@@ -0,0 +1,314 @@
+import glob
+import json
+import os
+
+from cloudmesh.common.util import path_expand
+
+from cloudmesh.apptainer.db import SqliteDatabase
+from cloudmesh.apptainer.db import get_database
+from cloudmesh.apptainer.db import unique_hostname
+
+
+class CatalogAggregator:
+    """
+    Merges the databases of many hosts into one indexed catalog.
+
+    Every node keeps its own apptainer.yaml (or SQLite database) with its
+    hostname, images, and instances. The aggregator copies the records of
+    all these files into a SqliteDatabase, whose tables are indexed by
+    hostname, image name, image digest, and instance name, so questions
+    such as which hosts have an image or where an instance runs are
+    answered without opening the files.
+
+    update() only reads the files whose inode, size, or modification time
+    changed since the last call; the records of files that no longer
+    exist are removed. The index file is kept between calls, so a cron job
+    or the CLI can refresh it cheaply.
+
+    Example:
+        catalog = CatalogAggregator("catalog.db")
+        catalog.update(["/shared/nodes/*/apptainer.yaml"])
+        print(catalog.locate(image="tf.sif"))
+    """
+
+    INDEX = "~/.cloudmesh/apptainer/catalog.db"
+
+    def __init__(self, filename=None, prefix="cloudmesh.apptainer"):
+        """
+        Args:
+            filename (str): The index file. If None
+                ~/.cloudmesh/apptainer/catalog.db is used.
+            prefix (str): The key prefix of the records in the sources.
+        """
+        self.filename = path_expand(filename or self.INDEX)
+        self.prefix = prefix
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = SqliteDatabase(self.filename, prefix=prefix)
+        self.connection = self.db.connection
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                inode INTEGER,
+                size INTEGER,
+                mtime INTEGER,
+                hosts TEXT NOT NULL
+            );
+            """
+        )
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def sources(self):
+        """
+        Returns:
+            list: The files in the index.
+        """
+        rows = self.connection.execute("SELECT path FROM sources ORDER BY path")
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _expand(sources):
+        paths = []
+        for source in sources:
+            source = path_expand(source)
+            if os.path.isdir(source):
+                source = os.path.join(source, "apptainer.yaml")
+            matches = sorted(glob.glob(source)) if glob.has_magic(source) else [source]
+            paths += [os.path.abspath(path) for path in matches]
+        return list(dict.fromkeys(paths))
+
+    def _owned(self, path):
+        # the hosts of all other files
+        return {
+            hostname
+            for (others,) in self.connection.execute(
+                "SELECT hosts FROM sources WHERE path != ?", (path,)
+            )
+            for hostname in json.loads(others)
+        }
+
+    def _stale(self, path, hosts):
+        # True if a host of the file was renamed for a file that is gone
+        suffix = f"@{path}"
+        owned = self._owned(path)
+        return any(
+            hostname.endswith(suffix)
+            and unique_hostname(hostname[: -len(suffix)], path, owned) != hostname
+            for hostname in hosts
+        )
+
+    def _release(self, path, hosts):
+        # removes the hosts of a file unless another file has them
+        owned = self._owned(path)
+        for hostname in hosts:
+            if hostname not in owned:
+                self.db.delete(hostname)
+
+    def _remove(self, path, hosts):
+        self._release(path, hosts)
+        with self.connection:
+            self.connection.execute("DELETE FROM sources WHERE path = ?", (path,))
+
+    def update(self, sources=None):
+        """
+        Brings the index up to date with the databases of the hosts.
+
+        Args:
+            sources (list): Database files, directories containing an
+                apptainer.yaml, or glob patterns. Files in the index that
+                are not given are removed from it. If None the files
+                already in the index are checked.
+
+        A host recorded as localhost, or with a hostname that another
+        file in the index already has, is kept under the hostname with the
+        path of its file appended, see unique_hostname(), and reported in
+        renamed.
+
+        Returns:
+            dict: The keys read (the files read again), unchanged (the
+                number of files that were not read), removed (the files
+                removed from the index), failed ({file: error}), and
+                renamed ({file: {hostname: indexed hostname}}).
+        """
+        known = {
+            row[0]: (row[1], row[2], row[3], json.loads(row[4]))
+            for row in self.connection.execute(
+                "SELECT path, inode, size, mtime, hosts FROM sources"
+            )
+        }
+        paths = list(known) if sources is None else self._expand(sources)
+        read, removed, failed, renamed = [], [], {}, {}
+        # the files that are gone are removed first, so the hosts they
+        # release are free for the files that are read
+        if sources is not None:
+            for path in set(known) - set(paths):
+                self._remove(path, known[path][3])
+                removed.append(path)
+        identities = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path in known:
+                    self._remove(path, known[path][3])
+                    removed.append(path)
+                elif sources is not None:
+                    failed[path] = "file not found"
+                continue
+            identities[path] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        unchanged = 0
+        for path, identity in identities.items():
+            if (
+                path in known
+                and known[path][:3] == identity
+                and not self._stale(path, known[path][3])
+            ):
+                unchanged += 1
+                continue
+            try:
+                db = get_database(path, prefix=self.prefix)
+                try:
+                    records = [db.load(hostname=hostname) for hostname in db.hosts()]
+                finally:
+                    db.close()
+            except Exception as e:
+                failed[path] = str(e)
+                continue
+            owned = self._owned(path)
+            for record in records:
+                hostname = unique_hostname(record["hostname"], path, owned)
+                if hostname != record["hostname"]:
+                    renamed.setdefault(path, {})[record["hostname"]] = hostname
+                    record["hostname"] = hostname
+            hosts = [record["hostname"] for record in records]
+            if path in known:
+                self._release(
+                    path, [host for host in known[path][3] if host not in hosts]
+                )
+            for record in records:
+                record.setdefault("location", [])
+                record.setdefault("images", [])
+                record.setdefault("instances", [])
+                record.setdefault("catalog", None)
+                self.db.save(record)
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO sources (path, inode, size, mtime, hosts)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (path, *identity, json.dumps(hosts)),
+                )
+            read.append(path)
+        return {
+            "read": read,
+            "unchanged": unchanged,
+            "removed": sorted(removed),
+            "failed": failed,
+            "renamed": renamed,
+        }
+
+    def hosts(self):
+        """
+        Summarizes the hosts in the index.
+
+        Returns:
+            list: A dict per host with the keys hostname, images,
+                instances (the number of each), and source.
+        """
+        sources = {}
+        for path, hosts in self.connection.execute("SELECT path, hosts FROM sources"):
+            for hostname in json.loads(hosts):
+                sources[hostname] = path
+        counts = {}
+        for table in ["images", "instances"]:
+            counts[table] = dict(
+                self.connection.execute(
+                    f"SELECT hostname, COUNT(*) FROM {table} GROUP BY hostname"
+                ).fetchall()
+            )
+        return [
+            {
+                "hostname": hostname,
+                "images": counts["images"].get(hostname, 0),
+                "instances": counts["instances"].get(hostname, 0),
+                "source": sources.get(hostname),
+            }
+            for hostname in self.db.hosts()
+        ]
+
+    def _query(self, table, conditions):
+        sql = f"SELECT hostname, data FROM {table}"
+        conditions = [(column, value) for column, value in conditions if value]
+        if conditions:
+            sql += " WHERE " + " AND ".join(f"{column} = ?" for column, _ in conditions)
+        sql += " ORDER BY hostname, position"
+        values = [value for _, value in conditions]
+        return [
+            dict(json.loads(data), hostname=hostname)
+            for hostname, data in self.connection.execute(sql, values)
+        ]
+
+    def images(self, hostname=None, name=None, digest=None):
+        """
+        Queries the images of all hosts.
+
+        Args:
+            hostname (str): Only images on this host.
+            name (str): Only images with this file name.
+            digest (str): Only images with this sha256:<hex> digest.
+
+        Returns:
+            list: The image records, each with its hostname.
+        """
+        return self._query(
+            "images",
+            [
+                ("hostname", hostname),
+                ("name", name),
+                ("json_extract(data, '$.digest')", digest),
+            ],
+        )
+
+    def instances(self, hostname=None, name=None, image=None):
+        """
+        Queries the instances of all hosts.
+
+        Args:
+            hostname (str): Only instances on this host.
+            name (str): Only instances with this name.
+            image (str): Only instances of this image path.
+
+        Returns:
+            list: The instance records, each with its hostname.
+        """
+        return self._query(
+            "instances",
+            [("hostname", hostname), ("instance", name), ("img", image)],
+        )
+
+    def locate(self, image=None, digest=None, instance=None):
+        """
+        Finds the hosts that have an image or run an instance.
+
+        Args:
+            image (str): The file name of the image.
+            digest (str): The digest of the image.
+            instance (str): The name of the instance.
+
+        Returns:
+            list: The hostnames, sorted.
+        """
+        if instance is not None:
+            records = self.instances(name=instance)
+        else:
+            records = self.images(name=image, digest=digest)
+        return sorted({record["hostname"] for record in records})
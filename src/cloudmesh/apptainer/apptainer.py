@@ -1,24 +1,127 @@
+import codecs
+import copy
+import fnmatch
 import json
 import os
-import re
+import selectors
+import shlex
+import shutil
+import signal
 import subprocess
-import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from contextlib import contextmanager
 
 import humanize
-from cloudmesh.common.Shell import Shell
+import yaml
 from cloudmesh.common.console import Console
 from cloudmesh.common.util import banner
-from cloudmesh.common.util import path_expand
 from cloudmesh.common.variables import Variables
 
-from yamldb import YamlDB
+from cloudmesh.apptainer.cache import CacheInspector
+from cloudmesh.apptainer.cache import PullMarker
+from cloudmesh.apptainer.catalog import ImageCatalog
+from cloudmesh.apptainer.cgroup import CgroupStats
+from cloudmesh.apptainer.db import get_database
+from cloudmesh.apptainer.inspectcache import InspectCache
+from cloudmesh.apptainer.instances import InstanceFiles
+from cloudmesh.apptainer.process import ProcessTable
+from cloudmesh.apptainer.sif import SifError
+from cloudmesh.apptainer.sif import SifImage
+from cloudmesh.apptainer.sif import is_sif
+from cloudmesh.apptainer.stats import parse_stats
+from cloudmesh.apptainer.store import deduplicate
+from cloudmesh.apptainer.store import file_digest
+from cloudmesh.apptainer.transport import get_transport
+from cloudmesh.apptainer.transport import is_local
 
 from pprint import pprint
 
+
+class ApptainerError(Exception):
+    """
+    Raised if a command run by Apptainer did not complete.
+
+    Attributes:
+        command (str): The command.
+        stdout (str): The output collected before the command was stopped.
+        stderr (str): The error output collected before it was stopped.
+    """
+
+    def __init__(self, message, command=None, stdout="", stderr=""):
+        super().__init__(message)
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class ApptainerTimeout(ApptainerError):
+    """Raised if a command did not finish within its timeout."""
+
+
+class ApptainerCancelled(ApptainerError):
+    """Raised if a command was cancelled with Apptainer.cancel()."""
+
+
+def _same_host(a, b):
+    return a == b or (is_local(a) and is_local(b))
+
+
 class Apptainer:
 
-    def __init__(self):
-        self.processes = []
+    def __init__(
+        self,
+        filename=None,
+        timeout=None,
+        ttl=2.0,
+        digest=None,
+        host=None,
+        transport=None,
+        scan=True,
+    ):
+        """
+        Creates the Apptainer object and updates its database.
+
+        Args:
+            filename (str): The database file. Files ending in .db, .sqlite,
+                or .sqlite3 use SQLite, all others YAML. If None the cms
+                variable apptainer_db is used and then apptainer.yaml.
+            timeout (float): The default timeout in seconds of the commands
+                run by system(). None waits forever.
+            ttl (float): Seconds the instance listing of info() is reused.
+                0 or None lists the instances on every call.
+            digest (bool): Record the sha256 digest of every image in the
+                catalog. If None the cms variable apptainer_digest is used.
+            host (str): The host the commands of system() are run on and
+                the database record is kept for. If None this host. A YAML
+                database holds one host, so use one file per host or SQLite;
+                a YAML file with the record of another host is rejected
+                with ValueError.
+            transport (str or Transport): How the commands reach the host,
+                local, ssh, or a Transport. If None local is used for this
+                host and ssh for all other hosts, see get_transport(). With
+                a remote transport the timeout and cancel() only kill the
+                local ssh client, not the command on the remote host, and
+                the operations on image files, e.g. add_location(),
+                download(), and dedup(), raise ValueError.
+            scan (bool): Update the images from the locations. If False the
+                images recorded in the database are used, which is enough
+                for commands that only manage instances. The locations of
+                a host reached with a remote transport are not on this host,
+                so they are never scanned.
+        """
+        self.timeout = timeout
+        self.ttl = ttl
+        self._listing = {}
+        self._generation = 0
+        self.instance_files = InstanceFiles()
+        self.cgroups = CgroupStats()
+        self._lock = threading.Lock()
+        self._running = {}
+        self._cancelled = set()
+        self.processes = ProcessTable()
         self.location = []
         self.instances = []
         self.variables = Variables()
@@ -26,83 +129,154 @@ class Apptainer:
             self.hostname = os.environ.get("HOSTNAME") or os.uname()[1]
         except:
             self.hostname = "localhost"
+        self.host = host
+        if host is not None:
+            self.hostname = host
+        self.transport = get_transport(transport, host=host)
         self.prefix = f"cloudmesh.apptainer"
-
-        self.db = YamlDB(filename="apptainer.yaml")
-        self.images = self.load_location_from_db()
+        self.filename = filename or self.variables["apptainer_db"] or "apptainer.yaml"
+        if digest is None:
+            digest = str(self.variables["apptainer_digest"]).lower() in [
+                "true",
+                "1",
+                "yes",
+            ]
+        self.digest = digest
+        self.catalog = ImageCatalog(hostname=self.hostname, digest=digest)
+        self._saved = {}
+        self._batch = 0
+        self._pending = False
+        self._inspect_cache = None
+
+        self.db = get_database(self.filename, prefix=self.prefix)
+        if host is not None and self.db.single_host:
+            stored = self.db.hosts()
+            if stored and not _same_host(stored[0], host):
+                raise ValueError(
+                    f"{self.filename} holds the record of {stored[0]}, use a"
+                    f" separate file or a SQLite database for {host}"
+                )
+        if scan and self.transport.local:
+            self.images = self.load_location_from_db()
+        else:
+            self.load()
 
         self.save()
 
     def get_db(self, key):
-        return self.db[f"{self.prefix}.{key}"]
+        return self.db.get(key, hostname=self.hostname)
+
+    def _record(self):
+        return {
+            "hostname": self.hostname,
+            "location": self.location,
+            "images": self.images,
+            "instances": self.instances,
+            "catalog": self.catalog.state,
+        }
+
+    @staticmethod
+    def _snapshot(record):
+        return {
+            key: json.dumps(value, sort_keys=True, default=str)
+            for key, value in record.items()
+        }
+
+    def save(self, force=False):
+        """
+        Saves the state to the database if it changed since the last save.
+
+        Only the keys that changed are passed to the database backend.
 
-    def save(self):
+        Inside a batch() the write is deferred until the outermost batch ends.
+
+        Args:
+            force (bool): Write the file even if nothing changed.
+
+        Returns:
+            bool: True if the file was written.
+        """
+        if self._batch > 0:
+            self._pending = True
+            return False
+        record = self._record()
+        snapshot = self._snapshot(record)
+        changed = [key for key in snapshot if snapshot[key] != self._saved.get(key)]
+        if force:
+            changed = list(snapshot)
+        if not changed:
+            return False
         try:
-            prefix = self.prefix
-            self.db[f"{prefix}.hostname"] = self.hostname
-            self.db[f"{prefix}.location"] = self.location
-            self.db[f"{prefix}.images"] = self.images
-            self.db[f"{prefix}.instances"] = self.instances
-            self.db.save()
+            self.db.save(record, keys=changed)
+            self._saved = snapshot
+            return True
         except:
-            Console.error("apptainer.yaml could not be written")
+            Console.error(f"{self.filename} could not be written")
+            return False
+
+    @contextmanager
+    def batch(self):
+        """
+        Defers all saves inside the block to a single write at its end.
+
+        Example:
+            with apptainer.batch():
+                apptainer.add_location("images")
+                apptainer.info()
+        """
+        self._batch += 1
+        try:
+            yield self
+        finally:
+            self._batch -= 1
+            if self._batch == 0 and self._pending:
+                self._pending = False
+                self.save()
 
     def load(self):
-        if os.path.isfile("apptainer.yaml"):
-            prefix = self.prefix
-            try:
-                self.hostname = self.db[f"{prefix}.hostname"]
-            except:
-                self.hostname = "localhost"
-            try:
-                self.location = self.db[f"{prefix}.location"]
-            except:
-                self.location = ["images"]
-            try:
-                self.images = self.db[f"{prefix}.images"]
-            except:
-                self.images = []
+        if self.db.exists():
+            record = self.db.load(hostname=self.hostname)
+            self.hostname = self.host or record.get("hostname") or self.hostname
+            self.location = record.get("location", ["images"])
+            self.images = record.get("images") or []
+            self.instances = record.get("instances") or []
+            self.catalog = ImageCatalog(
+                hostname=self.hostname, state=record.get("catalog"), digest=self.digest
+            )
+            self._saved = self._snapshot(
+                {key: record.get(key) for key in self._record()}
+            )
         else:
-            Console.warning("apptainer.yaml does not exist")
+            Console.warning(f"{self.filename} does not exist")
 
     def load_location_from_db(self):
+        """
+        Updates the list of images from the locations recorded in the database.
+
+        Only the location directories whose inode or mtime changed since the
+        last call are listed again; all other images are taken from the
+        catalog stored in the database.
+
+        Returns:
+            list: The images found in the locations.
+        """
         self.load()
+        self.images = self.catalog.refresh(self.location)
+        return self.images
 
-        self.images = []
-        for entry in self.location:
-            entry = path_expand(entry)
-            if os.path.isdir(entry):
-                for name in os.listdir(entry):
-                    if name.endswith(".sif"):
-                        location = entry + "/" + name
-                        try:
-                            size = humanize.naturalsize(os.path.getsize(location))
-                        except:
-                            size = "unknown"
-                        if os.path.isfile(location):
-                            self.images.append(
-                                {
-                                    "name": name,
-                                    "size": size,
-                                    "path": os.path.abspath(location),
-                                    "location": location,
-                                    "hostname": self.hostname,
-                                }
-                            )
-            elif entry.endswith(".sif"):
-                if os.path.isfile(entry):
-                    self.images.append(
-                        {
-                            "name": os.path.basename(entry),
-                            "size": size,
-                            "path": os.path.abspath(location),
-                            "location": entry,
-                        }
-                    )
-                    try:
-                        size = humanize.naturalsize(os.path.getsize(entry))
-                    except:
-                        size = "unknown"
+    def _local_files(self, operation):
+        """
+        Raises ValueError if the images of self.hostname are not on this host.
+
+        The locations, images, and catalog are files of this host, so the
+        operations that list, hash, pull, or link them can not work for a
+        host reached with a remote transport.
+        """
+        if not self.transport.local:
+            raise ValueError(
+                f"{operation} works on the files of this host and not on "
+                f"{self.hostname}, which is reached with {self.transport}"
+            )
 
     def add_location(self, path):
         """
@@ -113,85 +287,420 @@ class Apptainer:
 
         Returns:
         None
+
+        Raises:
+        ValueError: If the host is reached with a remote transport.
         """
+        self._local_files("add_location")
         if path not in self.location:
             self.location.append(path)
+        self.images = self.catalog.refresh(self.location)
         self.save()
-        self.load_location_from_db()
 
-    def ps(self):
+    def ps(self, name=None, running=False):
         """
-        Lists the process ids of the containers.
+        Lists the processes started with system(register=True), e.g. by start().
+
+        The records are kept in ~/.cloudmesh/apptainer/processes.json, so
+        they include the processes of earlier invocations. apptainer is not
+        called.
+
+        Args:
+            name (str): Only processes of this instance.
+            running (bool): Only processes that are still running.
 
         Returns:
-            tuple: A tuple containing the stdout and stderr of the command.
+            list: Dicts with the keys pid, name, command, start, end,
+                status, and exit.
+        """
+        return self.processes.list(name=name, running=running)
+
+    @staticmethod
+    def _command(arguments, env=None):
+        """
+        Joins an argument list and environment into a shell command line.
+        """
+        prefix = "".join(
+            f"{key}={shlex.quote(str(value))} " for key, value in (env or {}).items()
+        )
+        return prefix + shlex.join(arguments)
+
+    @staticmethod
+    def _gpu_env(gpu):
+        if gpu is None:
+            return {}
+        return {"CUDA_VISIBLE_DEVICES": str(gpu)}
+
+    @staticmethod
+    def _info_command(logs=False):
+        command = ["apptainer", "instance", "list", "--json"]
+        if logs:
+            command.append("--logs")
+        return command
+
+    @staticmethod
+    def _start_command(name, path, home=None, options=None):
+        command = ["apptainer", "instance", "start", "--nv"]
+        if home:
+            if home == "pwd":
+                home = os.getcwd()
+            command += ["--home", home]
+        command += [path, name]
+        if options:
+            if isinstance(options, str):
+                options = shlex.split(options)
+            command += list(options)
+        return command
+
+    @staticmethod
+    def _stop_command(name, force=False, signal=None, timeout=10, user=None):
+        command = ["apptainer", "instance", "stop"]
+        if name == "all":
+            return command + ["--all"]
+        if force:
+            command.append("--force")
+        if signal:
+            command += ["--signal", str(signal)]
+        if timeout:
+            command += ["--timeout", str(timeout)]
+        if user:
+            command += ["--user", user]
+        return command + [name]
+
+    @staticmethod
+    def _exec_command(name, command, bind=None, nv=False, home=None):
+        arguments = ["apptainer", "exec"]
+        if nv:
+            arguments.append("--nv")
+        if bind:
+            for b in bind:
+                arguments += [
+                    "--bind",
+                    f"{b['src']}:{b.get('dest', b['src'])}:{b.get('opts', 'rw')}",
+                ]
+        if home:
+            arguments += ["--home", home]
+        arguments.append(f"instance://{name}")
+        if isinstance(command, str):
+            command = shlex.split(command)
+        return arguments + list(command)
+
+    def _popen(self, command, name=None, **kwargs):
+        """
+        Starts a command with self.transport in its own process group and
+        records it as in flight.
+        """
+        process = self.transport.popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **kwargs,
+        )
+        with self._lock:
+            self._running[process.pid] = {"name": name, "process": process}
+        return process
+
+    def _kill(self, process, sig=signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _finish(self, process, register=False):
         """
-        return self.processes
+        Removes a process from the in flight calls.
+
+        Args:
+            process (Popen): The process that terminated.
+            register (bool): Record its exit status in the process table.
 
-    def system(self, command=None, name=None, verbose=False, register=False):
+        Returns:
+            bool: True if the call was cancelled.
+        """
+        if register:
+            self.processes.finish(process)
+        with self._lock:
+            self._running.pop(process.pid, None)
+            if process.pid in self._cancelled:
+                self._cancelled.discard(process.pid)
+                return True
+        return False
+
+    def cancel(self, name=None):
+        """
+        Cancels calls of system() and stream() that are in flight.
+
+        This can be called from any thread. The process group of each
+        selected call is killed and the call raises ApptainerCancelled.
+        For a remote host only the local ssh client is killed.
+
+        Args:
+            name (str): Only cancel the calls started with this name. All
+                calls are cancelled if None.
+
+        Returns:
+            int: The number of cancelled calls.
+        """
+        with self._lock:
+            selected = [
+                entry["process"]
+                for entry in self._running.values()
+                if name is None or entry["name"] == name
+            ]
+            for process in selected:
+                self._cancelled.add(process.pid)
+        for process in selected:
+            self._kill(process)
+        return len(selected)
+
+    def system(
+        self,
+        command=None,
+        name=None,
+        verbose=False,
+        register=False,
+        callback=None,
+        timeout=None,
+    ):
         """
         Runs a command.
 
+        The command runs with self.transport, on this host or on
+        self.hostname, in its own process group. If it does not finish
+        within the timeout, the whole group is killed and ApptainerTimeout
+        is raised with the output collected so far. For a remote host the
+        group is the local ssh client, the remote command is not killed.
+
         Args:
             command (str): Command to run.
             verbose (bool): Print the command before executing.
+            callback (function): If given, it is called as callback(stream, line)
+                for every line of output while the command runs, with stream
+                being "stdout" or "stderr". The output is then not collected
+                and empty strings are returned.
+            timeout (float): Seconds to wait for the command. If None
+                self.timeout is used; if that is None there is no limit.
 
         Returns:
             tuple: A tuple containing the stdout and stderr of the command.
+
+        Raises:
+            ApptainerTimeout: If the command did not finish in time.
+            ApptainerCancelled: If the call was cancelled with cancel().
         """
-        if verbose:
-            print(command)
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+        if callback is not None:
+            for stream, line in self.stream(
+                command=command, name=name, verbose=verbose, timeout=timeout
+            ):
+                callback(stream, line)
+            return "", ""
+        returncode, stdout, stderr = self._run(
+            command, name=name, verbose=verbose, register=register, timeout=timeout
         )
-        if register is None or register is False:
-            pass
-        elif register:
-            self.processes.append({"name": name, "pid": process})
-        elif not register:
-            del self.processes[name]
-        stdout, stderr = process.communicate()
         return stdout, stderr
 
-    def list(self, output=None, verbose=False):
+    def _run(self, command, name=None, verbose=False, register=False, timeout=None):
+        """
+        Runs a command like system() and also returns its exit code.
+
+        Returns:
+            tuple: The exit code, stdout, and stderr of the command.
+        """
+        if verbose:
+            print(command)
+        timeout = self.timeout if timeout is None else timeout
+        process = self._popen(command, name=name, text=True)
+        if register:
+            self.processes.register(process, name=name, command=command)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._kill(process)
+            stdout, stderr = process.communicate()
+            self._finish(process, register=register)
+            raise ApptainerTimeout(
+                f"Command did not finish within {timeout} seconds: {command}",
+                command=command,
+                stdout=stdout,
+                stderr=stderr,
+            )
+        except:
+            self._kill(process)
+            process.communicate()
+            self._finish(process, register=register)
+            raise
+        if self._finish(process, register=register):
+            raise ApptainerCancelled(
+                f"Command was cancelled: {command}",
+                command=command,
+                stdout=stdout,
+                stderr=stderr,
+            )
+        return process.returncode, stdout, stderr
+
+    def stream(self, command=None, name=None, verbose=False, chunk=65536, timeout=None):
+        """
+        Runs a command and yields its output while it runs.
+
+        Only the current, incomplete line of each stream is buffered, and a
+        line longer than chunk characters is yielded in pieces, so the memory
+        used does not depend on the amount of output. If the generator is
+        closed before the command finished, the command is killed.
+
+        Args:
+            command (str): Command to run.
+            verbose (bool): Print the command before executing.
+            chunk (int): The number of bytes read at once.
+            timeout (float): Seconds the command may run. If None
+                self.timeout is used; if that is None there is no limit.
+
+        Returns:
+            generator: (stream, line) tuples where stream is "stdout" or
+                "stderr" and line includes its newline.
+
+        Raises:
+            ApptainerTimeout: If the command did not finish in time.
+            ApptainerCancelled: If the call was cancelled with cancel().
+
+        Example:
+            for stream, line in apptainer.stream("ls -l"):
+                print(stream, line, end="")
+        """
+        if verbose:
+            print(command)
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        process = self._popen(command, name=name, stdin=subprocess.DEVNULL)
+        selector = selectors.DefaultSelector()
+        for tag, pipe in [("stdout", process.stdout), ("stderr", process.stderr)]:
+            selector.register(
+                pipe,
+                selectors.EVENT_READ,
+                (tag, codecs.getincrementaldecoder("utf-8")(errors="replace"), []),
+            )
+        try:
+            while selector.get_map():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise ApptainerTimeout(
+                            f"Command did not finish within {timeout} seconds: "
+                            f"{command}",
+                            command=command,
+                        )
+                for key, _ in selector.select(timeout=remaining):
+                    tag, decoder, pending = key.data
+                    data = os.read(key.fd, chunk)
+                    if data:
+                        text = "".join(pending) + decoder.decode(data)
+                    else:
+                        selector.unregister(key.fileobj)
+                        text = "".join(pending) + decoder.decode(b"", final=True)
+                    pending.clear()
+                    lines = text.splitlines(keepends=True)
+                    if data and lines and not lines[-1].endswith("\n"):
+                        if len(lines[-1]) < chunk:
+                            pending.append(lines.pop())
+                    for line in lines:
+                        yield tag, line
+            process.wait()
+        finally:
+            selector.close()
+            if process.poll() is None:
+                self._kill(process)
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+            cancelled = self._finish(process)
+        if cancelled:
+            raise ApptainerCancelled(f"Command was cancelled: {command}", command=command)
+
+    def list(self, output=None, verbose=False, fresh=False, native=True):
         """
         Lists the instances.
 
         Args:
             output (str): Output format. Supported values: "json".
             verbose (bool): Print the command before executing.
+            fresh (bool): Do not use the cached listing.
+            native (bool): Read the instance files of apptainer if possible.
 
         Returns:
-            tuple: A tuple containing the stdout and stderr of the command.
+            list: The instances.
         """
-        self.instances = self.info()["instances"]
+        self.instances = self.info(verbose=verbose, fresh=fresh, native=native)[
+            "instances"
+        ]
         return self.instances
 
-    def info(self, logs=False, verbose=False):
+    def invalidate(self):
+        """
+        Discards the cached instance listing.
+
+        It is called by start() and stop(); call it after instances were
+        changed by other means, e.g. another program.
+        """
+        with self._lock:
+            self._listing.clear()
+            self._generation += 1
+
+    def info(self, logs=False, verbose=False, fresh=False, native=True, save=True):
         """
         Lists the instances.
 
+        If native is True and the instances run on this host, they are
+        read from the instance files apptainer keeps under
+        ~/.apptainer/instances, see InstanceFiles. apptainer instance
+        list --json is only run if that directory does not exist.
+
+        The listing is cached for self.ttl seconds, so polling loops do not
+        run apptainer instance list on every call. The cache is invalidated
+        whenever an instance is started or stopped by this object.
+
         Args:
-            output (str): Output format. Supported values: "json".
             logs (bool): Include logs in the output.
             verbose (bool): Print the command before executing.
+            fresh (bool): Do not use the cached listing.
+            native (bool): Read the instance files of apptainer if possible.
+            save (bool): Save the instances to the database. Use False in
+                other threads, the database belongs to the thread that
+                created this object.
 
         Returns:
             dict: A dictionary containing the stdout as a dictionary.
         """
-        command = "apptainer instance list --json"
-        if logs:
-            command += " --logs"
-        if verbose:
-            banner(command)
-        stdout, stderr = self.system(command=command)
-
-        output_dict = json.loads(stdout)
-        self.db[f"{self.prefix}.instances"] = output_dict["instances"]
+        key = (logs, native)
+        with self._lock:
+            cached = self._listing.get(key)
+            generation = self._generation
+        if (
+            not fresh
+            and self.ttl
+            and cached is not None
+            and time.monotonic() - cached[0] < self.ttl
+        ):
+            return copy.deepcopy(cached[1])
+
+        fetched = time.monotonic()
+        instances = None
+        if native and self.transport.local:
+            instances = self.instance_files.list()
+        if instances is not None:
+            output_dict = {"instances": instances}
+        else:
+            command = self._command(self._info_command(logs=logs))
+            if verbose:
+                banner(command)
+            stdout, stderr = self.system(command=command)
+            output_dict = json.loads(stdout)
+
+        with self._lock:
+            if generation == self._generation:
+                self._listing[key] = (fetched, copy.deepcopy(output_dict))
+        self.instances = output_dict["instances"]
+        if save:
+            self.save()
 
         return output_dict
 
@@ -200,14 +709,41 @@ class Apptainer:
         Finds the image of an instance.
 
         Args:
-            name (str): Name of the instance.
+            name (str): Name of the instance. It can also be the digest
+                of the image, e.g. sha256:4f3c...
 
         Returns:
             str: The image of the instance.
         """
         #if name.endswith(".sif"):
         #    return os.path.basename(name), name
-    
+
+        if name.startswith("sha256:") and not self.transport.local:
+            # the files of a remote host can not be hashed again here
+            for image in self.images:
+                if image.get("digest", "").startswith(name):
+                    return image
+            raise ValueError(f"Image {name} not found")
+
+        if name.startswith("sha256:"):
+            # a file may have been rewritten since it was hashed; verify()
+            # hashes it again and updates its digest in the catalog
+            changed = False
+            for image in self.images:
+                if image.get("digest", "").startswith(name):
+                    if self.catalog.verify(image["location"]) == image["digest"]:
+                        if changed:
+                            self.images = self.catalog.images()
+                        return image
+                    changed = True
+            for image in self.images:
+                self.catalog.verify(image["location"])
+            self.images = self.catalog.images()
+            for image in self.images:
+                if image.get("digest", "").startswith(name):
+                    return image
+            raise ValueError(f"Image {name} not found")
+
         for key in ["name", "path", "location"]:
             for image in self.images:
                 if image[key] == name:
@@ -219,24 +755,59 @@ class Apptainer:
 
         # ...
 
-    def inspect(self, name):
+    @property
+    def inspect_cache(self):
+        """
+        The persistent cache of inspect results, created on first use.
+        """
+        if self._inspect_cache is None:
+            self._inspect_cache = InspectCache()
+        return self._inspect_cache
+
+    def _inspect(self, location, native=True):
+        if native:
+            try:
+                with SifImage(location) as sif:
+                    return sif.inspect()
+            except (OSError, SifError):
+                pass
+        command = f"apptainer inspect --json {location}"
+        stdout, stderr = self.system(name="inspect", command=command, register=False)
+        return json.loads(stdout)
+
+    def inspect(self, name, native=True, cache=True):
         """
         Inspects the instance.
 
+        The labels are read directly from the SIF header of the image. If
+        the image can not be parsed or has no labels object, apptainer
+        inspect is called instead. The result is cached on disk as long as
+        the inode, size, and mtime of the image do not change.
+
         Args:
             name (str): Name of the instance.
+            native (bool): Read the SIF file instead of calling apptainer.
+            cache (bool): Use the inspect cache.
 
         Returns:
             dict: A dictionary containing the JSON data from stdout.
             str: The stderr of the command.
+
+        Raises:
+            ValueError: If the host is reached with a remote transport.
         """
+        self._local_files("inspect")
         image = self.find_image(name)
         location = image["path"]
         name = image["name"]
-        command = f"apptainer inspect --json {location}"
-        stdout, stderr = self.system(name="inspect", command=command, register=False)
 
-        data = json.loads(stdout)
+        data = self.inspect_cache.get(location) if cache else None
+        if data is None:
+            data = self._inspect(location, native=native)
+            if cache:
+                self.inspect_cache.put(location, data)
+        if cache:
+            self.inspect_cache.save()
 
         attributes = data["data"]["attributes"]["labels"]
         size = humanize.naturalsize(os.path.getsize(location))
@@ -253,57 +824,81 @@ class Apptainer:
 
         return result
 
-    def cache(self):
-        result, stderr = self.system(
-            name="cache", command="apptainer cache list", register=False
-        )
-
-        # output = "There are 1 container file(s) using 43.48 MiB and 66 oci blob file(s) using 7.01 GiB of space\nTotal space used: 7.05 GiB"
+    def cache(self, entries=False):
+        """
+        Accounts the space used by the apptainer cache.
 
-        # another_possible_output = "There are 1 container file(s) using 469.52 MiB and 14 oci blob file(s) using 510.59 MiB of space
-        # Total space used: 980.10 MiB
-        # "
+        The cache directory is walked directly with CacheInspector, so no
+        apptainer command is run and the sizes are exact.
 
-        container_files = re.search(r"There are (\d+) container file", result).group(1)
-        container_space = re.search(r"using ([\d.]+) (MiB|GiB)", result).groups()
-        oci_blob_files = re.search(r"(\d+) oci blob file", result).group(1)
-        oci_blob_space = re.search(r"using ([\d.]+) (MiB|GiB)", result).groups()
-        total_space = re.search(
-            r"Total space used: ([\d.]+) (MiB|GiB)", result
-        ).groups()
+        Args:
+            entries (bool): Include the list of cache entries.
 
-        if "SINGULARITY_CACHEDIR" in os.environ:
-            s_cache = os.environ["SINGULARITY_CACHEDIR"]
-        else:
-            s_cache = None
-        if "APPTAINER_CACHEDIR" in os.environ:
-            a_cache = os.environ["APPTAINER_CACHEDIR"]
-        else:
-            a_cache = None
+        Returns:
+            dict: The number of files and the space of the container files
+                and OCI blobs as text and in bytes, the cache directory,
+                and the cache variables. With entries=True also the
+                entries as returned by CacheInspector.entries().
+        """
+        inspector = CacheInspector()
+        found = inspector.entries()
+        summary = inspector.summary(found)
 
         data = {
             "hostname": self.hostname,
-            "Container_Files": container_files,
-            "Container_Space": " ".join(container_space),
-            "OCI_Blob_Files": oci_blob_files,
-            "OCI_Blob_Space": " ".join(oci_blob_space),
-            "Total_Space_Used": " ".join(total_space),
-            "SINGULARITY_CACHEDIR": s_cache,
-            "APPTAINER_CACHEDIR": a_cache,
+            "Container_Files": summary["container_files"],
+            "Container_Space": humanize.naturalsize(
+                summary["container_bytes"], binary=True
+            ),
+            "Container_Bytes": summary["container_bytes"],
+            "OCI_Blob_Files": summary["blob_files"],
+            "OCI_Blob_Space": humanize.naturalsize(summary["blob_bytes"], binary=True),
+            "OCI_Blob_Bytes": summary["blob_bytes"],
+            "Total_Space_Used": humanize.naturalsize(
+                summary["total_bytes"], binary=True
+            ),
+            "Total_Bytes": summary["total_bytes"],
+            "Directory": summary["directory"],
+            "SINGULARITY_CACHEDIR": os.environ.get("SINGULARITY_CACHEDIR"),
+            "APPTAINER_CACHEDIR": os.environ.get("APPTAINER_CACHEDIR"),
         }
+        if entries:
+            data["entries"] = found
         return data
 
+    def cache_prune(self, budget, dry_run=False):
+        """
+        Removes the least recently used cache entries until the cache fits
+        into the budget.
+
+        Entries a pull in progress may use are kept, see CacheInspector.prune.
+
+        Args:
+            budget (int or str): The maximum size of the cache, e.g. 20GB.
+            dry_run (bool): Only report what would be removed.
+
+        Returns:
+            dict: The report of CacheInspector.prune.
+        """
+        return CacheInspector().prune(budget, dry_run=dry_run)
+
     def stats(self, name=None, output=None, verbose=False):
         """
         Displays statistics about the instances.
 
         Args:
-            output (str): Output format. Supported values: "json".
+            output (str): Output format. Supported values: "json" and "dict".
             verbose (bool): Print the command before executing.
 
         Returns:
-            tuple: A tuple containing the stdout and stderr of the command.
+            tuple: A tuple containing the stdout and stderr of the command
+                for "json". A dict as returned by counters() for "dict".
         """
+        if output == "dict":
+            for instance in self.info()["instances"]:
+                if instance["instance"] == name:
+                    return self.counters(instance, verbose=verbose)
+            raise ValueError(f"Instance {name} not found")
         command = f"apptainer instance stats"
         if "json" in output:
             command += " --json"
@@ -315,6 +910,33 @@ class Apptainer:
         stdout, stderr = self.system(command=command, register=False)
         return stdout, stderr
 
+    def counters(self, instance, verbose=False):
+        """
+        Reads the resource counters of an instance.
+
+        The counters are read from the cgroup v2 files of the instance pid
+        with self.cgroups. If the instance runs on another host, cgroup v2
+        is not available, or the cgroup of the instance can not be read,
+        apptainer instance stats --json is run.
+
+        Args:
+            instance (dict): An entry of info()["instances"].
+            verbose (bool): Print the command before executing.
+
+        Returns:
+            dict: The keys cpu (CPU time in nanoseconds), memory (bytes),
+                io (bytes read and written), and pids (number of processes).
+        """
+        if self.transport.local and self.cgroups.available():
+            try:
+                return self.cgroups.read(instance["pid"])
+            except OSError:
+                pass
+        stdout, stderr = self.stats(
+            name=instance["instance"], output="json", verbose=verbose
+        )
+        return parse_stats(stdout)
+
     def start(
         self,
         name=None,
@@ -332,7 +954,7 @@ class Apptainer:
 
         # check if name is not alrady in use
 
-        if clean:
+        if clean and not dryrun:
             try:
                 out, err = self.stop(name=name)
             except:
@@ -340,37 +962,111 @@ class Apptainer:
 
             assert "no instance found" not in out
 
-            out = self.info()
-            assert name not in out
-
-        if home:
-            if home == "pwd":
-                home = os.getcwd()
-            home = f"--home {home}"
-        else:
-            home = ""
-
-        if gpu is None:
-            gpu_visible_devices = ""
-        else:
-            gpu_visible_devices = f"CUDA_VISIBLE_DEVICES={gpu} "
-
         _image = self.find_image(image)
         path = _image["path"]
-        banner(f"Start {name} {path} {home}")
+        banner(f"Start {name} {path} {home or ''}")
 
-        command = (
-            gpu_visible_devices + f"apptainer instance start --nv {home} {path} {name}"
+        command = self._command(
+            self._start_command(name, path, home=home, options=options),
+            env=self._gpu_env(gpu),
         )
-        if options:
-            command += " " + " ".join(options)
+        stdout, stderr = "", ""
         if dryrun:
             print("DRYRUN:", command)
         else:
             banner(command)
-            stdout, stderr = self.system(name=name, command=command, register=True)
+            try:
+                stdout, stderr = self.system(
+                    name=name, command=command, register=True
+                )
+            finally:
+                self.invalidate()
         return stdout, stderr
 
+    def start_many(self, specs, max_workers=8, clean=True, dryrun=False):
+        """
+        Starts many instances in parallel.
+
+        The running instances are listed once before and once after the
+        launch instead of once per instance. Instances with the same name
+        that are already running are stopped first if clean is True.
+
+        Args:
+            specs (list): A list of dicts with the keys name and image and
+                optionally gpu, home, and options, or of (name, image) tuples.
+            max_workers (int): The maximum number of instances started at
+                the same time.
+            clean (bool): Stop running instances with the same name first.
+            dryrun (bool): Only return the commands.
+
+        Returns:
+            list: A dict per instance with the keys name, image, status,
+                seconds, stdout, and stderr. The status is one of started,
+                failed, or dryrun.
+        """
+        specs = [
+            dict(spec) if isinstance(spec, dict) else dict(zip(["name", "image"], spec))
+            for spec in specs
+        ]
+        for spec in specs:
+            if spec.get("name") is None:
+                raise ValueError("Name of the instance must be specified")
+            if spec.get("image") is None:
+                raise ValueError("Image of the instance must be specified")
+
+        if clean and not dryrun:
+            running = {i["instance"] for i in self.info()["instances"]}
+            existing = [spec["name"] for spec in specs if spec["name"] in running]
+            if existing:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    list(
+                        executor.map(
+                            lambda name: self.system(
+                                name="stop",
+                                command=self._command(self._stop_command(name)),
+                            ),
+                            existing,
+                        )
+                    )
+                self.invalidate()
+
+        def launch(spec):
+            start = time.perf_counter()
+            result = {"name": spec["name"], "image": spec["image"]}
+            try:
+                path = self.find_image(spec["image"])["path"]
+                command = self._command(
+                    self._start_command(
+                        spec["name"],
+                        path,
+                        home=spec.get("home"),
+                        options=spec.get("options"),
+                    ),
+                    env=self._gpu_env(spec.get("gpu")),
+                )
+                if dryrun:
+                    result.update(status="dryrun", stdout=command, stderr="")
+                else:
+                    stdout, stderr = self.system(
+                        name=spec["name"], command=command, register=True
+                    )
+                    result.update(status="started", stdout=stdout, stderr=stderr)
+            except Exception as e:
+                result.update(status="failed", stdout="", stderr=str(e))
+            result["seconds"] = round(time.perf_counter() - start, 3)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(launch, specs))
+
+        if not dryrun:
+            self.invalidate()
+            running = {i["instance"] for i in self.info()["instances"]}
+            for result in results:
+                if result["status"] == "started" and result["name"] not in running:
+                    result["status"] = "failed"
+        return results
+
     def stop(self, name=None, force=False, signal=None, timeout=10, user=None):
         """
         Stops the instances.
@@ -386,29 +1082,182 @@ class Apptainer:
             tuple: A tuple containing the stdout and stderr of the command.
         """
 
-        command = "apptainer instance stop"
-
-        if name == "all":
-            command += " --all"
-        else:
-            if force:
-                command += " --force"
-            if signal:
-                command += f" --signal {signal}"
-            if timeout:
-                command += f" --timeout {timeout}"
-            if user:
-                command += f" --user {user}"
-            if name == "all":
-                command += " --all"
-            else:
-                command += f" {name}"
+        command = self._command(
+            self._stop_command(
+                name, force=force, signal=signal, timeout=timeout, user=user
+            )
+        )
         banner(command)
-        stdout, stderr = self.system(name="stop", command=command, register=False)
+        try:
+            stdout, stderr = self.system(name="stop", command=command, register=False)
+        finally:
+            self.invalidate()
         return stdout, stderr
 
+    def _select(self, names=None):
+        """
+        Selects running instances by name or fnmatch pattern.
+
+        Args:
+            names (list or str): Instance names or patterns such as "tf*".
+                A string is split at commas. None selects all running
+                instances.
+
+        Returns:
+            tuple: The names of the selected running instances and the
+                names without a pattern that are not running.
+        """
+        running = [i["instance"] for i in self.info()["instances"]]
+        if names is None:
+            patterns = ["*"]
+        elif isinstance(names, str):
+            patterns = names.split(",")
+        else:
+            patterns = list(names)
+        selected = [
+            name
+            for name in running
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+        ]
+        missing = [
+            pattern
+            for pattern in patterns
+            if pattern not in running and not any(c in pattern for c in "*?[")
+        ]
+        return selected, missing
+
+    def stop_many(
+        self,
+        names=None,
+        max_workers=8,
+        timeout=10,
+        force=True,
+        signal=None,
+        grace=5,
+        deadline=None,
+    ):
+        """
+        Stops many instances in parallel.
+
+        The stops are issued concurrently by up to max_workers threads.
+        Each stop is given timeout + grace seconds from the moment it
+        starts, so stops waiting for a free worker are not counted as
+        timed out. Once all stops finished, the instances that are still
+        running are stopped with --force if force is True.
+
+        Args:
+            names (list or str): Instance names or fnmatch patterns such as
+                "tf*". A string is split at commas. None selects all
+                running instances.
+            max_workers (int): The maximum number of stops at the same time.
+            timeout (int): Seconds apptainer waits before it kills an instance.
+            force (bool): Force stop the instances left after the stops.
+            signal (str): Signal to send to the instances.
+            grace (int): Seconds added to the timeout of each stop.
+            deadline (float): Seconds after which the stops that did not
+                start yet are cancelled. If None all stops are run.
+
+        Returns:
+            list: A dict per instance with the keys name, status, seconds,
+                stdout, and stderr. The status is one of stopped, killed
+                (stopped by the --force pass), timeout, failed, not started
+                (the stop was cancelled by the deadline before it ran), or
+                not found.
+        """
+        selected, missing = self._select(names)
+        results = {
+            name: {
+                "name": name,
+                "status": "not found",
+                "seconds": 0.0,
+                "stdout": "",
+                "stderr": "",
+            }
+            for name in missing
+        }
+
+        started = time.perf_counter()
+
+        def stop(name, force=False):
+            start = time.perf_counter()
+            command = self._command(
+                self._stop_command(name, force=force, signal=signal, timeout=timeout)
+            )
+            try:
+                stdout, stderr = self.system(
+                    name="stop", command=command, timeout=(timeout or 0) + grace
+                )
+                expired = False
+            except ApptainerTimeout as e:
+                stdout, stderr, expired = e.stdout, e.stderr, True
+            finally:
+                self.invalidate()
+            return {
+                "name": name,
+                "stdout": stdout,
+                "stderr": stderr,
+                "seconds": round(time.perf_counter() - start, 3),
+                "expired": expired,
+            }
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {executor.submit(stop, name): name for name in selected}
+        try:
+            wait(futures, timeout=deadline)
+        finally:
+            # stops that did not start yet are cancelled, the running ones
+            # end within their own timeout; shutdown(cancel_futures=True)
+            # needs Python 3.9
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+        for future, name in futures.items():
+            if future.cancelled():
+                results[name] = {
+                    "name": name,
+                    "status": "not started",
+                    "seconds": 0.0,
+                    "stdout": "",
+                    "stderr": "",
+                }
+                continue
+            result = future.result()
+            result["status"] = "timeout" if result.pop("expired") else "stopped"
+            results[name] = result
+
+        remaining = {i["instance"] for i in self.info(fresh=True)["instances"]}
+        leftover = [name for name in selected if name in remaining]
+        if force and leftover:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for result in executor.map(lambda n: stop(n, force=True), leftover):
+                    result.pop("expired")
+                    results[result["name"]].update(
+                        status="killed",
+                        stdout=results[result["name"]]["stdout"] + result["stdout"],
+                        stderr=results[result["name"]]["stderr"] + result["stderr"],
+                        seconds=round(time.perf_counter() - started, 3),
+                    )
+            remaining = {i["instance"] for i in self.info(fresh=True)["instances"]}
+        for name in selected:
+            if name in remaining and results[name]["status"] not in [
+                "timeout",
+                "not started",
+            ]:
+                results[name]["status"] = "failed"
+        return [results[name] for name in selected] + [
+            result for name, result in results.items() if name not in selected
+        ]
+
     def exec(
-        self, name=None, command=None, bind=None, nv=False, home=None, verbose=False
+        self,
+        name=None,
+        command=None,
+        bind=None,
+        nv=False,
+        home=None,
+        verbose=False,
+        stream=False,
+        callback=None,
     ):
         """
         Execute a command in a container with optional bind paths, Nvidia support,
@@ -425,9 +1274,13 @@ class Apptainer:
                 Multiple bind paths can be given by a comma separated list.
             nv (bool): A boolean to enable or disable Nvidia support.
             home (str): A string specifying the home directory.
+            stream (bool): Return a generator of (stream, line) tuples that
+                yields the output while the command runs. See stream().
+            callback (function): Call callback(stream, line) for every line
+                of output instead of collecting it. See system().
 
         Returns:
-            stdout, stderr
+            stdout, stderr, or a generator if stream is True
 
         Raises:
             None
@@ -449,32 +1302,93 @@ class Apptainer:
             raise ValueError("Name of the instance must be specified")
         if command is None:
             raise ValueError("Command to execute must be specified")
-        # Construct the command
-        cmd = f"apptainer exec"
-
-        # Add Nvidia support
-        if nv:
-            cmd += " --nv"
-        
-        
-        cmd += f" instance://{name} {command}"
-
-        # Add bind paths
-        if bind:
-            for b in bind:
-                cmd += f" --bind {b['src']}:{b.get('dest', b['src'])}:{b.get('opts', 'rw')}"
-
-
-        # Add home directory
-        if home:
-            cmd += f" --home {home}"
+        cmd = self._command(
+            self._exec_command(name, command, bind=bind, nv=nv, home=home)
+        )
         if verbose:
             print(cmd)
         print(cmd)
 
-        stdout, stderr = self.system(name="exec", command=cmd, register=False)
+        if stream:
+            return self.stream(command=cmd)
+        stdout, stderr = self.system(
+            name="exec", command=cmd, register=False, callback=callback
+        )
         return stdout, stderr
 
+    def exec_many(
+        self,
+        names=None,
+        command=None,
+        max_workers=8,
+        bind=None,
+        nv=False,
+        home=None,
+        timeout=None,
+    ):
+        """
+        Executes the same command in many instances in parallel.
+
+        Args:
+            names (list or str): Instance names or fnmatch patterns such as
+                "tf*". A string is split at commas. None selects all
+                running instances.
+            command (str or list): The command to execute.
+            max_workers (int): The maximum number of commands run at the
+                same time.
+            bind (list): Bind paths as in exec().
+            nv (bool): Enable Nvidia support.
+            home (str): The home directory.
+            timeout (float): Seconds to wait for the command in each
+                instance. If None the timeout of apptainer is used.
+
+        Returns:
+            list: A dict per instance with the keys name, status, returncode,
+                seconds, stdout, and stderr. The status is one of ok,
+                failed, timeout, or not found.
+        """
+        if command is None:
+            raise ValueError("Command to execute must be specified")
+        selected, missing = self._select(names)
+
+        def run(name):
+            start = time.perf_counter()
+            cmd = self._command(
+                self._exec_command(name, command, bind=bind, nv=nv, home=home)
+            )
+            result = {"name": name}
+            try:
+                returncode, stdout, stderr = self._run(
+                    cmd, name="exec", timeout=timeout
+                )
+                status = "ok" if returncode == 0 else "failed"
+            except ApptainerTimeout as e:
+                returncode, stdout, stderr, status = None, e.stdout, e.stderr, "timeout"
+            except Exception as e:
+                returncode, stdout, stderr, status = None, "", str(e), "failed"
+            result.update(
+                status=status,
+                returncode=returncode,
+                seconds=round(time.perf_counter() - start, 3),
+                stdout=stdout or "",
+                stderr=stderr or "",
+            )
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(run, selected))
+        return results + [
+            {
+                "name": name,
+                "status": "not found",
+                "returncode": None,
+                "seconds": 0.0,
+                "stdout": "",
+                "stderr": "",
+            }
+            for name in missing
+        ]
+
     def shell(self, name):
         """
         Open a shell in the specified instance.
@@ -489,44 +1403,283 @@ class Apptainer:
         stdout, stderr = self.system(command=command)
         return stdout, stderr
 
-    def download(self, name=None, url=None):
+    @staticmethod
+    def _current(name, digest=None):
+        """
+        Checks if an image exists, is a complete SIF image, and has the
+        expected digest.
+        """
+        if not is_sif(name):
+            return False
+        return digest is None or file_digest(name) == digest
+
+    def _pull(self, name, url, digest=None, interactive=False):
+        """
+        Pulls an image atomically.
+
+        The image is pulled into the hidden file .NAME.partial in the
+        directory of the image. It is renamed to NAME only if it is a
+        complete SIF image with the expected digest, so an interrupted or
+        failed pull never leaves a truncated image under NAME. A verified
+        partial file left by an interrupted earlier call is renamed
+        without pulling again; the layers of a docker image that were
+        already downloaded are reused from the apptainer cache.
+
+        Args:
+            name (str): The image file.
+            url (str): The URL of the image.
+            digest (str): The expected digest in the form sha256:<hex>.
+            interactive (bool): Show the progress of the pull.
+
+        Returns:
+            tuple: The status (pulled or failed) and the error output.
+        """
+        directory, filename = os.path.split(os.path.abspath(name))
+        partial = os.path.join(directory, f".{filename}.partial")
+        stderr = ""
+        if not (digest and self._current(partial, digest)):
+            command = self._command(["apptainer", "pull", "--force", partial, url])
+            try:
+                with PullMarker(url):
+                    if interactive:
+                        returncode = os.system(command)
+                    else:
+                        returncode, stdout, stderr = self._run(command, name="pull")
+            except ApptainerError as e:
+                returncode, stderr = -1, str(e)
+            if returncode != 0:
+                error = stderr or f"apptainer pull {url} failed"
+            elif not is_sif(partial):
+                error = f"{url} did not produce a complete SIF image"
+            elif digest and file_digest(partial) != digest:
+                error = f"{url} does not have the digest {digest}"
+            else:
+                error = None
+            if error is not None:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                return "failed", error
+        os.replace(partial, name)
+        return "pulled", stderr
+
+    def download(self, name=None, url=None, digest=None):
         """
         Downloads an image from a URL.
 
+        The image is pulled into a temporary file and only renamed to name
+        once it is verified, see _pull. An existing image is kept if it is
+        a complete SIF image with the expected digest.
+
         Args:
             name (str): Name of the image.
             url (str): URL of the image.
+            digest (str): The expected digest in the form sha256:<hex>.
 
         Returns:
             None
+
+        Raises:
+            ApptainerError: If the image could not be pulled or verified.
+            ValueError: If the host is reached with a remote transport.
         """
-        command = f"apptainer pull {name} {url}"
-        if not os.path.exists(name):
-            r = os.system(command)
-            self.save()
-        else:
+        self._local_files("download")
+        if self._current(name, digest):
             Console.warning(f"Image {name} already exists")
-        assert r == 0
+            return
+        status, stderr = self._pull(name, url, digest=digest, interactive=True)
+        if status != "pulled":
+            raise ApptainerError(stderr, command=f"apptainer pull {name} {url}")
+        self.catalog.add(name)
+        self.images = self.catalog.images()
+        self.save()
 
-    def delete(self, name):
+    def download_many(self, images, max_workers=4):
         """
-        Deletes the specified instance.
+        Downloads many images in parallel.
+
+        Each URL is pulled only once and verified as in download(). Further
+        images with the same URL are hard linked to the first one, or
+        copied if a link is not possible. Images that already exist as
+        complete SIF images with the expected digest are skipped. The
+        catalog and database are updated once at the end.
 
         Args:
-            name (str): Name of the instance.
+            images (list): (name, url) or (name, url, digest) tuples or
+                dicts with the keys name, url, and optionally digest, e.g.
+                as returned by read_manifest().
+            max_workers (int): The maximum number of pulls at the same time.
+                Keep it small to not saturate the network.
 
         Returns:
-            tuple: A tuple containing the stdout and stderr of the command.
+            list: A dict per image with the keys name, url, status, seconds,
+                and stderr. The status is one of pulled, linked, exists, or
+                failed.
+
+        Raises:
+            ValueError: If the host is reached with a remote transport.
         """
-        r = Shell.rm(name)
-        self.load_location_from_db()
-        return r
+        self._local_files("download_many")
+        images = [
+            (
+                dict(image)
+                if isinstance(image, dict)
+                else dict(zip(["name", "url", "digest"], image))
+            )
+            for image in images
+        ]
+        results = {}
+        urls = {}
+        digests = {}
+        for image in images:
+            name = image["name"]
+            if name in results:
+                continue
+            results[name] = {"name": name, "url": image["url"], "seconds": 0.0}
+            if image.get("digest"):
+                digests.setdefault(image["url"], image["digest"])
+            if self._current(name, image.get("digest")):
+                results[name].update(status="exists", stderr="")
+            else:
+                urls.setdefault(image["url"], []).append(name)
+
+        def pull(url):
+            start = time.perf_counter()
+            status, stderr = self._pull(urls[url][0], url, digest=digests.get(url))
+            return url, status, stderr, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for url, status, stderr, seconds in executor.map(pull, list(urls)):
+                first, *others = urls[url]
+                results[first].update(
+                    status=status, stderr=stderr, seconds=round(seconds, 3)
+                )
+                for name in others:
+                    start = time.perf_counter()
+                    if status != "pulled":
+                        results[name].update(status="failed", stderr=stderr)
+                        continue
+                    tmp = f"{name}.partial"
+                    try:
+                        try:
+                            os.link(first, tmp)
+                        except OSError:
+                            shutil.copy2(first, tmp)
+                        os.replace(tmp, name)
+                        results[name].update(status="linked", stderr="")
+                    except OSError as e:
+                        results[name].update(status="failed", stderr=str(e))
+                    results[name]["seconds"] = round(time.perf_counter() - start, 3)
+
+        with self.batch():
+            for result in results.values():
+                if result["status"] in ["pulled", "linked"]:
+                    self.catalog.add(result["name"])
+            self.images = self.catalog.images()
+            self.save()
+        return list(results.values())
 
+    def dedup(self, mode="hardlink", dry_run=False):
+        """
+        Replaces copies of the same image in the locations by links.
 
-def main():
-    arguments = " ".join(sys.argv[1:])
-    os.system(f"cms apptainer {arguments}")
+        All locations are listed again and the digests of new or changed
+        images are computed. For every group of identical images the
+        copies are replaced by hard links to the first one, or by
+        symbolic links if mode is symlink or the copy is on another file
+        system. Every file is checked again right before it is linked, so
+        an image that was rewritten is never replaced.
 
+        Args:
+            mode (str): hardlink or symlink.
+            dry_run (bool): Only report what would be linked.
+
+        Returns:
+            list: A dict per replaced copy with the keys path, target, mode,
+                bytes, and digest.
+
+        Raises:
+            ValueError: If the host is reached with a remote transport.
+        """
+        self._local_files("dedup")
+        self.catalog.refresh(self.location, force=True)
+        self.catalog.hash()
+        result = []
+        for digest, paths in self.catalog.duplicates().items():
+            for entry in deduplicate(
+                paths,
+                mode=mode,
+                dry_run=dry_run,
+                digest=digest,
+                verify=self.catalog.verify,
+            ):
+                entry["digest"] = digest
+                result.append(entry)
+        if not dry_run:
+            self.catalog.refresh(self.location, force=True)
+        self.images = self.catalog.images()
+        self.save()
+        return result
+
+    def delete(self, name):
+        """
+        Deletes the specified instance.
+
+        Args:
+            name (str): Name of the instance.
 
-if __name__ == "__main__":
-    main()
+        Returns:
+            None
+        """
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+        self.catalog.remove(name)
+        self.images = self.catalog.images()
+
+
+def read_manifest(filename):
+    """
+    Reads the images to be downloaded from a manifest.
+
+    A manifest ending in .yaml or .yml is either a mapping from the name
+    to the URL or a list of dicts with the keys name, url, and optionally
+    digest. Any other file has one image per line in the form
+    NAME URL [DIGEST]; empty lines and lines starting with # are ignored.
+    Names without the extension .sif get it appended.
+
+    Args:
+        filename (str): The manifest.
+
+    Returns:
+        list: Dicts with the keys name, url, and digest (None if not given).
+    """
+    with open(filename) as f:
+        content = f.read()
+    if os.path.splitext(filename)[1] in [".yaml", ".yml"]:
+        data = yaml.safe_load(content) or []
+        if isinstance(data, dict):
+            data = [{"name": name, "url": url} for name, url in data.items()]
+        images = [
+            {
+                "name": str(image["name"]),
+                "url": image["url"],
+                "digest": image.get("digest"),
+            }
+            for image in data
+        ]
+    else:
+        images = []
+        for number, line in enumerate(content.splitlines(), start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split()
+            if len(fields) not in [2, 3]:
+                raise ValueError(f"{filename}:{number}: expected NAME URL [DIGEST]")
+            fields.append(None)
+            images.append({"name": fields[0], "url": fields[1], "digest": fields[2]})
+    for image in images:
+        if not image["name"].endswith(".sif"):
+            image["name"] += ".sif"
+    return images
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import os
+import shlex
+
+from cloudmesh.common.util import banner
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.apptainer import ApptainerCancelled
+from cloudmesh.apptainer.apptainer import ApptainerTimeout
+
+
+class AsyncApptainer:
+    """
+    Asyncio version of the instance operations of Apptainer.
+
+    The methods system, info, list, start, stop, and exec are coroutines
+    with the same arguments and return values as their Apptainer
+    counterparts. The commands are run with asyncio.create_subprocess_exec,
+    so many operations can be awaited concurrently from one event loop.
+    The database, image catalog, and command construction are shared with
+    the wrapped Apptainer object.
+
+    As in Apptainer.system(), every command runs in its own process group.
+    If it does not finish within its timeout, or if the coroutine is
+    cancelled, the whole group is killed. Apptainer.cancel() of the wrapped
+    object also cancels the commands of this object. For a remote host
+    only the local ssh client is killed, not the remote command.
+
+    Example:
+        app = AsyncApptainer()
+        results = await asyncio.gather(
+            *[app.exec(name=name, command="hostname") for name in names]
+        )
+    """
+
+    def __init__(self, apptainer=None, max_concurrency=None):
+        """
+        Args:
+            apptainer (Apptainer): The object to share the database with.
+                A new one is created if None.
+            max_concurrency (int): The maximum number of commands running
+                at the same time. Unlimited if None.
+        """
+        self.apptainer = apptainer or Apptainer()
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    def __getattr__(self, name):
+        return getattr(self.apptainer, name)
+
+    def _limit(self):
+        if self._semaphore is None and self.max_concurrency:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def system(
+        self,
+        command=None,
+        name=None,
+        verbose=False,
+        env=None,
+        timeout=None,
+        register=False,
+    ):
+        """
+        Runs a command.
+
+        Args:
+            command (str or list): Command to run. A string is split with
+                shlex, so it is not interpreted by a shell.
+            verbose (bool): Print the command before executing.
+            env (dict): Variables added to the environment of the command.
+                On another host they are set on the command line.
+            timeout (float): Seconds to wait for the command. If None the
+                timeout of the wrapped Apptainer is used; if that is None
+                there is no limit.
+            register (bool): Record the process in the process table of the
+                wrapped Apptainer, see Apptainer.ps().
+
+        Returns:
+            tuple: A tuple containing the stdout and stderr of the command.
+
+        Raises:
+            ApptainerTimeout: If the command did not finish in time.
+            ApptainerCancelled: If the call was cancelled with cancel().
+        """
+        if isinstance(command, str):
+            command = shlex.split(command)
+        if verbose:
+            print(shlex.join(command))
+        environment = None
+        transport = self.apptainer.transport
+        if not transport.local:
+            command = transport.wrap(Apptainer._command(command, env=env))[0]
+        elif env:
+            environment = dict(os.environ)
+            environment.update(env)
+        timeout = self.apptainer.timeout if timeout is None else timeout
+        semaphore = self._limit()
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=None if transport.local else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=environment,
+                start_new_session=True,
+            )
+            if register:
+                self.apptainer.processes.register(
+                    process, name=name, command=shlex.join(command)
+                )
+            stdout, stderr, expired, cancelled = await self._communicate(
+                process, name=name, timeout=timeout, register=register
+            )
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+        stdout = stdout.decode(errors="replace")
+        stderr = stderr.decode(errors="replace")
+        line = shlex.join(command)
+        if expired:
+            raise ApptainerTimeout(
+                f"Command did not finish within {timeout} seconds: {line}",
+                command=line,
+                stdout=stdout,
+                stderr=stderr,
+            )
+        if cancelled:
+            raise ApptainerCancelled(
+                f"Command was cancelled: {line}",
+                command=line,
+                stdout=stdout,
+                stderr=stderr,
+            )
+        return stdout, stderr
+
+    async def _communicate(self, process, name=None, timeout=None, register=False):
+        """
+        Collects the output of a process and kills its process group on a
+        timeout or if the coroutine is cancelled.
+
+        Returns:
+            tuple: stdout, stderr, whether the timeout expired, and whether
+                the call was cancelled with Apptainer.cancel().
+        """
+        app = self.apptainer
+        with app._lock:
+            app._running[process.pid] = {"name": name, "process": process}
+        # the output is read by its own task, so it is kept on a timeout
+        reading = asyncio.ensure_future(process.communicate())
+        try:
+            done, pending = await asyncio.wait({reading}, timeout=timeout)
+        except BaseException:
+            app._kill(process)
+            try:
+                await reading
+            except BaseException:
+                pass
+            app._finish(process, register=register)
+            raise
+        expired = bool(pending)
+        if expired:
+            app._kill(process)
+        stdout, stderr = await reading
+        return stdout, stderr, expired, app._finish(process, register=register)
+
+    async def info(self, logs=False, verbose=False, native=True):
+        """
+        Lists the instances.
+
+        Args:
+            native (bool): Read the instance files of apptainer if possible.
+
+        Returns:
+            dict: A dictionary containing the stdout as a dictionary.
+        """
+        instances = None
+        if native and self.apptainer.transport.local:
+            instances = self.apptainer.instance_files.list()
+        if instances is not None:
+            output_dict = {"instances": instances}
+        else:
+            command = Apptainer._info_command(logs=logs)
+            if verbose:
+                banner(shlex.join(command))
+            stdout, stderr = await self.system(command=command)
+            output_dict = json.loads(stdout)
+        self.apptainer.instances = output_dict["instances"]
+        self.apptainer.save()
+        return output_dict
+
+    async def list(self, output=None, verbose=False, native=True):
+        """
+        Lists the instances.
+
+        Returns:
+            list: The instances.
+        """
+        return (await self.info(verbose=verbose, native=native))["instances"]
+
+    async def start(
+        self,
+        name=None,
+        image=None,
+        gpu=None,
+        home=None,
+        clean=True,
+        options=None,
+        dryrun=False,
+    ):
+        """
+        Starts an instance.
+
+        Returns:
+            tuple: A tuple containing the stdout and stderr of the command.
+        """
+        if name is None:
+            raise ValueError("Name of the instance must be specified")
+        if image is None:
+            raise ValueError("Image of the instance must be specified")
+        if clean:
+            await self.stop(name=name)
+        path = self.apptainer.find_image(image)["path"]
+        command = Apptainer._start_command(name, path, home=home, options=options)
+        env = Apptainer._gpu_env(gpu)
+        if dryrun:
+            print("DRYRUN:", Apptainer._command(command, env=env))
+            return "", ""
+        try:
+            return await self.system(
+                name=name, command=command, env=env, register=True
+            )
+        finally:
+            self.apptainer.invalidate()
+
+    async def stop(self, name=None, force=False, signal=None, timeout=10, user=None):
+        """
+        Stops the instances.
+
+        Returns:
+            tuple: A tuple containing the stdout and stderr of the command.
+        """
+        command = Apptainer._stop_command(
+            name, force=force, signal=signal, timeout=timeout, user=user
+        )
+        try:
+            return await self.system(name="stop", command=command)
+        finally:
+            self.apptainer.invalidate()
+
+    async def exec(
+        self, name=None, command=None, bind=None, nv=False, home=None, verbose=False
+    ):
+        """
+        Executes a command in an instance.
+
+        Returns:
+            tuple: A tuple containing the stdout and stderr of the command.
+        """
+        if name is None:
+            raise ValueError("Name of the instance must be specified")
+        if command is None:
+            raise ValueError("Command to execute must be specified")
+        command = Apptainer._exec_command(name, command, bind=bind, nv=nv, home=home)
+        return await self.system(name="exec", command=command, verbose=verbose)
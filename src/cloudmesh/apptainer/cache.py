@@ -0,0 +1,382 @@
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudmesh.common.util import path_expand
+
+from cloudmesh.apptainer.process import _alive
+from cloudmesh.apptainer.process import _hostname
+from cloudmesh.apptainer.process import _ticks
+
+# the subdirectories of the cache holding container files; the OCI blobs
+# are kept in blob/blobs/sha256
+CONTAINER_CATEGORIES = ["library", "oci-tmp", "oci-sif", "shub", "oras", "net"]
+BLOB_CATEGORY = "blob"
+CATEGORIES = [BLOB_CATEGORY] + CONTAINER_CATEGORIES
+
+
+def cache_directory():
+    """
+    Returns the cache directory used by apptainer.
+
+    It is $APPTAINER_CACHEDIR/cache, $SINGULARITY_CACHEDIR/cache, or
+    ~/.apptainer/cache.
+
+    Returns:
+        str: The directory.
+    """
+    root = os.environ.get("APPTAINER_CACHEDIR") or os.environ.get(
+        "SINGULARITY_CACHEDIR"
+    )
+    if not root:
+        root = os.path.join(os.path.expanduser("~"), ".apptainer")
+    return os.path.join(root, "cache")
+
+
+UNITS = {"": 1, "k": 10**3, "m": 10**6, "g": 10**9, "t": 10**12}
+
+
+def parse_size(size):
+    """
+    Converts a size such as 500M, 10GB, or 1.5GiB to bytes.
+
+    The units K, M, G, and T are powers of 1000; with a trailing iB they
+    are powers of 1024.
+
+    Args:
+        size (str or int): The size.
+
+    Returns:
+        int: The number of bytes.
+    """
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)(i?)b?\s*", str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"invalid size {size}")
+    number, unit, binary = match.groups()
+    unit = unit.lower()
+    factor = 1024 ** list(UNITS).index(unit) if binary else UNITS[unit]
+    return int(float(number) * factor)
+
+
+def _boot_time():
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("btime"):
+                return int(line.split()[1])
+    return None
+
+
+def _running_pulls():
+    """
+    Returns the start times of the apptainer pull and build commands that
+    are running on this host, found in /proc.
+    """
+    try:
+        btime = _boot_time()
+        pids = [pid for pid in os.listdir("/proc") if pid.isdigit()]
+    except OSError:
+        return []
+    if btime is None:
+        return []
+    tick = os.sysconf("SC_CLK_TCK")
+    started = []
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                arguments = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            continue
+        if not arguments or os.path.basename(arguments[0]) not in [
+            "apptainer",
+            "singularity",
+        ]:
+            continue
+        if "pull" not in arguments and "build" not in arguments:
+            continue
+        ticks = _ticks(pid)
+        if ticks is not None:
+            started.append(btime + ticks / tick)
+    return started
+
+
+class PullMarker:
+    """
+    Marks a pull as in progress while the block runs.
+
+    A JSON file with the pid, the hostname, the start time, and the URL is
+    kept in the directory ~/.cloudmesh/apptainer/pulls. CacheInspector.prune()
+    does not remove cache entries a running pull may use. Markers of
+    processes on this host that are gone are ignored and removed by
+    active_pulls(). The directory may be shared by several hosts, whose
+    processes can not be checked here; their markers count as active
+    until they are older than MAX_AGE seconds and are removed after that.
+
+    Example:
+        with PullMarker(url):
+            os.system(f"apptainer pull {name} {url}")
+    """
+
+    DIRECTORY = "~/.cloudmesh/apptainer/pulls"
+    MAX_AGE = 24 * 3600
+
+    def __init__(self, url=None, directory=None):
+        self.url = url
+        self.directory = path_expand(directory or self.DIRECTORY)
+        self.filename = None
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        pid = os.getpid()
+        self.filename = os.path.join(self.directory, f"{pid}-{time.time_ns()}.json")
+        with open(self.filename, "w") as f:
+            marker = {
+                "pid": pid,
+                "hostname": _hostname(),
+                "ticks": _ticks(pid),
+                "start": time.time(),
+                "url": self.url,
+            }
+            json.dump(marker, f)
+        return self
+
+    def __exit__(self, *args):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+def active_pulls(directory=None):
+    """
+    Returns the start times of the pulls in progress.
+
+    Both the PullMarker files and the apptainer pull and build commands
+    found in /proc are considered. Only the markers of this host are
+    checked against its processes; those of other hosts sharing the
+    directory are active until they are older than PullMarker.MAX_AGE.
+
+    Args:
+        directory (str): The marker directory. If None the default one.
+
+    Returns:
+        list: The start times in seconds since the epoch.
+    """
+    directory = path_expand(directory or PullMarker.DIRECTORY)
+    hostname = _hostname()
+    started = _running_pulls()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        names = []
+    for name in names:
+        filename = os.path.join(directory, name)
+        try:
+            with open(filename) as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if marker.get("hostname", hostname) != hostname:
+            alive = time.time() - marker["start"] < PullMarker.MAX_AGE
+        else:
+            alive = _alive(marker["pid"], marker.get("ticks"))
+        if alive:
+            started.append(marker["start"])
+        else:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+    return started
+
+
+def _usage(entry):
+    """
+    Returns the bytes, last access time, and last modification time of a
+    file or of all files below a directory.
+    """
+    stat = entry.stat(follow_symlinks=False)
+    if not entry.is_dir(follow_symlinks=False):
+        return stat.st_size, stat.st_atime, stat.st_mtime
+    size, atime, mtime = 0, stat.st_atime, stat.st_mtime
+    try:
+        children = os.scandir(entry.path)
+    except OSError:
+        return size, atime, mtime
+    with children:
+        for child in children:
+            child_size, child_atime, child_mtime = _usage(child)
+            size += child_size
+            atime = max(atime, child_atime)
+            mtime = max(mtime, child_mtime)
+    return size, atime, mtime
+
+
+class CacheInspector:
+    """
+    Accounts the space used by the apptainer cache.
+
+    The cache directory is walked with os.scandir instead of parsing the
+    output of apptainer cache list. Every OCI blob and every container
+    file (a file or directory directly below library, oci-tmp, oci-sif,
+    shub, oras, or net) is an entry with its exact size in bytes and the
+    latest access and modification time of its files. The entries are
+    measured in parallel.
+    """
+
+    def __init__(self, directory=None, max_workers=8):
+        """
+        Args:
+            directory (str): The cache directory. If None cache_directory().
+            max_workers (int): The number of directories walked at the same time.
+        """
+        self.directory = directory or cache_directory()
+        self.max_workers = max_workers
+
+    def _scan(self, category):
+        directory = os.path.join(self.directory, category)
+        if category == BLOB_CATEGORY:
+            directory = os.path.join(directory, "blobs", "sha256")
+        try:
+            with os.scandir(directory) as scan:
+                return [(category, entry) for entry in scan]
+        except OSError:
+            return []
+
+    @staticmethod
+    def _entry(item):
+        category, entry = item
+        try:
+            size, atime, mtime = _usage(entry)
+        except OSError:
+            return None
+        return {
+            "category": category,
+            "name": entry.name,
+            "path": entry.path,
+            "bytes": size,
+            "atime": atime,
+            "mtime": mtime,
+        }
+
+    def entries(self):
+        """
+        Lists the entries of the cache.
+
+        The category directories are listed first; the entries are then
+        measured in parallel, so large container directories in oci-tmp
+        or library are walked at the same time.
+
+        Returns:
+            list: Dicts with the keys category, name, path, bytes, atime,
+                and mtime ordered by category and name.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            items = [
+                item for items in executor.map(self._scan, CATEGORIES) for item in items
+            ]
+            entries = [
+                entry for entry in executor.map(self._entry, items) if entry is not None
+            ]
+        order = {category: i for i, category in enumerate(CATEGORIES)}
+        return sorted(entries, key=lambda e: (order[e["category"]], e["name"]))
+
+    def summary(self, entries=None):
+        """
+        Sums up the entries of the cache.
+
+        Args:
+            entries (list): The entries. If None they are listed.
+
+        Returns:
+            dict: The keys directory, categories ({category: {"files": n,
+                "bytes": n}}), container_files, container_bytes,
+                blob_files, blob_bytes, and total_bytes.
+        """
+        if entries is None:
+            entries = self.entries()
+        categories = {category: {"files": 0, "bytes": 0} for category in CATEGORIES}
+        for entry in entries:
+            categories[entry["category"]]["files"] += 1
+            categories[entry["category"]]["bytes"] += entry["bytes"]
+        blob = categories[BLOB_CATEGORY]
+        container_files = sum(
+            categories[category]["files"] for category in CONTAINER_CATEGORIES
+        )
+        container_bytes = sum(
+            categories[category]["bytes"] for category in CONTAINER_CATEGORIES
+        )
+        return {
+            "directory": self.directory,
+            "categories": categories,
+            "container_files": container_files,
+            "container_bytes": container_bytes,
+            "blob_files": blob["files"],
+            "blob_bytes": blob["bytes"],
+            "total_bytes": container_bytes + blob["bytes"],
+        }
+
+    def prune(self, budget, dry_run=False, pulls=None):
+        """
+        Removes the least recently used entries until the cache fits a budget.
+
+        The entries are ordered by their last use, the later of the access
+        and modification time. While a pull is in progress no OCI blob is
+        removed, as the layers of the pull may already be in the cache,
+        and no container file used since the pull started is removed.
+
+        Args:
+            budget (int or str): The maximum size of the cache, e.g. 20GB.
+            dry_run (bool): Only report what would be removed.
+            pulls (list): The start times of the pulls in progress. If None
+                active_pulls() is used.
+
+        Returns:
+            dict: The keys budget, before, after, and reclaimed in bytes,
+                dry_run, removed (the entries removed), protected (the
+                entries kept because of a pull), and failed (entries that
+                could not be removed, with an error).
+        """
+        budget = parse_size(budget)
+        pulls = active_pulls() if pulls is None else pulls
+        since = min(pulls) if pulls else None
+        entries = self.entries()
+        before = sum(entry["bytes"] for entry in entries)
+        total = before
+        removed, protected, failed = [], [], []
+        for entry in sorted(entries, key=lambda e: max(e["atime"], e["mtime"])):
+            if total <= budget:
+                break
+            if since is not None and (
+                entry["category"] == BLOB_CATEGORY
+                or max(entry["atime"], entry["mtime"]) >= since
+            ):
+                protected.append(entry)
+                continue
+            if not dry_run:
+                try:
+                    if os.path.isdir(entry["path"]) and not os.path.islink(
+                        entry["path"]
+                    ):
+                        shutil.rmtree(entry["path"])
+                    else:
+                        os.remove(entry["path"])
+                except OSError as e:
+                    failed.append(dict(entry, error=str(e)))
+                    continue
+            removed.append(entry)
+            total -= entry["bytes"]
+        return {
+            "budget": budget,
+            "before": before,
+            "after": total,
+            "reclaimed": before - total,
+            "dry_run": dry_run,
+            "removed": removed,
+            "protected": protected,
+            "failed": failed,
+        }
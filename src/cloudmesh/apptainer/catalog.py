@@ -0,0 +1,324 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import humanize
+from cloudmesh.common.util import path_expand
+
+from cloudmesh.apptainer.store import file_digest
+
+
+class ImageCatalog:
+    """
+    Incremental index of the sif images found in a list of locations.
+
+    The catalog keeps a state that records the inode, size, and mtime of
+    every location directory and every image in it. A directory is only
+    listed again if its own inode or mtime changed, so a refresh of an
+    unchanged tree costs a single stat per location. The state is a plain
+    dict so it can be stored in the apptainer database and reloaded by
+    the next invocation.
+
+    The state has the form
+
+        directories:
+          /abs/images:
+            inode: 1234
+            mtime: 1700000000000000000
+            files:
+              tf.sif: {inode: 5678, size: 1234, mtime: 1700000000000000000}
+        files:
+          /abs/more/tf.sif: {inode: 91011, size: 1234, mtime: 1700000000000000000}
+
+    If digest is True the sha256 digest of every image is added to its
+    entry as digest: sha256:<hex>. It is computed once and kept as long
+    as the inode, size, and mtime of the file do not change, so the
+    catalog doubles as a content-addressed index of the images.
+    """
+
+    def __init__(self, hostname="localhost", state=None, digest=False):
+        self.hostname = hostname
+        self.digest = digest
+        self._digests = {}
+        self.locations = []
+        self.state = {"directories": {}, "files": {}}
+        if state:
+            self.state["directories"].update(state.get("directories") or {})
+            self.state["files"].update(state.get("files") or {})
+
+    def _identity(self, stat):
+        identity = {
+            "inode": stat.st_ino,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+        digest = self._digests.get((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        if digest is not None:
+            identity["digest"] = digest
+        return identity
+
+    def _scan_directory(self, directory, stat):
+        files = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".sif"):
+                    continue
+                try:
+                    if entry.is_file():
+                        files[entry.name] = self._identity(entry.stat())
+                except OSError:
+                    pass
+        self.state["directories"][directory] = {
+            "inode": stat.st_ino,
+            "mtime": stat.st_mtime_ns,
+            "files": files,
+        }
+
+    def refresh(self, locations, force=False):
+        """
+        Brings the catalog up to date with the given locations.
+
+        Args:
+            locations (list): Directories or sif files to be indexed.
+            force (bool): List every directory even if it did not change.
+
+        Returns:
+            list: The images found in the locations.
+        """
+        self.locations = list(locations)
+        # digests of the known files, so rescanned and hard linked files
+        # with the same inode, size, and mtime are not hashed again
+        self._digests = {
+            (identity["inode"], identity["size"], identity["mtime"]): identity["digest"]
+            for path, identity in self._paths()
+            if "digest" in identity
+        }
+        directories = {}
+        files = {}
+        for entry in self.locations:
+            entry = path_expand(entry)
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                continue
+            if os.path.isdir(entry):
+                cached = self.state["directories"].get(entry)
+                if (
+                    force
+                    or cached is None
+                    or cached["inode"] != stat.st_ino
+                    or cached["mtime"] != stat.st_mtime_ns
+                ):
+                    try:
+                        self._scan_directory(entry, stat)
+                    except OSError:
+                        continue
+                directories[entry] = self.state["directories"][entry]
+            elif entry.endswith(".sif") and os.path.isfile(entry):
+                files[entry] = self._identity(stat)
+        self.state = {"directories": directories, "files": files}
+        if self.digest:
+            self.hash()
+        return self.images()
+
+    def _paths(self):
+        for directory, cached in self.state["directories"].items():
+            for name, identity in cached["files"].items():
+                yield os.path.join(directory, name), identity
+        for path, identity in self.state["files"].items():
+            yield path, identity
+
+    def hash(self, max_workers=4):
+        """
+        Computes the digests of the images that do not have one yet.
+
+        Args:
+            max_workers (int): The number of files hashed at the same time.
+
+        Returns:
+            int: The number of images hashed.
+        """
+        missing = [
+            (path, identity)
+            for path, identity in self._paths()
+            if "digest" not in identity
+        ]
+
+        def digest(item):
+            try:
+                return file_digest(item[0])
+            except OSError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for (path, identity), value in zip(missing, executor.map(digest, missing)):
+                if value is not None:
+                    identity["digest"] = value
+        return len(missing)
+
+    def verify(self, path):
+        """
+        Returns the digest of an image after checking that it is current.
+
+        The file is stat'ed again; if its inode, size, or mtime differ
+        from the catalog, e.g. because it was rewritten in place, which
+        does not change the mtime of its directory, it is hashed again
+        and the catalog entry is updated.
+
+        Args:
+            path (str): The path of the image as listed by the catalog.
+
+        Returns:
+            str: The digest or None if the file can not be read.
+        """
+        for location, identity in self._paths():
+            if location == path:
+                break
+        else:
+            identity = None
+        try:
+            stat = os.stat(path)
+            if identity is not None and "digest" in identity and (
+                identity["inode"],
+                identity["size"],
+                identity["mtime"],
+            ) == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                return identity["digest"]
+            digest = file_digest(path)
+        except OSError:
+            return None
+        if identity is not None:
+            identity.update(
+                inode=stat.st_ino,
+                size=stat.st_size,
+                mtime=stat.st_mtime_ns,
+                digest=digest,
+            )
+        return digest
+
+    def duplicates(self):
+        """
+        Groups the images with the same digest.
+
+        Returns:
+            dict: {digest: [path, ...]} for every digest shared by more
+                than one path. The paths are ordered by inode, so copies
+                that are already hard links follow each other.
+        """
+        groups = {}
+        for path, identity in self._paths():
+            if "digest" in identity:
+                groups.setdefault(identity["digest"], []).append(
+                    (identity["inode"], path)
+                )
+        return {
+            digest: [path for inode, path in sorted(paths)]
+            for digest, paths in groups.items()
+            if len(paths) > 1
+        }
+
+    def _directory_of(self, path):
+        directory = os.path.dirname(path_expand(path)) or "."
+        for entry in self.state["directories"]:
+            if os.path.abspath(entry) == os.path.abspath(directory):
+                return entry
+        return None
+
+    def _advance(self, directory):
+        """
+        Records the current mtime of a directory after add() or remove().
+
+        The mtime only changes with the names in the directory, but it can
+        not tell which change it records. It is taken only if the sif files
+        in the directory are the recorded ones; otherwise another change
+        happened since the last scan and the stale mtime makes the next
+        refresh() list the directory again.
+        """
+        cached = self.state["directories"][directory]
+        try:
+            # stat first, so a change while listing leaves the mtime stale
+            stat = os.stat(directory)
+            names = {name for name in os.listdir(directory) if name.endswith(".sif")}
+        except OSError:
+            del self.state["directories"][directory]
+            return
+        if names == set(cached["files"]):
+            cached["mtime"] = stat.st_mtime_ns
+
+    def add(self, path):
+        """
+        Records a single image without rescanning its directory.
+
+        Args:
+            path (str): The path of the sif file.
+
+        Returns:
+            None
+        """
+        path = path_expand(path)
+        if not path.endswith(".sif") or not os.path.isfile(path):
+            return
+        directory = self._directory_of(path)
+        identity = self._identity(os.stat(path))
+        if self.digest:
+            identity["digest"] = file_digest(path)
+        if directory is not None:
+            cached = self.state["directories"][directory]
+            cached["files"][os.path.basename(path)] = identity
+            self._advance(directory)
+        else:
+            for entry in self.state["files"]:
+                if os.path.abspath(entry) == os.path.abspath(path):
+                    self.state["files"][entry] = identity
+
+    def remove(self, path):
+        """
+        Removes a single image without rescanning its directory.
+
+        Args:
+            path (str): The path of the sif file.
+
+        Returns:
+            None
+        """
+        path = path_expand(path)
+        directory = self._directory_of(path)
+        if directory is not None:
+            cached = self.state["directories"][directory]
+            cached["files"].pop(os.path.basename(path), None)
+            self._advance(directory)
+        for entry in list(self.state["files"]):
+            if os.path.abspath(entry) == os.path.abspath(path):
+                del self.state["files"][entry]
+
+    def images(self):
+        """
+        Lists the images recorded in the catalog without touching the disk.
+
+        Returns:
+            list: A list of dicts with name, size, path, location and hostname,
+                and digest if it is known.
+        """
+        entries = [path_expand(entry) for entry in self.locations] or list(
+            self.state["directories"]
+        ) + list(self.state["files"])
+        result = []
+        for entry in entries:
+            if entry in self.state["directories"]:
+                files = sorted(self.state["directories"][entry]["files"].items())
+                locations = [(entry + "/" + name, identity) for name, identity in files]
+            elif entry in self.state["files"]:
+                locations = [(entry, self.state["files"][entry])]
+            else:
+                continue
+            for location, identity in locations:
+                image = {
+                    "name": os.path.basename(location),
+                    "size": humanize.naturalsize(identity["size"]),
+                    "path": os.path.abspath(location),
+                    "location": location,
+                    "hostname": self.hostname,
+                }
+                if "digest" in identity:
+                    image["digest"] = identity["digest"]
+                result.append(image)
+        return result
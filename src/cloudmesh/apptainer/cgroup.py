@@ -0,0 +1,169 @@
+import os
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _number(value):
+    value = value.strip()
+    return None if value == "max" else int(value)
+
+
+def _flat(text):
+    # cpu.stat: one "key value" pair per line
+    return {
+        key: int(value)
+        for key, value in (line.split() for line in text.splitlines() if line.strip())
+    }
+
+
+def _pairs(text):
+    # io.stat: "key=value" pairs after the device number
+    return {
+        key: int(value)
+        for key, value in (field.split("=", 1) for field in text.split())
+    }
+
+
+class CgroupStats:
+    """
+    Reads the resource usage of a process from its cgroup v2 files.
+
+    The cgroup of a pid is taken from the line 0::<path> of
+    /proc/<pid>/cgroup; the counters are read from cpu.stat,
+    memory.current, memory.max, io.stat, and pids.current in that
+    directory of /sys/fs/cgroup. No process is started, so reading the
+    counters of an instance takes microseconds instead of the time to
+    run apptainer instance stats.
+
+    The counters are only taken if the cgroup belongs to the process:
+    every process in its cgroup.procs must be the process or one of its
+    descendants. An instance started without a cgroup of its own runs in
+    a shared one, such as the session scope in user.slice or the cgroup
+    of a Slurm job, whose counters include other processes; read() raises
+    OSError for it, so callers fall back to apptainer instance stats.
+
+    The root and proc directories can point to a copy of the tree, e.g.
+    in tests.
+    """
+
+    def __init__(self, root="/sys/fs/cgroup", proc="/proc"):
+        self.root = root
+        self.proc = proc
+
+    def available(self):
+        """
+        Returns:
+            bool: True if the cgroup v2 hierarchy is mounted at root.
+        """
+        return os.path.isfile(os.path.join(self.root, "cgroup.controllers"))
+
+    def path(self, pid):
+        """
+        Returns the cgroup directory of a process.
+
+        Args:
+            pid (int): The process id.
+
+        Returns:
+            str: The directory or None if the process has no cgroup v2 entry.
+        """
+        try:
+            content = _read(os.path.join(self.proc, str(pid), "cgroup"))
+        except OSError:
+            return None
+        for line in content.splitlines():
+            if line.startswith("0::"):
+                return os.path.join(self.root, line[3:].strip().lstrip("/"))
+        return None
+
+    def _ppid(self, pid):
+        try:
+            stat = _read(os.path.join(self.proc, str(pid), "stat"))
+            return int(stat.rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def owns(self, directory, pid):
+        """
+        Checks if a cgroup holds only a process and its descendants.
+
+        Args:
+            directory (str): The cgroup directory.
+            pid (int): The process id.
+
+        Returns:
+            bool: True if every process of the cgroup descends from pid.
+        """
+        try:
+            procs = _read(os.path.join(directory, "cgroup.procs")).split()
+            procs = [int(process) for process in procs]
+        except (OSError, ValueError):
+            return False
+        for process in procs:
+            seen = set()
+            while process != pid:
+                if process is None or process <= 1 or process in seen:
+                    return False
+                seen.add(process)
+                process = self._ppid(process)
+        return True
+
+    def read(self, pid):
+        """
+        Reads the counters of the cgroup of a process.
+
+        Args:
+            pid (int): The process id, e.g. the pid of an instance.
+
+        Returns:
+            dict: The keys cpu (CPU time in nanoseconds), memory (bytes),
+                io (bytes read and written), and pids (number of
+                processes) as returned by parse_stats(), and the parsed
+                files as cpu.stat, memory.max, and io.stat. Counters whose
+                controller is not enabled are None.
+
+        Raises:
+            OSError: If the process or its cgroup does not exist, or the
+                cgroup also holds other processes.
+        """
+        directory = self.path(pid)
+        if directory is None or not os.path.isdir(directory):
+            raise FileNotFoundError(f"no cgroup v2 directory for pid {pid}")
+        if not self.owns(directory, pid):
+            raise OSError(f"the cgroup {directory} of pid {pid} is shared")
+
+        def optional(name, parse):
+            try:
+                return parse(_read(os.path.join(directory, name)))
+            except FileNotFoundError:
+                return None
+
+        cpu = optional("cpu.stat", _flat)
+        io = optional(
+            "io.stat",
+            lambda text: {
+                line.split(None, 1)[0]: _pairs(line.split(None, 1)[1])
+                for line in text.splitlines()
+                if " " in line.strip()
+            },
+        )
+        return {
+            "cpu": cpu["usage_usec"] * 1000 if cpu and "usage_usec" in cpu else None,
+            "memory": optional("memory.current", _number),
+            "io": (
+                sum(
+                    device.get("rbytes", 0) + device.get("wbytes", 0)
+                    for device in io.values()
+                )
+                if io is not None
+                else None
+            ),
+            "pids": optional("pids.current", _number),
+            "cgroup": directory,
+            "cpu.stat": cpu,
+            "memory.max": optional("memory.max", _number),
+            "io.stat": io,
+        }
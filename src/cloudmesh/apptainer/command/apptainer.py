@@ -1,8 +1,9 @@
 import os
+import shlex
+import sys
+import time
 
-from cloudmesh.apptainer.apptainer import Apptainer
-from cloudmesh.common.Printer import Printer
-from cloudmesh.common.util import readfile
+from cloudmesh.common.console import Console
 from cloudmesh.shell.command import PluginCommand
 from cloudmesh.shell.command import command
 from cloudmesh.shell.command import map_parameters
@@ -17,19 +18,26 @@ class ApptainerCommand(PluginCommand):
         ::
 
             Usage:
-                apptainer download NAME URL
+                apptainer download NAME URL [--digest=DIGEST]
+                apptainer download --manifest=FILE [--pulls=N]
                 apptainer inspect NAME
                 apptainer list [--detail] [--output=OUTPUT]
                 apptainer info
                 apptainer --dir=DIRECTORY
                 apptainer --add=SIF
-                apptainer cache [--output=OUTPUT]
+                apptainer cache [--output=OUTPUT] [--detail]
+                apptainer cache prune --budget=SIZE [--dryrun]
                 apptainer images [DIRECTORY] [--output=OUTPUT]
-                apptainer start NAME IMAGE [--home=PWD] [--gpu=GPU] [OPTIONS] [--dryrun]
-                apptainer stop NAME
+                apptainer dedup [--symlink] [--dryrun]
+                apptainer start NAME IMAGE [--home=PWD] [--gpu=GPU] [OPTIONS] [--dryrun] [--parallel=N]
+                apptainer stop NAME [--parallel=N] [--timeout=SECONDS] [--force]
                 apptainer shell NAME
-                apptainer exec NAME COMMAND
+                apptainer exec NAME COMMAND [--parallel=N]
                 apptainer stats NAME [--output=OUTPUT]
+                apptainer stats [NAME] --watch [--interval=SECONDS] [--window=SECONDS]
+                apptainer migrate DATABASE [YAML...]
+                apptainer catalog [SOURCE...] [--index=FILE] [--host=HOST] [--image=IMAGE] [--digest=DIGEST] [--instance=INSTANCE]
+                apptainer ps [NAME] [--running]
 
                 This command can be used to manage apptainers.
 
@@ -38,8 +46,15 @@ class ApptainerCommand(PluginCommand):
                     PARAMETER  a parameterized parameter of the form "a[0-3],a5"
                     OPTIONS   Options passed to the start command
                     IMAGE     The name of the image to be used
-                    NAME      The name of the apptainer
+                    NAME      The name of the apptainer. For start it can
+                              be a parameterized name such as "tf[0-3],a5",
+                              for stop and exec also a pattern such as "tf*"
                     URL       The URL of the file to be downloaded
+                    DATABASE  The database file to be written, e.g. apptainer.db
+                    YAML      The apptainer.yaml files to be migrated
+                    SOURCE    The apptainer.yaml or database of a host, a
+                              directory containing an apptainer.yaml, or a
+                              pattern such as "/shared/*/apptainer.yaml"
 
                 Options:
                     --dir=DIRECTORY    sets the the directory of the a list of aptainers
@@ -50,7 +65,30 @@ class ApptainerCommand(PluginCommand):
                     --command=COMMAND  sets the command to be executed
                     --output=OUTPUT    the format of the output [default: table]
                     --detail           shows more details [default: False]
+                    --parallel=N       the number of instances started,
+                                       stopped, or running the command at
+                                       the same time [default: 8]
+                    --timeout=SECONDS  seconds to wait before an instance is
+                                       killed [default: 10]
+                    --force            force stop instances that did not stop
+                                       in time
+                    --symlink          link duplicates with symbolic links
+                    --digest=DIGEST    the expected sha256:<hex> digest
+                    --manifest=FILE    a file listing the images to download
+                    --pulls=N          the number of images downloaded at
+                                       the same time [default: 4]
+                    --budget=SIZE      the maximum size of the cache, e.g.
+                                       20GB or 500MiB
+                    --watch            samples the instances continuously
+                    --interval=SECONDS seconds between two samples [default: 1]
+                    --window=SECONDS   seconds summarized by stats --watch
+                                       [default: 60]
                     -c COMMAND         sets the command to be executed
+                    --index=FILE       the index of the catalog of all hosts
+                                       [default: ~/.cloudmesh/apptainer/catalog.db]
+                    --host=HOST        only the images and instances of HOST
+                    --instance=INSTANCE  finds the hosts running INSTANCE
+                    --running          only the processes that are still running
 
             Description:
 
@@ -58,6 +96,39 @@ class ApptainerCommand(PluginCommand):
                     lists the apptainers in the specified directory
                     by default the directory is
 
+                cms apptainer exec NAME COMMAND
+                    executes the command in the instance and prints its
+                    output while it runs. If COMMAND is a file it is run
+                    with sh.
+
+                cms apptainer download NAME URL [--digest=DIGEST]
+                    pulls the image into a temporary file and renames it
+                    to NAME once it is verified as a complete SIF image
+                    with the expected digest. An existing image that
+                    passes the check is not pulled again.
+
+                cms apptainer download --manifest=images.txt --pulls=4
+                    downloads the images listed in images.txt with up to
+                    4 pulls at the same time. Each line of the file has
+                    the form NAME URL [DIGEST]. A file ending in .yaml
+                    maps the names to the URLs. A URL listed for several
+                    names is pulled once and linked to the other names.
+
+                cms apptainer catalog "/shared/*/apptainer.yaml" --image=tf.sif
+                    merges the databases of all hosts into one indexed
+                    catalog and lists the hosts that have the image
+                    tf.sif. Only the files that changed since the last
+                    call are read again. Without SOURCE the files already
+                    in the catalog are checked. With --digest the images
+                    are found by their sha256 digest, with --instance the
+                    hosts running an instance are listed, and with --host
+                    the images and instances of a host. Without a query
+                    the hosts are summarized.
+
+                cms apptainer ps [NAME] [--running]
+                    lists the processes started by cms apptainer, e.g. the
+                    instance starts, with their pid, status, and exit code
+
                 cms apptainer --dir=DIRECTORY
                     sets the default apptainer directory in the cms variable
                     apptainer_dir
@@ -65,8 +136,49 @@ class ApptainerCommand(PluginCommand):
                 cms apptainer --add=SIF
                     adds a sif file to the list of apptainers
 
-                cms apptainer cache
-                    lists the cached apptainers
+                cms apptainer start "tf[0-31]" tf.sif --parallel=16
+                    starts the instances tf0 to tf31 with up to 16 at the
+                    same time and prints the status and duration of each
+
+                cms apptainer stop "tf*" --force
+                    stops all instances whose name starts with tf in
+                    parallel and prints which of them stopped, were
+                    killed, or timed out
+
+                cms apptainer stats --watch --interval=2 --window=300
+                    samples CPU, memory, I/O, and the number of processes of
+                    all running instances every 2 seconds and prints the
+                    last, minimum, maximum, mean, and percentiles of the
+                    last 5 minutes until it is interrupted with CTRL-C.
+                    CPU is given in percent and I/O in bytes per second.
+
+                cms apptainer dedup [--symlink] [--dryrun]
+                    finds images with the same sha256 digest in the
+                    locations and replaces the copies by hard links to
+                    one of them, or by symbolic links with --symlink or
+                    across file systems. To record the digests in the
+                    catalog and show them in cms apptainer images use
+
+                        cms set apptainer_digest=True
+
+                cms apptainer cache [--detail]
+                    lists the number of files and the space used by the
+                    apptainer cache. With --detail every container file
+                    and OCI blob is listed with its size and last access
+
+                cms apptainer cache prune --budget=20GB [--dryrun]
+                    removes the least recently used container files and
+                    OCI blobs until the cache uses at most 20 GB. Entries
+                    used by a pull in progress are kept. With --dryrun the
+                    entries are only listed.
+
+                cms apptainer migrate DATABASE [YAML...]
+                    copies the records of the given apptainer.yaml files
+                    (default: apptainer.yaml) into DATABASE. Files ending
+                    in .db, .sqlite, or .sqlite3 are SQLite databases. To
+                    use it set the cms variable apptainer_db, e.g.
+
+                        cms set apptainer_db=apptainer.db
 
                 cms apptainer info
                     prints information contained in the apptainer.yaml file.
@@ -105,7 +217,24 @@ class ApptainerCommand(PluginCommand):
         # variables = Variables()
         # variables["apptainer_dir"] = True
 
-        map_parameters(arguments, "output")
+        map_parameters(
+            arguments,
+            "output",
+            "home",
+            "gpu",
+            "dryrun",
+            "parallel",
+            "timeout",
+            "force",
+            "watch",
+            "interval",
+            "window",
+            "host",
+            "image",
+            "digest",
+            "instance",
+            "running",
+        )
 
         # arguments = Parameter.parse(
         #     arguments, parameter="expand", experiment="dict", COMMAND="str"
@@ -113,8 +242,25 @@ class ApptainerCommand(PluginCommand):
 
         # VERBOSE(arguments)
 
-        app = Apptainer()
-        r = app.load_location_from_db()
+        # the modules of the subcommands are imported in their branches, so
+        # e.g. ps does not load Apptainer and its dependencies
+        if arguments.catalog or arguments.migrate or arguments.ps or arguments["--dir"]:
+            app = None
+        else:
+            from cloudmesh.apptainer.apptainer import Apptainer
+
+            # the locations are only scanned for commands that use images
+            app = Apptainer(
+                scan=not (
+                    arguments.list
+                    or arguments.info
+                    or arguments.stop
+                    or arguments.shell
+                    or arguments.exec
+                    or arguments.stats
+                    or arguments.cache
+                )
+            )
 
         if arguments["--dir"]:
             print("option dir")
@@ -122,21 +268,20 @@ class ApptainerCommand(PluginCommand):
         elif arguments.info:
             out = app.info()
             app.save()
-            r = readfile("apptainer.yaml")
-            print(r)
+            print(app.db.yaml(hostname=app.hostname))
 
         elif arguments.list:
             detail = arguments["--detail"]
 
             out = app.list()
             app.save()
-            r = readfile("apptainer.yaml")
-            prefix = app.prefix
-            data = app.db[f"{prefix}.instances"]
+            data = app.get_db("instances")
             # if arguments.output == "table":
             #     print(tabulate(data, headers="keys", tablefmt="simple_grid", showindex="always"))
             # else:
             if detail:
+                from cloudmesh.common.Printer import Printer
+
                 print(Printer.write(data, order=None, output=arguments.output))
             else:
                 for entry in data:
@@ -149,63 +294,310 @@ class ApptainerCommand(PluginCommand):
                     )
                 )
 
+        elif arguments.cache and arguments.prune:
+            report = app.cache_prune(arguments["--budget"], dry_run=arguments.dryrun)
+            data = [
+                {
+                    "category": entry["category"],
+                    "name": entry["name"],
+                    "bytes": entry["bytes"],
+                    "status": status,
+                }
+                for status in ["removed", "protected", "failed"]
+                for entry in report[status]
+            ]
+            if data:
+                print(tabulate(data, headers="keys", tablefmt="simple_grid"))
+            action = "Would reclaim" if report["dry_run"] else "Reclaimed"
+            print(
+                f"{action} {report['reclaimed']} bytes: "
+                f"{report['before']} -> {report['after']} "
+                f"(budget {report['budget']})"
+            )
+
         elif arguments.cache:
-            data = app.cache()
+            from cloudmesh.common.Printer import Printer
+
+            detail = arguments["--detail"]
+            data = app.cache(entries=detail)
+            entries = data.pop("entries", [])
             print(Printer.attribute(data, output=arguments.output))
+            if detail:
+                data = [
+                    {
+                        "category": entry["category"],
+                        "name": entry["name"],
+                        "bytes": entry["bytes"],
+                        "atime": time.strftime(
+                            "%Y-%m-%d %H:%M:%S", time.localtime(entry["atime"])
+                        ),
+                    }
+                    for entry in entries
+                ]
+                print(tabulate(data, headers="keys", tablefmt="simple_grid"))
 
         elif arguments["--add"]:
             print("option add")
             app.add_location(arguments["--add"])
 
         elif arguments.inspect:
+            from cloudmesh.common.Printer import Printer
+
             data = app.inspect(arguments.NAME)
             print(Printer.attribute(data))
 
+        elif arguments.stats and arguments.watch:
+            from cloudmesh.apptainer.stats import StatsCollector
+
+            interval = float(arguments.interval)
+            window = float(arguments.window)
+            collector = StatsCollector(
+                app, interval=interval, size=max(2, int(window / interval) + 1)
+            )
+            collector.start()
+            try:
+                while True:
+                    time.sleep(interval)
+                    data = collector.table(name=arguments.NAME, window=window)
+                    print("\033[H\033[J", end="")
+                    print(
+                        tabulate(
+                            data, headers="keys", tablefmt="simple_grid", floatfmt=".1f"
+                        )
+                    )
+            except KeyboardInterrupt:
+                pass
+            finally:
+                collector.stop()
+
         elif arguments.stats:
-            r = app.stats(name=arguments.NAME, output="json")
+            from cloudmesh.common.Printer import Printer
 
-            print(Printer.attribute(r, output=arguments.output))
+            data = app.stats(name=arguments.NAME, output="dict")
+            data = {key: data[key] for key in ["cpu", "memory", "io", "pids"]}
+            print(Printer.attribute(data, output=arguments.output))
 
         elif arguments.start:
-            r = app.start(
-                name=arguments.NAME,
-                image=arguments.IMAGE,
-                home=arguments.home,
-                gpu=arguments.gpu,
-                options=arguments.OPTIONS,
-            )
+            from cloudmesh.common.parameter import Parameter
+
+            names = Parameter.expand(arguments.NAME)
+            if len(names) == 1:
+                r = app.start(
+                    name=arguments.NAME,
+                    image=arguments.IMAGE,
+                    home=arguments.home,
+                    gpu=arguments.gpu,
+                    options=arguments.OPTIONS,
+                    dryrun=arguments.dryrun,
+                )
+            else:
+                specs = [
+                    {
+                        "name": name,
+                        "image": arguments.IMAGE,
+                        "home": arguments.home,
+                        "gpu": arguments.gpu,
+                        "options": arguments.OPTIONS,
+                    }
+                    for name in names
+                ]
+                results = app.start_many(
+                    specs,
+                    max_workers=int(arguments.parallel),
+                    dryrun=arguments.dryrun,
+                )
+                data = [
+                    {key: result[key] for key in ["name", "image", "status", "seconds"]}
+                    for result in results
+                ]
+                print(tabulate(data, headers="keys", tablefmt="simple_grid"))
 
         elif arguments.stop:
-            r = app.stop(arguments.NAME)
+            from cloudmesh.common.parameter import Parameter
+
+            names = Parameter.expand(arguments.NAME)
+            if names == ["all"] or (
+                len(names) == 1 and not any(c in names[0] for c in "*?[")
+            ):
+                r = app.stop(
+                    arguments.NAME,
+                    timeout=int(arguments.timeout),
+                    force=arguments.force,
+                )
+            else:
+                results = app.stop_many(
+                    names,
+                    max_workers=int(arguments.parallel),
+                    timeout=int(arguments.timeout),
+                    force=arguments.force,
+                )
+                data = [
+                    {key: result[key] for key in ["name", "status", "seconds"]}
+                    for result in results
+                ]
+                print(tabulate(data, headers="keys", tablefmt="simple_grid"))
 
         elif arguments.shell:
             r = app.shell(arguments.NAME)
 
         elif arguments.exec:
+            from cloudmesh.common.parameter import Parameter
+
             command = arguments.COMMAND
 
             if os.path.isfile(command):
                 script = command
                 command = f"sh {script}"
 
-            name = arguments.NAME
-
-            stdout, stderr = app.exec(name=name, command=command)
-            print(stdout)
-            print(stderr)
+            names = Parameter.expand(arguments.NAME)
+            if len(names) == 1 and not any(c in names[0] for c in "*?["):
+                for stream, line in app.exec(
+                    name=names[0], command=command, stream=True
+                ):
+                    output = sys.stdout if stream == "stdout" else sys.stderr
+                    output.write(line)
+                    output.flush()
+            else:
+                results = app.exec_many(
+                    names, command=command, max_workers=int(arguments.parallel)
+                )
+                data = [
+                    {
+                        key: result[key].strip()
+                        if key in ["stdout", "stderr"]
+                        else result[key]
+                        for key in [
+                            "name",
+                            "status",
+                            "returncode",
+                            "seconds",
+                            "stdout",
+                            "stderr",
+                        ]
+                    }
+                    for result in results
+                ]
+                print(tabulate(data, headers="keys", tablefmt="simple_grid"))
 
         elif arguments.images:
+            from cloudmesh.common.Printer import Printer
+
             directory = arguments.DIRECTORY
             data = app.images
             print(Printer.write(data, output=arguments.output))
 
+        elif arguments.dedup:
+            mode = "symlink" if arguments["--symlink"] else "hardlink"
+            results = app.dedup(mode=mode, dry_run=arguments.dryrun)
+            data = [
+                {key: result[key] for key in ["path", "target", "mode", "bytes"]}
+                for result in results
+            ]
+            if data:
+                print(tabulate(data, headers="keys", tablefmt="simple_grid"))
+            action = "Would free" if arguments.dryrun else "Freed"
+            print(f"{action} {sum(result['bytes'] for result in results)} bytes")
+
+        elif arguments.download and arguments["--manifest"]:
+            from cloudmesh.apptainer.apptainer import read_manifest
+
+            images = read_manifest(arguments["--manifest"])
+            results = app.download_many(images, max_workers=int(arguments["--pulls"]))
+            data = [
+                {key: result[key] for key in ["name", "url", "status", "seconds"]}
+                for result in results
+            ]
+            print(tabulate(data, headers="keys", tablefmt="simple_grid"))
+
         elif arguments.download:
             name = arguments.NAME
             if not name.endswith(".sif"):
                 name += ".sif"
             print(f"NAME>{name}<")
 
-            app.download(name=name, url=arguments.URL)
+            app.download(name=name, url=arguments.URL, digest=arguments["--digest"])
+
+        elif arguments.catalog:
+            from cloudmesh.apptainer.aggregate import CatalogAggregator
+
+            with CatalogAggregator(arguments["--index"]) as catalog:
+                report = catalog.update(arguments.SOURCE or None)
+                for path, error in report["failed"].items():
+                    Console.error(f"{path}: {error}")
+                for path, hosts in report["renamed"].items():
+                    for hostname, indexed in hosts.items():
+                        Console.warning(f"{path}: {hostname} is indexed as {indexed}")
+                if arguments.instance:
+                    data = [
+                        {
+                            key: instance.get(key)
+                            for key in ["hostname", "instance", "pid", "img"]
+                        }
+                        for instance in catalog.instances(
+                            hostname=arguments.host, name=arguments.instance
+                        )
+                    ]
+                elif arguments.image or arguments.digest or arguments.host:
+                    data = [
+                        {
+                            key: image.get(key)
+                            for key in ["hostname", "name", "size", "path", "digest"]
+                        }
+                        for image in catalog.images(
+                            hostname=arguments.host,
+                            name=arguments.image,
+                            digest=arguments.digest,
+                        )
+                    ]
+                    if arguments.host and not (arguments.image or arguments.digest):
+                        print(tabulate(data, headers="keys", tablefmt="simple_grid"))
+                        data = [
+                            {
+                                key: instance.get(key)
+                                for key in ["hostname", "instance", "pid", "img"]
+                            }
+                            for instance in catalog.instances(hostname=arguments.host)
+                        ]
+                else:
+                    data = catalog.hosts()
+            if data:
+                print(tabulate(data, headers="keys", tablefmt="simple_grid"))
+
+        elif arguments.ps:
+            from cloudmesh.apptainer.process import ProcessTable
+
+            records = ProcessTable().list(
+                name=arguments.NAME, running=arguments.running
+            )
+            data = [
+                {
+                    key: (
+                        time.strftime(
+                            "%Y-%m-%d %H:%M:%S", time.localtime(record[key])
+                        )
+                        if key in ["start", "end"] and record.get(key)
+                        else record.get(key)
+                    )
+                    for key in [
+                        "hostname",
+                        "pid",
+                        "name",
+                        "status",
+                        "exit",
+                        "start",
+                        "end",
+                    ]
+                }
+                for record in records
+            ]
+            print(tabulate(data, headers="keys", tablefmt="simple_grid"))
+
+        elif arguments.migrate:
+            from cloudmesh.apptainer.db import migrate
+
+            sources = arguments.YAML or ["apptainer.yaml"]
+            hosts = migrate(sources, arguments.DATABASE)
+            print(f"Migrated {len(hosts)} host(s) to {arguments.DATABASE}")
 
         elif arguments.load:
             r = app.load()
@@ -214,3 +606,17 @@ class ApptainerCommand(PluginCommand):
             r = app.save()
 
         return ""
+
+
+def main():
+    """
+    Runs the cma command.
+
+    The arguments are parsed with the grammar of cms apptainer and the
+    command is run in this process, so neither the cms shell nor the other
+    cloudmesh plugins are loaded.
+
+    Example:
+        cma list
+    """
+    ApptainerCommand().do_apptainer(shlex.join(sys.argv[1:]))
@@ -0,0 +1,465 @@
+import json
+import os
+import shutil
+import sqlite3
+import stat
+import tempfile
+
+import yaml
+from yamldb import YamlDB
+
+KEYS = ["hostname", "location", "images", "instances", "catalog"]
+
+# names a host may record for itself that do not tell the hosts apart
+ANONYMOUS = {"localhost", "localhost.localdomain", "127.0.0.1", "::1"}
+
+
+def _plain(data):
+    return json.loads(json.dumps(data, default=str))
+
+
+def _default_mode():
+    """
+    Returns the permission bits open() gives a new file under the umask.
+
+    The umask is read without os.umask(), which would change it for all
+    threads while it is read.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    # without /proc a new file shows the mode the umask leaves
+    directory = tempfile.mkdtemp()
+    try:
+        probe = os.path.join(directory, "probe")
+        os.close(os.open(probe, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        return stat.S_IMODE(os.stat(probe).st_mode)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def unique_hostname(hostname, path, taken):
+    """
+    Returns the hostname under which a record read from a file is kept.
+
+    When the records of several files are merged, a hostname such as
+    localhost, or one that another file already has, would merge the
+    records of different hosts. Such a hostname gets the absolute path of
+    its file appended, e.g. localhost@/shared/node1/apptainer.yaml.
+
+    Args:
+        hostname (str): The hostname stored in the file.
+        path (str): The file the record was read from.
+        taken (set): The hostnames of the records of other files.
+
+    Returns:
+        str: The hostname, or the hostname with the path.
+    """
+    if hostname in ANONYMOUS or hostname in taken:
+        return f"{hostname}@{os.path.abspath(path)}"
+    return hostname
+
+
+def _mode(filename):
+    """
+    Returns the permission bits of a file, or those of a new file.
+    """
+    try:
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        return _default_mode()
+
+
+class Database:
+    """
+    Interface of the storage used by Apptainer.
+
+    A database stores one record per host. A record is a dict with the keys
+    hostname, location, images, instances, and catalog. Keys that are not
+    stored are missing from the dict returned by load(). Values can also be
+    read with the dotted keys used in apptainer.yaml, e.g.
+
+        db["cloudmesh.apptainer.images"]
+    """
+
+    # True if the file holds the record of one host only
+    single_host = False
+
+    def __init__(self, filename, prefix="cloudmesh.apptainer"):
+        self.filename = filename
+        self.prefix = prefix
+
+    def exists(self):
+        return os.path.isfile(self.filename)
+
+    def close(self):
+        pass
+
+    def load(self, hostname=None):
+        """
+        Loads the record of a host.
+
+        Args:
+            hostname (str): The host. If None the default host of the database.
+
+        Returns:
+            dict: The stored keys of the record.
+        """
+        raise NotImplementedError
+
+    def save(self, record, keys=None):
+        """
+        Stores a record.
+
+        Args:
+            record (dict): The record to be stored.
+            keys (list): The keys that changed. If None all keys are written.
+
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    def hosts(self):
+        """
+        Returns:
+            list: The hostnames that have a record in the database.
+        """
+        raise NotImplementedError
+
+    def get(self, key, hostname=None):
+        return self.load(hostname=hostname)[key]
+
+    def __getitem__(self, key):
+        prefix = f"{self.prefix}."
+        if key.startswith(prefix):
+            key = key[len(prefix):]
+        return self.get(key)
+
+    def yaml(self, hostname=None):
+        """
+        Returns:
+            str: The record as YAML in the same layout as apptainer.yaml.
+        """
+        data = {}
+        record = self.load(hostname=hostname)
+        node = data
+        for key in self.prefix.split("."):
+            node[key] = {}
+            node = node[key]
+        node.update({key: record[key] for key in KEYS if key in record})
+        return yaml.safe_dump(_plain(data), sort_keys=False, default_flow_style=False)
+
+
+class YamlDatabase(Database):
+    """
+    Stores the record of a single host in apptainer.yaml.
+    """
+
+    single_host = True
+
+    def __init__(self, filename="apptainer.yaml", prefix="cloudmesh.apptainer"):
+        super().__init__(filename, prefix=prefix)
+        exists = os.path.exists(filename)
+        self.db = YamlDB(filename=filename)
+        if not exists and os.path.exists(filename):
+            # YamlDB creates the file with mode 0600
+            os.chmod(filename, _default_mode())
+
+    def load(self, hostname=None):
+        record = {}
+        for key in KEYS:
+            try:
+                record[key] = self.db[f"{self.prefix}.{key}"]
+            except:
+                pass
+        return record
+
+    def yaml(self, hostname=None):
+        with open(self.filename) as f:
+            return f.read()
+
+    def hosts(self):
+        try:
+            return [self.db[f"{self.prefix}.hostname"]]
+        except:
+            return []
+
+    def save(self, record, keys=None):
+        """
+        Writes the record atomically into the yaml file.
+
+        The data is written to a temporary file in the same directory which
+        is then renamed over the database file, so a concurrent reader sees
+        either the old or the new content but never a partial file. The
+        temporary file gets the mode of the database file, or the default
+        mode of new files if it does not exist yet.
+        """
+        data = self.db.data
+        for key in self.prefix.split("."):
+            if not isinstance(data.get(key), dict):
+                data[key] = {}
+            data = data[key]
+        data.update(record)
+
+        content = yaml.safe_dump(
+            _plain(self.db.data), sort_keys=False, default_flow_style=False
+        )
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(
+            dir=directory, prefix=f".{os.path.basename(self.filename)}.", suffix=".tmp"
+        )
+        try:
+            # mkstemp creates the file with mode 0600
+            os.fchmod(fd, _mode(self.filename))
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+class SqliteDatabase(Database):
+    """
+    Stores the records of many hosts in a SQLite database.
+
+    Images and instances are kept in their own tables indexed by hostname,
+    image name, and instance name, so they can be queried without loading
+    the records of all hosts. Saving a record only rewrites the sections
+    that changed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hosts (
+            hostname TEXT PRIMARY KEY,
+            location TEXT,
+            catalog TEXT
+        );
+        CREATE TABLE IF NOT EXISTS images (
+            hostname TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT,
+            path TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS images_hostname ON images (hostname);
+        CREATE INDEX IF NOT EXISTS images_name ON images (name);
+        CREATE INDEX IF NOT EXISTS images_digest
+            ON images (json_extract(data, '$.digest'));
+        CREATE TABLE IF NOT EXISTS instances (
+            hostname TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            instance TEXT,
+            img TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS instances_hostname ON instances (hostname);
+        CREATE INDEX IF NOT EXISTS instances_instance ON instances (instance);
+    """
+
+    def __init__(self, filename="apptainer.db", prefix="cloudmesh.apptainer"):
+        super().__init__(filename, prefix=prefix)
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def hosts(self):
+        rows = self.connection.execute("SELECT hostname FROM hosts ORDER BY hostname")
+        return [row[0] for row in rows]
+
+    def _hostname(self, hostname):
+        if hostname is not None:
+            return hostname
+        hosts = self.hosts()
+        return hosts[0] if len(hosts) == 1 else None
+
+    def load(self, hostname=None):
+        hostname = self._hostname(hostname)
+        row = self.connection.execute(
+            "SELECT location, catalog FROM hosts WHERE hostname = ?", (hostname,)
+        ).fetchone()
+        if row is None:
+            return {"hostname": hostname} if hostname else {}
+        return {
+            "hostname": hostname,
+            "location": json.loads(row[0]) if row[0] else [],
+            "images": self.images(hostname=hostname),
+            "instances": self.instances(hostname=hostname),
+            "catalog": json.loads(row[1]) if row[1] else None,
+        }
+
+    def get(self, key, hostname=None):
+        hostname = self._hostname(hostname)
+        if key == "images":
+            return self.images(hostname=hostname)
+        if key == "instances":
+            return self.instances(hostname=hostname)
+        return self.load(hostname=hostname)[key]
+
+    def _query(self, table, column, hostname=None, name=None):
+        sql = f"SELECT data FROM {table}"
+        conditions = []
+        values = []
+        if hostname is not None:
+            conditions.append("hostname = ?")
+            values.append(hostname)
+        if name is not None:
+            conditions.append(f"{column} = ?")
+            values.append(name)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY hostname, position"
+        return [json.loads(row[0]) for row in self.connection.execute(sql, values)]
+
+    def images(self, hostname=None, name=None):
+        """
+        Queries the images.
+
+        Args:
+            hostname (str): Only images on this host.
+            name (str): Only images with this name.
+
+        Returns:
+            list: The image records.
+        """
+        return self._query("images", "name", hostname=hostname, name=name)
+
+    def instances(self, hostname=None, name=None):
+        """
+        Queries the instances.
+
+        Args:
+            hostname (str): Only instances on this host.
+            name (str): Only instances with this name.
+
+        Returns:
+            list: The instance records.
+        """
+        return self._query("instances", "instance", hostname=hostname, name=name)
+
+    def delete(self, hostname):
+        """
+        Removes the record of a host.
+
+        Args:
+            hostname (str): The host.
+        """
+        with self.connection:
+            for table in ["hosts", "images", "instances"]:
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE hostname = ?", (hostname,)
+                )
+
+    def save(self, record, keys=None):
+        hostname = record["hostname"]
+        keys = KEYS if keys is None else keys
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO hosts (hostname) VALUES (?)", (hostname,)
+            )
+            for key in ["location", "catalog"]:
+                if key in keys:
+                    self.connection.execute(
+                        f"UPDATE hosts SET {key} = ? WHERE hostname = ?",
+                        (json.dumps(_plain(record[key])), hostname),
+                    )
+            if "images" in keys:
+                self.connection.execute(
+                    "DELETE FROM images WHERE hostname = ?", (hostname,)
+                )
+                self.connection.executemany(
+                    "INSERT INTO images (hostname, position, name, path, data)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            hostname,
+                            position,
+                            image.get("name"),
+                            image.get("path"),
+                            json.dumps(_plain(image)),
+                        )
+                        for position, image in enumerate(record["images"] or [])
+                    ],
+                )
+            if "instances" in keys:
+                self.connection.execute(
+                    "DELETE FROM instances WHERE hostname = ?", (hostname,)
+                )
+                self.connection.executemany(
+                    "INSERT INTO instances (hostname, position, instance, img, data)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            hostname,
+                            position,
+                            instance.get("instance"),
+                            instance.get("img"),
+                            json.dumps(_plain(instance)),
+                        )
+                        for position, instance in enumerate(record["instances"] or [])
+                    ],
+                )
+
+
+def get_database(filename="apptainer.yaml", prefix="cloudmesh.apptainer"):
+    """
+    Returns the database backend for a file based on its extension.
+
+    Files ending in .db, .sqlite, or .sqlite3 use SQLite, all others YAML.
+
+    Args:
+        filename (str): The database file.
+        prefix (str): The key prefix of the records.
+
+    Returns:
+        Database: The backend.
+    """
+    if os.path.splitext(filename)[1] in [".db", ".sqlite", ".sqlite3"]:
+        return SqliteDatabase(filename, prefix=prefix)
+    return YamlDatabase(filename, prefix=prefix)
+
+
+def migrate(sources, destination, prefix="cloudmesh.apptainer"):
+    """
+    Copies the records of one or more databases into another one.
+
+    This is typically used once to move existing apptainer.yaml files of
+    several hosts into a single SQLite database.
+
+    A record whose hostname is localhost, or whose hostname was already
+    migrated from another file, is renamed with unique_hostname() so the
+    records of different hosts are not merged.
+
+    Args:
+        sources (list): The files to be read.
+        destination (str): The file to be written.
+        prefix (str): The key prefix of the records.
+
+    Returns:
+        list: The hostnames that were migrated, as stored in destination.
+    """
+    target = get_database(destination, prefix=prefix)
+    migrated = []
+    for source in sources:
+        db = get_database(source, prefix=prefix)
+        taken = set(migrated)
+        for hostname in db.hosts():
+            record = db.load(hostname=hostname)
+            record["hostname"] = unique_hostname(hostname, source, taken)
+            record.setdefault("location", [])
+            record.setdefault("images", [])
+            record.setdefault("instances", [])
+            record.setdefault("catalog", None)
+            target.save(record)
+            migrated.append(record["hostname"])
+    return migrated
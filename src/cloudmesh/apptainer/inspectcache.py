@@ -0,0 +1,180 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from cloudmesh.common.util import path_expand
+
+
+class InspectCache:
+    """
+    Persistent LRU cache for the results of inspecting an image.
+
+    An entry is keyed by the absolute path of the image and stores the
+    inode, size, and mtime of the file at the time it was inspected. A
+    lookup stats the file and discards the entry if any of them changed,
+    so a replaced or rewritten image is inspected again. The least
+    recently used entries are evicted once the cache holds more than
+    max_entries entries or its data exceeds max_bytes.
+
+    The counters hits, misses, invalidations, and evictions are kept in
+    a small file next to the cache file, e.g. inspect.counters.json, so
+    they accumulate across invocations. A lookup only changes the
+    counters, so saving after a hit does not rewrite the cache file.
+    """
+
+    COUNTERS = ["hits", "misses", "invalidations", "evictions"]
+
+    def __init__(
+        self,
+        filename="~/.cloudmesh/apptainer/inspect.json",
+        max_entries=1000,
+        max_bytes=16 * 1024 * 1024,
+    ):
+        self.filename = path_expand(filename)
+        self.counters_filename = os.path.splitext(self.filename)[0] + ".counters.json"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._bytes = 0
+        self._dirty = False
+        self._counted = False
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def _identity(path):
+        stat = os.stat(path)
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def _size(entry):
+        return len(json.dumps(entry["data"]))
+
+    @staticmethod
+    def _read(filename):
+        try:
+            with open(filename) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self):
+        content = self._read(self.filename) or {}
+        # cache files written before the counters file keep them inside
+        counters = self._read(self.counters_filename) or content.get("counters", {})
+        with self._lock:
+            self.entries = OrderedDict(content.get("entries", []))
+            for key in self.COUNTERS:
+                self.counters[key] = counters.get(key, 0)
+            self._bytes = sum(self._size(entry) for entry in self.entries.values())
+
+    @staticmethod
+    def _write(filename, content):
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            os.replace(tmp, filename)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def save(self):
+        """
+        Writes the entries atomically if they changed and the counters if
+        they changed.
+
+        Returns:
+            bool: True if the cache file was written.
+        """
+        with self._lock:
+            entries = None
+            if self._dirty:
+                entries = json.dumps({"entries": list(self.entries.items())})
+            counters = json.dumps(self.counters) if self._counted else None
+            self._dirty = False
+            self._counted = False
+        if entries is not None:
+            self._write(self.filename, entries)
+        if counters is not None:
+            self._write(self.counters_filename, counters)
+        return entries is not None
+
+    def get(self, path):
+        """
+        Returns the cached data of an image if the file did not change.
+
+        Args:
+            path (str): The path of the image.
+
+        Returns:
+            dict: The cached data or None.
+        """
+        path = os.path.abspath(path)
+        try:
+            identity = self._identity(path)
+        except OSError:
+            identity = None
+        with self._lock:
+            self._counted = True
+            entry = self.entries.get(path)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            if entry["identity"] != identity:
+                self._dirty = True
+                del self.entries[path]
+                self._bytes -= self._size(entry)
+                self.counters["invalidations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(path)
+            self.counters["hits"] += 1
+            return entry["data"]
+
+    def put(self, path, data):
+        """
+        Stores the data of an image and evicts the least recently used entries.
+
+        Args:
+            path (str): The path of the image.
+            data (dict): The data to be cached. It must be JSON serializable.
+
+        Returns:
+            None
+        """
+        path = os.path.abspath(path)
+        entry = {"identity": self._identity(path), "data": data}
+        with self._lock:
+            self._dirty = True
+            self._counted = True
+            if path in self.entries:
+                self._bytes -= self._size(self.entries.pop(path))
+            self.entries[path] = entry
+            self._bytes += self._size(entry)
+            while len(self.entries) > 1 and (
+                len(self.entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, evicted = self.entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._bytes = 0
+            self._dirty = True
+
+    def stats(self):
+        """
+        Returns:
+            dict: The counters, the number of entries, and the cached bytes.
+        """
+        with self._lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self._bytes)
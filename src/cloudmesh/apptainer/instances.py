@@ -0,0 +1,92 @@
+import json
+import os
+import pwd
+import socket
+
+from cloudmesh.apptainer.process import _alive
+
+
+class InstanceFiles:
+    """
+    Reads the state of the running instances from the files of apptainer.
+
+    For every instance apptainer writes a JSON file
+
+        ~/.apptainer/instances/app/<hostname>/<user>/<name>/<name>.json
+
+    holding, among others, the pid of the instance process, the image, the
+    ip address, and the log files. Reading these files takes a few
+    milliseconds, while apptainer instance list --json forks apptainer.
+    Files whose process is no longer alive are skipped, just as apptainer
+    does.
+
+    Example:
+        instances = InstanceFiles().list()
+        if instances is None:
+            instances = Apptainer().info(native=False)["instances"]
+    """
+
+    def __init__(self, directory=None, hostname=None, user=None):
+        """
+        Args:
+            directory (str): The apptainer configuration directory. If None
+                $APPTAINER_CONFIGDIR or ~/.apptainer is used.
+            hostname (str): The hostname. If None the name of this host.
+            user (str): The user. If None the current user.
+        """
+        directory = directory or os.environ.get("APPTAINER_CONFIGDIR")
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".apptainer")
+        self.hostname = hostname or socket.gethostname()
+        self.user = user or pwd.getpwuid(os.getuid()).pw_name
+        self.directory = os.path.join(
+            directory, "instances", "app", self.hostname, self.user
+        )
+
+    def available(self):
+        """
+        Returns:
+            bool: True if the instance directory of the user exists.
+        """
+        return os.path.isdir(self.directory)
+
+    @staticmethod
+    def _entry(name, content):
+        pid = content["pid"]
+        if not isinstance(pid, int) or pid <= 0:
+            raise ValueError(f"invalid pid {pid}")
+        return {
+            "instance": name,
+            "pid": pid,
+            "img": content["image"],
+            "ip": content.get("ip") or "",
+            "logErrPath": content.get("logErrPath") or "",
+            "logOutPath": content.get("logOutPath") or "",
+        }
+
+    def list(self):
+        """
+        Lists the running instances.
+
+        Returns:
+            list: The instances in the form of info()["instances"], ordered
+                by name, or None if the instance directory does not exist.
+        """
+        try:
+            entries = os.scandir(self.directory)
+        except OSError:
+            return None
+        instances = []
+        with entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                filename = os.path.join(entry.path, f"{entry.name}.json")
+                try:
+                    with open(filename) as f:
+                        instance = self._entry(entry.name, json.load(f))
+                except (OSError, ValueError, KeyError, TypeError):
+                    continue
+                if _alive(instance["pid"]):
+                    instances.append(instance)
+        return sorted(instances, key=lambda instance: instance["instance"])
@@ -0,0 +1,228 @@
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+
+def _ticks(pid):
+    """
+    Returns the start time of a process in clock ticks since boot, or None.
+
+    Together with the pid it identifies a process even if the pid is reused.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _hostname():
+    """
+    Returns the name of this host, which qualifies the pids in files that
+    may be shared by several hosts, e.g. in a shared home directory.
+    """
+    return socket.gethostname()
+
+
+def _alive(pid, ticks=None):
+    if os.path.isdir("/proc"):
+        current = _ticks(pid)
+        return current is not None and (ticks is None or current == ticks)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _poll(process):
+    """
+    Returns the exit code of a subprocess.Popen or asyncio process, or None.
+    """
+    poll = getattr(process, "poll", None)
+    return poll() if poll is not None else process.returncode
+
+
+class ProcessTable:
+    """
+    Registry of the processes started by Apptainer.
+
+    Each record holds the pid, the hostname, the name of the instance, the
+    command, the start and end time, the status (running or exited), and
+    the exit code. Processes started by this object are reaped with poll();
+    processes recorded by other invocations on this host are checked with
+    /proc. The records of other hosts sharing the file are kept as they
+    are, as their processes can not be checked here. The table is
+    kept in memory and merged into a JSON file under a file lock whenever
+    it changes, so the records survive across CLI invocations. Only the
+    last keep exited records are retained.
+    """
+
+    def __init__(self, filename="~/.cloudmesh/apptainer/processes.json", keep=100):
+        self.filename = os.path.expanduser(filename)
+        self.keep = keep
+        self.records = None
+        self._children = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(pid, hostname=None):
+        return f"{hostname or _hostname()}:{pid}"
+
+    def _read(self):
+        try:
+            with open(self.filename) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # records written before the hostname was recorded are of this host
+        for record in records.values():
+            record.setdefault("hostname", _hostname())
+        return {
+            self._key(record["pid"], record["hostname"]): record
+            for record in records.values()
+        }
+
+    def _load(self):
+        if self.records is None:
+            self.records = self._read()
+
+    def save(self):
+        """
+        Merges the records into the file.
+
+        Records of other invocations that are not known here are kept.
+        """
+        directory = os.path.dirname(self.filename)
+        os.makedirs(directory, exist_ok=True)
+        with open(self.filename + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with self._lock:
+                records = self._read()
+                for key, record in (self.records or {}).items():
+                    stored = records.get(key)
+                    if (
+                        stored is not None
+                        and stored["status"] != "running"
+                        and record["status"] == "running"
+                        and key not in self._children
+                    ):
+                        continue
+                    records[key] = record
+                exited = sorted(
+                    (r for r in records.values() if r["status"] != "running"),
+                    key=lambda r: r.get("end") or 0,
+                )
+                for record in exited[: max(0, len(exited) - self.keep)]:
+                    records.pop(self._key(record["pid"], record["hostname"]), None)
+                self.records = records
+                content = json.dumps(records, indent=2)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            os.replace(tmp, self.filename)
+
+    def register(self, process, name=None, command=None):
+        """
+        Records a process started with subprocess.Popen or asyncio.
+
+        Args:
+            process (Popen or asyncio.subprocess.Process): The process.
+            name (str): The name of the instance.
+            command (str): The command.
+
+        Returns:
+            dict: The record.
+        """
+        record = {
+            "pid": process.pid,
+            "hostname": _hostname(),
+            "name": name,
+            "command": command,
+            "start": time.time(),
+            "ticks": _ticks(process.pid),
+            "end": None,
+            "status": "running",
+            "exit": None,
+        }
+        with self._lock:
+            self._load()
+            key = self._key(process.pid)
+            self.records[key] = record
+            self._children[key] = process
+        self.save()
+        return record
+
+    def finish(self, process):
+        """
+        Records the exit status of a registered process that terminated.
+        """
+        with self._lock:
+            self._load()
+            key = self._key(process.pid)
+            self._children.pop(key, None)
+            record = self.records.get(key)
+            if record is None:
+                return
+            record.update(status="exited", exit=process.returncode, end=time.time())
+        self.save()
+
+    def reap(self):
+        """
+        Updates the status of the running records of this host.
+
+        Returns:
+            int: The number of records that changed to exited.
+        """
+        changed = 0
+        hostname = _hostname()
+        with self._lock:
+            self._load()
+            for key, record in self.records.items():
+                if record["status"] != "running" or record["hostname"] != hostname:
+                    continue
+                process = self._children.get(key)
+                if process is not None:
+                    if _poll(process) is None:
+                        continue
+                    del self._children[key]
+                    record.update(exit=process.returncode)
+                elif _alive(record["pid"], record.get("ticks")):
+                    continue
+                record.update(status="exited", end=time.time())
+                changed += 1
+        if changed:
+            self.save()
+        return changed
+
+    def list(self, name=None, running=False):
+        """
+        Lists the records.
+
+        Args:
+            name (str): Only records of this instance.
+            running (bool): Only processes that are still running.
+
+        Returns:
+            list: The records ordered by start time.
+        """
+        self.reap()
+        with self._lock:
+            records = sorted(self.records.values(), key=lambda r: r["start"])
+        return [
+            record
+            for record in records
+            if (name is None or record["name"] == name)
+            and (not running or record["status"] == "running")
+        ]
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self.records)
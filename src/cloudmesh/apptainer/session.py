@@ -0,0 +1,216 @@
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.apptainer import ApptainerError
+from cloudmesh.apptainer.apptainer import ApptainerTimeout
+from cloudmesh.apptainer.transport import LocalTransport
+
+
+class ExecSession:
+    """
+    Runs many commands in an instance over one long lived shell.
+
+    The session starts apptainer exec instance://NAME /bin/sh once and
+    writes the commands to the stdin of that shell. After each command
+    the shell prints a random marker and the exit code to stdout and the
+    marker to stderr, so the output of every command is framed and a
+    command only costs a round trip instead of starting apptainer.
+
+    The commands run one after the other in the same shell, so changes
+    of the working directory or of variables are kept between them.
+    Their stdin is /dev/null.
+
+    Example:
+        with ExecSession(name="tf") as session:
+            for i in range(1000):
+                stdout, stderr = session.exec(f"cat /data/{i}.txt")
+                print(session.returncode)
+    """
+
+    def __init__(
+        self,
+        apptainer=None,
+        name=None,
+        bind=None,
+        nv=False,
+        home=None,
+        shell="/bin/sh",
+        timeout=None,
+    ):
+        """
+        Args:
+            apptainer (Apptainer): Used for the default timeout and the
+                transport to the host of the instance.
+            name (str): The instance.
+            bind (list): Bind paths as in Apptainer.exec.
+            nv (bool): Enable Nvidia support.
+            home (str): The home directory.
+            shell (str): The shell started in the instance.
+            timeout (float): The default timeout of exec() in seconds.
+                If None the timeout of apptainer is used.
+        """
+        if name is None:
+            raise ValueError("Name of the instance must be specified")
+        self.name = name
+        self.command = Apptainer._command(
+            Apptainer._exec_command(name, [shell], bind=bind, nv=nv, home=home)
+        )
+        self.transport = apptainer.transport if apptainer else LocalTransport()
+        self.timeout = apptainer.timeout if timeout is None and apptainer else timeout
+        self.returncode = None
+        self.process = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """
+        Starts the shell in the instance.
+
+        Returns:
+            ExecSession: self
+        """
+        if self.process is None:
+            self.process = self.transport.popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        return self
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        self._release()
+
+    def _release(self):
+        for pipe in [self.process.stdin, self.process.stdout, self.process.stderr]:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        self.process = None
+
+    def close(self, timeout=5):
+        """
+        Ends the shell. It is killed if it does not exit within timeout.
+        """
+        with self._lock:
+            if self.process is None:
+                return
+            try:
+                self.process.stdin.write(b"exit\n")
+                self.process.stdin.close()
+                self.process.wait(timeout=timeout)
+                self._release()
+            except (OSError, subprocess.TimeoutExpired):
+                self._kill()
+
+    def exec(self, command, timeout=None):
+        """
+        Runs a command in the session.
+
+        Args:
+            command (str): The command. It is run by the shell.
+            timeout (float): Seconds to wait for the command. If None the
+                timeout of the session. The session is closed if the
+                command does not finish in time.
+
+        Returns:
+            tuple: A tuple containing the stdout and stderr of the command.
+                The exit code is stored in self.returncode.
+
+        Raises:
+            ApptainerTimeout: If the command did not finish in time.
+            ApptainerError: If the shell ended, e.g. because the command
+                called exit.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            if self.process is None:
+                self.open()
+            marker = f"__cloudmesh_{uuid.uuid4().hex}__".encode()
+            script = (
+                b"{ " + command.encode() + b"\n} </dev/null\n"
+                b"__cloudmesh_rc=$?\n"
+                b"printf '\\n%s %d\\n' '" + marker + b"' $__cloudmesh_rc\n"
+                b"printf '\\n%s\\n' '" + marker + b"' >&2\n"
+            )
+            try:
+                self.process.stdin.write(script)
+                self.process.stdin.flush()
+            except OSError:
+                self._kill()
+                raise ApptainerError(
+                    f"The session in {self.name} has ended", command=command
+                )
+            return self._read(command, marker, timeout)
+
+    def _read(self, command, marker, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buffers = {"stdout": bytearray(), "stderr": bytearray()}
+        # the position of the end marker in a buffer once it was seen
+        found = {}
+        done = {}
+        selector = selectors.DefaultSelector()
+        selector.register(self.process.stdout, selectors.EVENT_READ, "stdout")
+        selector.register(self.process.stderr, selectors.EVENT_READ, "stderr")
+        end = b"\n" + marker
+        try:
+            while len(done) < 2:
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        self._kill()
+                        raise ApptainerTimeout(
+                            f"Command did not finish within {timeout} seconds: "
+                            f"{command}",
+                            command=command,
+                            stdout=buffers["stdout"].decode(errors="replace"),
+                            stderr=buffers["stderr"].decode(errors="replace"),
+                        )
+                for key, events in selector.select(wait):
+                    tag = key.data
+                    data = os.read(key.fileobj.fileno(), 65536)
+                    if not data:
+                        self._kill()
+                        raise ApptainerError(
+                            f"The session in {self.name} has ended",
+                            command=command,
+                            stdout=buffers["stdout"].decode(errors="replace"),
+                            stderr=buffers["stderr"].decode(errors="replace"),
+                        )
+                    buffer = buffers[tag]
+                    buffer += data
+                    if tag not in found:
+                        # only the new data and a marker split before it
+                        start = max(0, len(buffer) - len(data) - len(end))
+                        index = buffer.find(end, start)
+                        if index >= 0:
+                            found[tag] = index
+                    if tag in found and buffer.endswith(b"\n"):
+                        done[tag] = bytes(buffer[found[tag] + len(end) :])
+                        del buffer[found[tag] :]
+                        selector.unregister(key.fileobj)
+        finally:
+            selector.close()
+        self.returncode = int(done["stdout"].split()[0])
+        return (
+            buffers["stdout"].decode(errors="replace"),
+            buffers["stderr"].decode(errors="replace"),
+        )
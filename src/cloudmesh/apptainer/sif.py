@@ -0,0 +1,259 @@
+import json
+import mmap
+import struct
+import uuid
+
+SIF_MAGIC = b"SIF_MAGIC\0"
+
+# global header: launch script, magic, version, arch, id, ctime, mtime,
+# dfree, dtotal, descoff, desclen, dataoff, datalen
+HEADER = struct.Struct("<32s10s3s3s16sqqqqqqqq")
+
+# descriptor: datatype, used, id, groupid, linkedid, offset, size,
+# sizewithpadding, ctime, mtime, uid, gid, name, extra
+DESCRIPTOR = struct.Struct("<iBIIIqqqqqqq128s384s")
+
+DATA_TYPES = {
+    0x4001: "Def.FILE",
+    0x4002: "Env.Vars",
+    0x4003: "JSON.Labels",
+    0x4004: "FS",
+    0x4005: "Signature",
+    0x4006: "JSON.Generic",
+    0x4007: "Generic/Raw",
+    0x4008: "Cryptographic Message",
+    0x4009: "SBOM",
+    0x400A: "OCI.RootIndex",
+    0x400B: "OCI.Blob",
+}
+
+DATA_LABELS = 0x4003
+DATA_GENERIC = 0x4006
+
+
+class SifError(ValueError):
+    """Raised if a file can not be read as a SIF image."""
+
+
+def _string(data):
+    return data.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+class SifImage:
+    """
+    Reads the global header and descriptor table of a SIF image.
+
+    The file is memory mapped, so only the pages holding the header, the
+    descriptors, and the requested data objects are read from disk.
+
+    Example:
+        with SifImage("tf.sif") as image:
+            print(image.header["arch"])
+            print(image.labels())
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.descriptors = []
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SifError(f"{path} is empty")
+        try:
+            self._read()
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _read(self):
+        if len(self._map) < HEADER.size:
+            raise SifError(f"{self.path} is too small to be a SIF image")
+        (
+            launch,
+            magic,
+            version,
+            arch,
+            image_id,
+            ctime,
+            mtime,
+            dfree,
+            dtotal,
+            descoff,
+            desclen,
+            dataoff,
+            datalen,
+        ) = HEADER.unpack_from(self._map, 0)
+        if magic != SIF_MAGIC:
+            raise SifError(f"{self.path} is not a SIF image")
+        if dtotal < 0 or descoff + dtotal * DESCRIPTOR.size > len(self._map):
+            raise SifError(f"{self.path} has a truncated descriptor table")
+        self.header = {
+            "launch": _string(launch),
+            "version": _string(version),
+            "arch": _string(arch),
+            "id": str(uuid.UUID(bytes=image_id)),
+            "ctime": ctime,
+            "mtime": mtime,
+            "dfree": dfree,
+            "dtotal": dtotal,
+            "descoff": descoff,
+            "desclen": desclen,
+            "dataoff": dataoff,
+            "datalen": datalen,
+        }
+        for i in range(dtotal):
+            (
+                datatype,
+                used,
+                object_id,
+                groupid,
+                linkedid,
+                offset,
+                size,
+                sizewithpadding,
+                ctime,
+                mtime,
+                uid,
+                gid,
+                name,
+                extra,
+            ) = DESCRIPTOR.unpack_from(self._map, descoff + i * DESCRIPTOR.size)
+            if not used:
+                continue
+            if offset < 0 or size < 0 or offset + size > len(self._map):
+                raise SifError(f"{self.path} has a truncated data object {object_id}")
+            self.descriptors.append(
+                {
+                    "datatype": datatype,
+                    "type": DATA_TYPES.get(datatype, hex(datatype)),
+                    "id": object_id,
+                    "groupid": groupid,
+                    "linkedid": linkedid,
+                    "offset": offset,
+                    "size": size,
+                    "name": _string(name),
+                }
+            )
+
+    def data(self, descriptor):
+        """
+        Returns the content of a data object.
+
+        Args:
+            descriptor (dict): A descriptor from self.descriptors.
+
+        Returns:
+            bytes: The data.
+        """
+        offset = descriptor["offset"]
+        return self._map[offset : offset + descriptor["size"]]
+
+    def find(self, datatype):
+        """
+        Returns the first descriptor of the given data type or None.
+        """
+        for descriptor in self.descriptors:
+            if descriptor["datatype"] == datatype:
+                return descriptor
+        return None
+
+    def _json(self, descriptor):
+        return json.loads(self.data(descriptor).rstrip(b"\0") or b"{}")
+
+    def metadata(self):
+        """
+        Returns the inspect metadata apptainer stores in the image.
+
+        apptainer build and pull keep it in a JSON.Generic data object in
+        the form of apptainer inspect --json. JSON.Generic objects holding
+        other data are skipped.
+
+        Returns:
+            dict: The metadata or None if the image has none.
+        """
+        for descriptor in self.descriptors:
+            if descriptor["datatype"] != DATA_GENERIC:
+                continue
+            try:
+                data = self._json(descriptor)
+            except ValueError:
+                continue
+            if isinstance(data, dict) and isinstance(
+                (data.get("data") or {}).get("attributes"), dict
+            ):
+                return data
+        return None
+
+    def labels(self):
+        """
+        Returns the labels of the image.
+
+        They are read from the inspect metadata and, for images without
+        one, from the JSON labels data object.
+
+        Returns:
+            dict: The labels or None if the image has neither object.
+        """
+        metadata = self.metadata()
+        if metadata is not None:
+            return metadata["data"]["attributes"].get("labels") or {}
+        descriptor = self.find(DATA_LABELS)
+        if descriptor is None:
+            return None
+        try:
+            return self._json(descriptor)
+        except ValueError as e:
+            raise SifError(f"{self.path} has invalid labels: {e}")
+
+    def inspect(self):
+        """
+        Returns the labels in the form produced by apptainer inspect --json.
+
+        Returns:
+            dict: {"type": "container", "data": {"attributes": {"labels": ...}}}
+
+        Raises:
+            SifError: If the image has neither inspect metadata nor a labels
+                object. The labels of such images are only found inside the
+                container file system.
+        """
+        labels = self.labels()
+        if labels is None:
+            raise SifError(f"{self.path} has no labels data object")
+        metadata = self.metadata() or {}
+        return {
+            "type": metadata.get("type", "container"),
+            "data": {"attributes": {"labels": labels}},
+        }
+
+
+def is_sif(path):
+    """
+    Checks if a file has a valid SIF header and descriptor table.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        bool: True if the file is a SIF image.
+    """
+    try:
+        with SifImage(path):
+            return True
+    except (OSError, SifError):
+        return False
@@ -0,0 +1,294 @@
+import json
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+METRICS = ["cpu", "memory", "io", "pids"]
+
+
+def parse_stats(data):
+    """
+    Extracts the counters from the output of apptainer instance stats --json.
+
+    Args:
+        data (dict or str): The output with the keys cpu_stats, memory_stats,
+            blkio_stats, and pids_stats.
+
+    Returns:
+        dict: The keys cpu (CPU time in nanoseconds), memory (bytes), io
+            (bytes read and written), and pids (number of processes).
+            Values that are not present are None.
+    """
+    if isinstance(data, str):
+        data = json.loads(data)
+    cpu = (data.get("cpu_stats") or {}).get("cpu_usage") or {}
+    memory = (data.get("memory_stats") or {}).get("usage") or {}
+    blkio = (data.get("blkio_stats") or {}).get("io_service_bytes_recursive")
+    pids = data.get("pids_stats") or {}
+    io = None
+    if blkio is not None:
+        io = sum(
+            entry.get("value", 0)
+            for entry in blkio
+            if str(entry.get("op", "")).lower() in ["read", "write"]
+        )
+    return {
+        "cpu": cpu.get("total_usage"),
+        "memory": memory.get("usage"),
+        "io": io,
+        "pids": pids.get("current"),
+    }
+
+
+class RingBuffer:
+    """
+    Fixed size time series of floats.
+
+    The timestamps and values are kept in two preallocated arrays, so
+    appending a sample does not allocate and the memory used is
+    2 * size * 8 bytes no matter how long the collector runs.
+    """
+
+    def __init__(self, size=600):
+        self.size = size
+        self.times = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.count = 0
+        self.next = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, value):
+        self.times[self.next] = t
+        self.values[self.next] = value
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def last(self):
+        if self.count == 0:
+            return None
+        return self.values[(self.next - 1) % self.size]
+
+    def window(self, seconds=None, now=None):
+        """
+        Returns the values of the last seconds, oldest first.
+
+        Args:
+            seconds (float): The length of the window. If None all values.
+            now (float): The end of the window. If None the current time.
+
+        Returns:
+            list: The values.
+        """
+        start = (self.next - self.count) % self.size
+        indices = [(start + i) % self.size for i in range(self.count)]
+        if seconds is None:
+            return [self.values[i] for i in indices]
+        since = (time.time() if now is None else now) - seconds
+        return [self.values[i] for i in indices if self.times[i] >= since]
+
+    def summary(self, seconds=None, now=None):
+        """
+        Summarizes the values of a window.
+
+        Args:
+            seconds (float): The length of the window. If None all values.
+            now (float): The end of the window. If None the current time.
+
+        Returns:
+            dict: The keys count, last, min, max, mean, p50, p90, and p99.
+                Without values all but count are None.
+        """
+        values = sorted(self.window(seconds=seconds, now=now))
+        result = {"count": len(values), "last": self.last()}
+        if not values:
+            result.update(dict.fromkeys(["min", "max", "mean", "p50", "p90", "p99"]))
+            result["last"] = None
+            return result
+        result.update(
+            min=values[0],
+            max=values[-1],
+            mean=sum(values) / len(values),
+        )
+        for p in [50, 90, 99]:
+            rank = max(0, -(-p * len(values) // 100) - 1)
+            result[f"p{p}"] = values[rank]
+        return result
+
+
+class StatsCollector:
+    """
+    Samples the resource usage of all running instances in the background.
+
+    Every interval seconds the running instances are listed and their
+    counters are read, by default from their cgroup v2 files (see
+    Apptainer.counters). For every instance the CPU usage in percent, the
+    memory in bytes, the I/O rate in bytes per second, and the number of
+    processes are appended to a RingBuffer of the given size. The CPU and
+    I/O rates are computed from the difference to the previous sample.
+    Instances that are no longer running are dropped.
+
+    Example:
+        collector = StatsCollector(Apptainer(), interval=1, size=3600)
+        collector.start()
+        ...
+        print(collector.summary(window=60))
+        collector.stop()
+    """
+
+    def __init__(
+        self, apptainer=None, interval=1.0, size=600, source=None, max_workers=8
+    ):
+        """
+        Args:
+            apptainer (Apptainer): Used to list the instances and, if source
+                is None, to read their counters with counters().
+            interval (float): Seconds between two samples.
+            size (int): The number of samples kept per instance and metric.
+            source (function): Called as source(instance) with an entry of
+                info()["instances"]; returns a dict as parse_stats() does.
+            max_workers (int): The number of instances read at the same time.
+        """
+        self.apptainer = apptainer
+        self.interval = interval
+        self.size = size
+        self.source = source or self._read
+        self.max_workers = max_workers
+        self.series = {}
+        self.errors = {}
+        self.error = None
+        self._previous = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read(self, instance):
+        return self.apptainer.counters(instance)
+
+    def _instances(self):
+        # runs on the sampler thread, which must not write the database
+        return self.apptainer.info(save=False)["instances"]
+
+    def _counters(self, instance):
+        try:
+            return instance["instance"], self.source(instance), None
+        except Exception as e:
+            return instance["instance"], None, str(e)
+
+    def sample(self):
+        """
+        Reads the counters of all running instances once.
+
+        Returns:
+            int: The number of instances sampled.
+        """
+        instances = self._instances()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._counters, instances))
+        now = time.time()
+        with self._lock:
+            running = {name for name, counters, error in results}
+            for name in list(self.series):
+                if name not in running:
+                    del self.series[name]
+                    self._previous.pop(name, None)
+                    self.errors.pop(name, None)
+            sampled = 0
+            for name, counters, error in results:
+                if counters is None:
+                    self.errors[name] = error
+                    continue
+                self.errors.pop(name, None)
+                series = self.series.setdefault(
+                    name, {metric: RingBuffer(self.size) for metric in METRICS}
+                )
+                previous = self._previous.get(name)
+                self._previous[name] = (now, counters)
+                for metric in ["memory", "pids"]:
+                    if counters.get(metric) is not None:
+                        series[metric].append(now, counters[metric])
+                if previous is not None and now > previous[0]:
+                    elapsed = now - previous[0]
+                    for metric, scale in [("cpu", 100 / 1e9), ("io", 1)]:
+                        value = counters.get(metric)
+                        before = previous[1].get(metric)
+                        if None in (value, before) or value < before:
+                            continue
+                        series[metric].append(now, (value - before) * scale / elapsed)
+                sampled += 1
+        return sampled
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sample()
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """
+        Starts sampling in a daemon thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="apptainer-stats", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling and waits for the thread to end.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def summary(self, name=None, window=None):
+        """
+        Summarizes the samples.
+
+        Args:
+            name (str): Only this instance.
+            window (float): Only the samples of the last window seconds.
+
+        Returns:
+            dict: {instance: {metric: RingBuffer.summary()}}
+        """
+        now = time.time()
+        with self._lock:
+            return {
+                instance: {
+                    metric: buffer.summary(seconds=window, now=now)
+                    for metric, buffer in series.items()
+                }
+                for instance, series in self.series.items()
+                if name is None or instance == name
+            }
+
+    def table(self, name=None, window=None):
+        """
+        Returns the summary as a list of rows for printing.
+
+        Returns:
+            list: A dict per instance and metric.
+        """
+        return [
+            dict(name=instance, metric=metric, **values)
+            for instance, metrics in self.summary(name=name, window=window).items()
+            for metric, values in metrics.items()
+        ]
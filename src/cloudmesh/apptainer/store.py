@@ -0,0 +1,105 @@
+import errno
+import hashlib
+import mmap
+import os
+
+CHUNK = 16 * 1024 * 1024
+
+
+def file_digest(path, chunk=CHUNK):
+    """
+    Computes the sha256 digest of a file.
+
+    The file is memory mapped and hashed in chunks, so large images are
+    not copied into Python memory and hashlib can run without the GIL.
+
+    Args:
+        path (str): The file.
+        chunk (int): The number of bytes hashed at a time.
+
+    Returns:
+        str: The digest in the form sha256:<hex>.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                view = memoryview(data)
+                try:
+                    for offset in range(0, len(data), chunk):
+                        sha.update(view[offset : offset + chunk])
+                finally:
+                    view.release()
+    return f"sha256:{sha.hexdigest()}"
+
+
+def deduplicate(paths, mode="hardlink", dry_run=False, digest=None, verify=None):
+    """
+    Replaces copies of the same image by links to the first one.
+
+    The link is created under a temporary name and renamed over the copy,
+    so the path always refers to a complete image. A hard link is used if
+    mode is hardlink and the files are on the same file system, otherwise
+    a symbolic link to the absolute path of the first image.
+
+    If digest is given, every file is checked right before it is linked
+    and files that no longer have that digest are left alone, so a file
+    rewritten since it was hashed is never replaced.
+
+    Args:
+        paths (list): Paths of files with identical content.
+        mode (str): hardlink or symlink.
+        dry_run (bool): Only report what would be linked.
+        digest (str): The digest the files are expected to have.
+        verify (function): Called as verify(path); returns the current
+            digest of the file. If None file_digest is used.
+
+    Returns:
+        list: A dict per replaced copy with the keys path, target, mode,
+            and bytes (the space freed).
+    """
+    if mode not in ["hardlink", "symlink"]:
+        raise ValueError(f"mode must be hardlink or symlink, not {mode}")
+    if digest is not None:
+        verify = verify or file_digest
+
+        def current(path):
+            try:
+                return verify(path) == digest
+            except OSError:
+                return False
+
+        paths = [path for path in paths if current(path)]
+        if len(paths) < 2:
+            return []
+    target, *copies = paths
+    stat = os.stat(target)
+    result = []
+    for path in copies:
+        if os.path.islink(path) and os.path.realpath(path) == os.path.realpath(target):
+            continue
+        copy = os.stat(path)
+        if copy.st_ino == stat.st_ino and copy.st_dev == stat.st_dev:
+            continue
+        link = mode
+        if link == "hardlink" and copy.st_dev != stat.st_dev:
+            link = "symlink"
+        freed = copy.st_size if copy.st_nlink == 1 else 0
+        if not dry_run:
+            tmp = f"{path}.dedup.tmp"
+            if link == "hardlink":
+                try:
+                    os.link(target, tmp)
+                except OSError as e:
+                    if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+                        raise
+                    link = "symlink"
+            if link == "symlink":
+                os.symlink(os.path.abspath(target), tmp)
+            try:
+                os.replace(tmp, path)
+            except:
+                os.remove(tmp)
+                raise
+        result.append({"path": path, "target": target, "mode": link, "bytes": freed})
+    return result
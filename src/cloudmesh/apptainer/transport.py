@@ -0,0 +1,221 @@
+import os
+import socket
+import subprocess
+
+from cloudmesh.common.util import path_expand
+
+
+class Transport:
+    """
+    Runs shell command lines for Apptainer.system() on a host.
+
+    A transport turns a command line into the arguments of a process
+    started on this host. The process runs in its own session, so
+    Apptainer can kill it with its process group.
+    """
+
+    local = True
+
+    def __init__(self, host=None):
+        self.host = host or "localhost"
+
+    def wrap(self, command):
+        """
+        Returns the arguments of the local process that runs a command.
+
+        Args:
+            command (str): The shell command line.
+
+        Returns:
+            tuple: The arguments for subprocess.Popen and whether they are
+                run with shell=True.
+        """
+        raise NotImplementedError
+
+    def popen(self, command, **kwargs):
+        """
+        Starts a command.
+
+        Args:
+            command (str): The shell command line.
+            kwargs: Passed to subprocess.Popen, e.g. stdout and stderr.
+
+        Returns:
+            Popen: The process.
+        """
+        arguments, shell = self.wrap(command)
+        return subprocess.Popen(
+            arguments, shell=shell, start_new_session=True, **kwargs
+        )
+
+    def close(self):
+        """
+        Releases the connections kept by the transport.
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.host!r})"
+
+
+class LocalTransport(Transport):
+    """
+    Runs the commands on this host with /bin/sh.
+    """
+
+    def wrap(self, command):
+        return command, True
+
+
+class SshTransport(Transport):
+    """
+    Runs the commands on a remote host with ssh.
+
+    All commands to a host share one connection. The first command opens
+    a master connection with ControlMaster=auto; it stays in the
+    background for persist seconds after the last command and later
+    commands, also those of other processes, are multiplexed over its
+    control socket instead of opening a new connection. The socket is
+    kept in control_dir and named by a hash of the host, port, and user.
+
+    ssh runs in batch mode, so a host that asks for a password fails
+    instead of blocking. The standard input of a command is /dev/null
+    unless a stdin is passed to popen().
+
+    Example:
+        with SshTransport("node1", user="alice") as transport:
+            apptainer = Apptainer(host="node1", transport=transport)
+            apptainer.list()
+    """
+
+    local = False
+
+    CONTROL_DIR = "~/.cloudmesh/apptainer/ssh"
+
+    def __init__(
+        self,
+        host=None,
+        user=None,
+        port=None,
+        persist=600,
+        control_dir=None,
+        options=None,
+        ssh="ssh",
+    ):
+        """
+        Args:
+            host (str): The remote host.
+            user (str): The remote user. If None the one of the ssh config.
+            port (int): The ssh port. If None the one of the ssh config.
+            persist (int): Seconds the master connection is kept open
+                after the last command.
+            control_dir (str): The directory of the control sockets.
+            options (list): Further arguments for ssh, e.g. ["-i", key].
+            ssh (str): The ssh command.
+        """
+        if host is None:
+            raise ValueError("Host of the transport must be specified")
+        super().__init__(host)
+        self.user = user
+        self.port = port
+        self.persist = persist
+        self.control_dir = path_expand(control_dir or self.CONTROL_DIR)
+        self.options = list(options or [])
+        self.ssh = ssh
+
+    @property
+    def destination(self):
+        return f"{self.user}@{self.host}" if self.user else self.host
+
+    def _arguments(self):
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+        arguments = [
+            self.ssh,
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={os.path.join(self.control_dir, '%C')}",
+            "-o",
+            f"ControlPersist={self.persist}",
+        ]
+        if self.port:
+            arguments += ["-p", str(self.port)]
+        return arguments + self.options
+
+    def wrap(self, command):
+        return self._arguments() + [self.destination, command], False
+
+    def popen(self, command, **kwargs):
+        kwargs.setdefault("stdin", subprocess.DEVNULL)
+        return super().popen(command, **kwargs)
+
+    def _control(self, operation):
+        return subprocess.run(
+            self._arguments() + ["-O", operation, self.destination],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode
+
+    def connected(self):
+        """
+        Returns:
+            bool: True if a master connection to the host is open.
+        """
+        return self._control("check") == 0
+
+    def close(self):
+        """
+        Closes the master connection to the host.
+        """
+        if self.connected():
+            self._control("exit")
+
+
+TRANSPORTS = {"local": LocalTransport, "ssh": SshTransport}
+
+
+def is_local(host):
+    """
+    Returns:
+        bool: True if host is None or names this host.
+    """
+    if not host:
+        return True
+    names = {"localhost", "127.0.0.1", "::1", socket.gethostname(), os.uname()[1]}
+    if os.environ.get("HOSTNAME"):
+        names.add(os.environ["HOSTNAME"])
+    return host in names or host.split(".")[0] in names
+
+
+def get_transport(transport=None, host=None, **kwargs):
+    """
+    Returns the transport for a host.
+
+    Args:
+        transport (str or Transport): A transport, or the name of one in
+            TRANSPORTS. If None local is used for this host and ssh for
+            all other hosts.
+        host (str): The host.
+        kwargs: Passed to the transport, e.g. user or port for ssh.
+
+    Returns:
+        Transport: The transport.
+    """
+    if transport is not None and not isinstance(transport, str):
+        return transport
+    if transport is None:
+        transport = "local" if is_local(host) else "ssh"
+    if transport not in TRANSPORTS:
+        raise ValueError(
+            f"unknown transport {transport}, use one of {', '.join(TRANSPORTS)}"
+        )
+    return TRANSPORTS[transport](host, **kwargs)
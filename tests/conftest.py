@@ -0,0 +1,190 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from cloudmesh.apptainer.apptainer import Apptainer
+
+FAKE_APPTAINER = '''#!{python}
+"""A stand-in for the apptainer command used by the tests.
+
+The instances are kept in $FAKE_APPTAINER_STATE/instances.json.
+"""
+import fcntl
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+state = os.path.join(os.environ["FAKE_APPTAINER_STATE"], "instances.json")
+lock = open(state + ".lock", "w")
+
+
+def load():
+    try:
+        with open(state) as f:
+            return json.load(f)
+    except OSError:
+        return []
+
+
+def dump(instances):
+    with open(state, "w") as f:
+        json.dump(instances, f)
+
+
+def positional(arguments):
+    result = []
+    skip = False
+    for argument in arguments:
+        if skip:
+            skip = False
+        elif argument in ["--home", "--bind", "--signal", "--timeout", "--user"]:
+            skip = True
+        elif not argument.startswith("--"):
+            result.append(argument)
+    return result
+
+
+arguments = sys.argv[1:]
+if arguments[:2] == ["instance", "stop"] and "--force" not in arguments:
+    time.sleep(float(os.environ.get("FAKE_APPTAINER_STOP_DELAY", "0")))
+if arguments[:2] in (["instance", "start"], ["instance", "stop"]):
+    fcntl.flock(lock, fcntl.LOCK_EX)
+if arguments[:2] == ["instance", "list"]:
+    print(json.dumps({{"instances": load()}}))
+elif arguments[:2] == ["instance", "start"]:
+    path, name = positional(arguments[2:])[:2]
+    instances = [i for i in load() if i["instance"] != name]
+    instances.append(
+        {{
+            "instance": name,
+            "pid": os.getpid(),
+            "img": path,
+            "ip": "",
+            "logErrPath": f"/tmp/{{name}}.err",
+            "logOutPath": f"/tmp/{{name}}.out",
+        }}
+    )
+    dump(instances)
+    print(f"INFO:    instance started successfully", file=sys.stderr)
+elif arguments[:2] == ["instance", "stop"]:
+    names = positional(arguments[2:])
+    instances = load()
+    if "--all" in arguments:
+        names = [i["instance"] for i in instances]
+    found = [i for i in instances if i["instance"] in names]
+    if not found:
+        print(f"FATAL:   no instance found with name {{names}}", file=sys.stderr)
+        sys.exit(255)
+    dump([i for i in instances if i["instance"] not in names])
+    for i in found:
+        print(f"INFO:    Stopping {{i['instance']}} instance of {{i['img']}}", file=sys.stderr)
+elif arguments[:2] == ["instance", "stats"]:
+    name = positional(arguments[2:])[0]
+    if name not in [i["instance"] for i in load()]:
+        print(f"FATAL:   no instance found with name {{name}}", file=sys.stderr)
+        sys.exit(255)
+    # half a CPU, 1 MB of I/O per second
+    now = time.time()
+    print(
+        json.dumps(
+            {{
+                "cpu_stats": {{"cpu_usage": {{"total_usage": int(now * 5e8)}}}},
+                "memory_stats": {{"usage": {{"usage": 1024 * 1024}}}},
+                "blkio_stats": {{
+                    "io_service_bytes_recursive": [
+                        {{"op": "Read", "value": int(now * 5e5)}},
+                        {{"op": "Write", "value": int(now * 5e5)}},
+                        {{"op": "Total", "value": int(now * 1e6)}},
+                    ]
+                }},
+                "pids_stats": {{"current": 2}},
+            }}
+        )
+    )
+elif arguments[0] == "pull":
+    # pull [--force] NAME URL: file://PATH is copied, bad://... writes a
+    # file that is not a SIF image, fail://... writes part of a file and
+    # fails, other URLs write a SIF image holding the URL. Every pull is
+    # logged to pulls.log
+    name, url = positional(arguments[1:])[:2]
+    with open(os.path.join(os.environ["FAKE_APPTAINER_STATE"], "pulls.log"), "a") as f:
+        f.write(f"{{name}} {{url}}\\n")
+    time.sleep(float(os.environ.get("FAKE_APPTAINER_PULL_DELAY", "0")))
+    if os.path.exists(name) and "--force" not in arguments:
+        print(f"FATAL:   Image file already exists: {{name}}", file=sys.stderr)
+        sys.exit(255)
+    if url.startswith("fail://"):
+        with open(name, "wb") as f:
+            f.write(b"SIF_")
+        print(f"FATAL:   could not pull {{url}}", file=sys.stderr)
+        sys.exit(255)
+    if url.startswith("file://"):
+        with open(url[len("file://"):], "rb") as f:
+            content = f.read()
+    elif url.startswith("bad://"):
+        content = url.encode()
+    else:
+        header = "<32s10s3s3s16sqqqqqqqq"
+        size = struct.calcsize(header)
+        content = struct.pack(
+            header, b"#!/usr/bin/env run-singularity\\n", b"SIF_MAGIC\\0",
+            b"01\\0", b"02\\0", bytes(16), 0, 0, 0, 0, size, 0, size, len(url),
+        ) + url.encode()
+    with open(name, "wb") as f:
+        f.write(content)
+elif arguments[0] == "exec":
+    rest = arguments[1:]
+    while rest and not rest[0].startswith("instance://"):
+        rest = rest[2:] if rest[0] in ["--bind", "--home"] else rest[1:]
+    sys.exit(subprocess.call(rest[1:]))
+else:
+    print(f"FATAL:   unknown command {{arguments}}", file=sys.stderr)
+    sys.exit(255)
+'''
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """Runs the test in tmp_path, which is also HOME and holds ~/.cloudmesh.
+
+    The cms variables, e.g. apptainer_db, of the user running the tests
+    are not seen.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.delenv("CLOUDMESH_CONFIG_DIR", raising=False)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def fake_apptainer(home, tmp_path, monkeypatch):
+    """Puts a fake apptainer command in the PATH and runs the test in tmp_path."""
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    script = bin / "apptainer"
+    script.write_text(FAKE_APPTAINER.format(python=sys.executable))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_APPTAINER_STATE", str(tmp_path))
+    return script
+
+
+@pytest.fixture
+def apptainer(fake_apptainer):
+    """An Apptainer for the fake apptainer command."""
+    return Apptainer()
+
+
+@pytest.fixture
+def images(fake_apptainer):
+    """Adds the location images holding an empty tf.sif to the database."""
+    os.mkdir("images")
+    with open("images/tf.sif", "wb") as f:
+        f.write(b"\0")
+    Apptainer().add_location("images")
+    return "images"
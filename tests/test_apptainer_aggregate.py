@@ -0,0 +1,171 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_aggregate.py
+# pytest -v  tests/test_apptainer_aggregate.py
+# pytest -v --capture=no  tests/test_apptainer_aggregate.py::TestAggregate::<METHODNAME>
+###############################################################
+import os
+import time
+
+import pytest
+import yaml
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.aggregate import CatalogAggregator
+from cloudmesh.apptainer.db import migrate
+
+
+def write(hostname, images, instances=(), directory=None):
+    directory = directory or hostname
+    os.makedirs(directory, exist_ok=True)
+    data = {
+        "cloudmesh": {
+            "apptainer": {
+                "hostname": hostname,
+                "location": [],
+                "images": [
+                    {
+                        "name": name,
+                        "path": f"/images/{name}",
+                        "hostname": hostname,
+                        "digest": f"sha256:{name}",
+                    }
+                    for name in images
+                ],
+                "instances": [
+                    {"instance": name, "pid": i, "img": f"/images/{image}"}
+                    for i, (name, image) in enumerate(instances)
+                ],
+            }
+        }
+    }
+    filename = os.path.join(directory, "apptainer.yaml")
+    with open(filename, "w") as f:
+        yaml.safe_dump(data, f)
+    return filename
+
+
+@pytest.fixture
+def nodes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for i in range(20):
+        write(
+            f"node{i:02d}",
+            ["tf.sif"] if i % 2 else ["torch.sif", "tf.sif"],
+            [(f"job{i}", "tf.sif")],
+        )
+    return "node*/apptainer.yaml"
+
+
+class TestAggregate:
+
+    def test_update(self, nodes):
+        HEADING()
+        with CatalogAggregator("catalog.db") as catalog:
+            Benchmark.Start()
+            report = catalog.update([nodes])
+            Benchmark.Stop()
+            assert len(report["read"]) == 20
+            assert report["unchanged"] == 0
+            assert [host["hostname"] for host in catalog.hosts()] == [
+                f"node{i:02d}" for i in range(20)
+            ]
+            assert catalog.hosts()[0]["images"] == 2
+            assert catalog.hosts()[0]["source"] == os.path.abspath(
+                "node00/apptainer.yaml"
+            )
+
+        with CatalogAggregator("catalog.db") as catalog:
+            report = catalog.update()
+            assert report["read"] == []
+            assert report["unchanged"] == 20
+
+            time.sleep(0.01)
+            write("node03", ["torch.sif"])
+            os.remove("node04/apptainer.yaml")
+            report = catalog.update([nodes])
+            assert report["read"] == [os.path.abspath("node03/apptainer.yaml")]
+            assert report["unchanged"] == 18
+            assert report["removed"] == [os.path.abspath("node04/apptainer.yaml")]
+            assert "node04" not in [host["hostname"] for host in catalog.hosts()]
+            assert catalog.instances(hostname="node03") == []
+
+            catalog.update(["node00"])
+            assert catalog.sources() == [os.path.abspath("node00/apptainer.yaml")]
+            assert [host["hostname"] for host in catalog.hosts()] == ["node00"]
+
+    def test_queries(self, nodes):
+        HEADING()
+        catalog = CatalogAggregator(":memory:")
+        catalog.update([nodes])
+        Benchmark.Start()
+        assert catalog.locate(image="torch.sif") == [f"node{i:02d}" for i in range(0, 20, 2)]
+        Benchmark.Stop()
+        assert catalog.locate(digest="sha256:tf.sif") == [f"node{i:02d}" for i in range(20)]
+        assert catalog.locate(instance="job7") == ["node07"]
+        assert catalog.locate(image="missing.sif") == []
+        [instance] = catalog.instances(name="job7")
+        assert instance == {"instance": "job7", "pid": 0, "img": "/images/tf.sif", "hostname": "node07"}
+        images = catalog.images(hostname="node02")
+        assert [image["name"] for image in images] == ["torch.sif", "tf.sif"]
+        assert catalog.images(hostname="node01", name="torch.sif") == []
+        assert len(catalog.instances(image="/images/tf.sif")) == 20
+        catalog.close()
+
+    def test_sqlite_source(self, nodes):
+        HEADING()
+        migrate([f"node{i:02d}/apptainer.yaml" for i in range(3)], "cluster.db")
+        catalog = CatalogAggregator(":memory:")
+        report = catalog.update(["cluster.db", "node05"])
+        assert len(report["read"]) == 2
+        assert [host["hostname"] for host in catalog.hosts()] == [
+            "node00",
+            "node01",
+            "node02",
+            "node05",
+        ]
+        assert catalog.locate(instance="job1") == ["node01"]
+
+        time.sleep(0.01)
+        write("node01", ["tf.sif"], directory="moved")
+        moved = os.path.abspath("moved/apptainer.yaml")
+        report = catalog.update(["cluster.db", "node05", "moved"])
+        assert report["renamed"] == {moved: {"node01": f"node01@{moved}"}}
+        assert catalog.locate(instance="job1") == ["node01"]
+        report = catalog.update(["node05", "moved"])
+        assert report["read"] == [moved]
+        assert [host["hostname"] for host in catalog.hosts()] == ["node01", "node05"]
+        assert catalog.locate(instance="job1") == []
+
+    def test_localhost(self, nodes):
+        HEADING()
+        first = os.path.abspath(write("localhost", ["tf.sif"], directory="a"))
+        second = os.path.abspath(write("localhost", ["torch.sif"], directory="b"))
+        catalog = CatalogAggregator(":memory:")
+        Benchmark.Start()
+        report = catalog.update(["a", "b"])
+        Benchmark.Stop()
+        assert report["renamed"] == {
+            first: {"localhost": f"localhost@{first}"},
+            second: {"localhost": f"localhost@{second}"},
+        }
+        assert catalog.locate(image="tf.sif") == [f"localhost@{first}"]
+        assert catalog.locate(image="torch.sif") == [f"localhost@{second}"]
+        assert catalog.update(["a", "b"])["unchanged"] == 2
+
+        hosts = migrate(["a/apptainer.yaml", "b/apptainer.yaml"], "cluster.db")
+        assert hosts == [f"localhost@{first}", f"localhost@{second}"]
+        hosts = migrate(["node00/apptainer.yaml", "node00/apptainer.yaml"], "copy.db")
+        assert hosts == ["node00", f"node00@{os.path.abspath('node00/apptainer.yaml')}"]
+
+    def test_failed(self, nodes):
+        HEADING()
+        with open("broken.yaml", "w") as f:
+            f.write("cloudmesh: [")
+        catalog = CatalogAggregator(":memory:")
+        report = catalog.update(["broken.yaml", "missing.yaml", "node00"])
+        assert set(report["failed"]) == {
+            os.path.abspath("broken.yaml"),
+            os.path.abspath("missing.yaml"),
+        }
+        assert [host["hostname"] for host in catalog.hosts()] == ["node00"]
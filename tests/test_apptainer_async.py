@@ -0,0 +1,91 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_async.py
+# pytest -v  tests/test_apptainer_async.py
+# pytest -v --capture=no  tests/test_apptainer_async.py::TestAsync::<METHODNAME>
+###############################################################
+import asyncio
+import os
+import time
+
+import pytest
+
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import ApptainerCancelled
+from cloudmesh.apptainer.apptainer import ApptainerTimeout
+from cloudmesh.apptainer.asyncapptainer import AsyncApptainer
+
+# prints the pid of a child that outlives its parent if the group is not killed
+SPAWN = ["sh", "-c", "sleep 30 & echo $!; wait"]
+
+
+def gone(pid):
+    time.sleep(0.2)
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except OSError:
+        return True
+
+
+class TestAsync:
+
+    def test_start_exec_stop(self, fake_apptainer):
+        HEADING()
+        os.mkdir("images")
+        with open("images/tf.sif", "wb") as f:
+            f.write(b"\0")
+        names = [f"tf{i}" for i in range(8)]
+
+        async def run():
+            app = AsyncApptainer(max_concurrency=4)
+            app.add_location("images")
+            for name in names:
+                await app.start(name=name, image="tf.sif", clean=False)
+            instances = await app.list()
+            outputs = await asyncio.gather(
+                *[app.exec(name=name, command=f"echo {name}") for name in names]
+            )
+            await asyncio.gather(*[app.stop(name=name) for name in names])
+            return instances, outputs, await app.list(), app.ps()
+
+        Benchmark.Start()
+        instances, outputs, remaining, processes = asyncio.run(run())
+        Benchmark.Stop()
+        assert sorted(i["instance"] for i in instances) == sorted(names)
+        assert [stdout.strip() for stdout, stderr in outputs] == names
+        assert remaining == []
+        assert sorted(record["name"] for record in processes) == sorted(names)
+        assert {record["exit"] for record in processes} == {0}
+
+    def test_timeout(self, fake_apptainer):
+        HEADING()
+        app = AsyncApptainer()
+        Benchmark.Start()
+        with pytest.raises(ApptainerTimeout) as e:
+            asyncio.run(app.system(command=SPAWN, timeout=0.5))
+        Benchmark.Stop()
+        assert gone(int(e.value.stdout))
+
+    def test_cancel(self, fake_apptainer):
+        HEADING()
+        app = AsyncApptainer()
+
+        async def run(cancel):
+            task = asyncio.ensure_future(app.system(command=SPAWN, name="spawn"))
+            await asyncio.sleep(0.3)
+            pid = next(iter(app.apptainer._running))
+            cancel(task)
+            try:
+                await task
+            except (asyncio.CancelledError, ApptainerCancelled) as e:
+                return pid, type(e)
+
+        pid, error = asyncio.run(run(lambda task: task.cancel()))
+        assert error is asyncio.CancelledError
+        assert gone(pid)
+        pid, error = asyncio.run(run(lambda task: app.cancel(name="spawn")))
+        assert error is ApptainerCancelled
+        assert gone(pid)
+        assert app.apptainer._running == {}
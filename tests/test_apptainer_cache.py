@@ -0,0 +1,155 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_cache.py
+# pytest -v  tests/test_apptainer_cache.py
+# pytest -v --capture=no  tests/test_apptainer_cache.py::TestCache::<METHODNAME>
+###############################################################
+import json
+import os
+import time
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.cache import CacheInspector
+from cloudmesh.apptainer.cache import PullMarker
+from cloudmesh.apptainer.cache import active_pulls
+from cloudmesh.apptainer.cache import cache_directory
+from cloudmesh.apptainer.cache import parse_size
+
+
+def create(path, size, atime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    if atime is not None:
+        os.utime(path, (atime, atime))
+
+
+@pytest.fixture
+def cache(fake_apptainer, tmp_path, monkeypatch):
+    monkeypatch.setenv("APPTAINER_CACHEDIR", str(tmp_path / "apptainer"))
+    directory = cache_directory()
+    blobs = os.path.join(directory, "blob", "blobs", "sha256")
+    for i in range(20):
+        create(os.path.join(blobs, f"{i:064x}"), 1000 + i, atime=1000 + i)
+    create(os.path.join(directory, "blob", "index.json"), 50)
+    create(os.path.join(directory, "library", "a" * 64), 3 * 1024 * 1024, 2000)
+    create(os.path.join(directory, "oci-tmp", "b" * 64, "rootfs.sif"), 2048, 5000)
+    create(os.path.join(directory, "oci-tmp", "b" * 64, "config.json"), 10, 4000)
+    return directory
+
+
+class TestCache:
+
+    def test_directory(self, fake_apptainer, monkeypatch):
+        HEADING()
+        monkeypatch.delenv("APPTAINER_CACHEDIR", raising=False)
+        monkeypatch.setenv("SINGULARITY_CACHEDIR", "/scratch/s")
+        assert cache_directory() == "/scratch/s/cache"
+        monkeypatch.delenv("SINGULARITY_CACHEDIR")
+        assert cache_directory() == os.path.expanduser("~/.apptainer/cache")
+
+    def test_entries(self, cache):
+        HEADING()
+        inspector = CacheInspector()
+        Benchmark.Start()
+        entries = inspector.entries()
+        Benchmark.Stop()
+        assert [entry["category"] for entry in entries] == ["blob"] * 20 + [
+            "library",
+            "oci-tmp",
+        ]
+        assert entries[0]["bytes"] == 1000
+        assert entries[0]["atime"] == 1000
+        assert entries[-1]["bytes"] == 2058
+        assert entries[-1]["atime"] >= 5000
+        summary = inspector.summary(entries)
+        assert summary["blob_files"] == 20
+        assert summary["blob_bytes"] == sum(1000 + i for i in range(20))
+        assert summary["container_files"] == 2
+        assert summary["container_bytes"] == 3 * 1024 * 1024 + 2058
+        assert summary["categories"]["oci-tmp"] == {"files": 1, "bytes": 2058}
+        assert summary["total_bytes"] == summary["blob_bytes"] + summary[
+            "container_bytes"
+        ]
+
+    def test_cache(self, cache):
+        HEADING()
+        data = Apptainer().cache()
+        assert data["Container_Files"] == 2
+        assert data["OCI_Blob_Files"] == 20
+        assert data["OCI_Blob_Space"] != data["Container_Space"]
+        assert data["Container_Space"] == "3.0 MiB"
+        assert data["Total_Bytes"] == data["Container_Bytes"] + data["OCI_Blob_Bytes"]
+        assert "entries" not in data
+        assert len(Apptainer().cache(entries=True)["entries"]) == 22
+
+    def test_empty(self, fake_apptainer):
+        HEADING()
+        data = Apptainer().cache()
+        assert data["Total_Bytes"] == 0
+
+    def test_prune(self, cache):
+        HEADING()
+        inspector = CacheInspector()
+        before = inspector.summary()["total_bytes"]
+        Benchmark.Start()
+        report = inspector.prune(before - 2500, dry_run=True, pulls=[])
+        Benchmark.Stop()
+        assert [entry["name"] for entry in report["removed"]] == [
+            f"{i:064x}" for i in range(3)
+        ]
+        assert report["reclaimed"] == 3003
+        assert inspector.summary()["total_bytes"] == before
+
+        report = inspector.prune(before - 2500, pulls=[])
+        assert report["after"] == before - 3003
+        assert inspector.summary()["blob_files"] == 17
+
+        report = Apptainer().cache_prune("1MB")
+        assert report["after"] <= 1000 * 1000
+        summary = inspector.summary()
+        assert summary["categories"]["library"]["files"] == 0
+        assert summary["total_bytes"] == report["after"]
+
+    def test_prune_pull(self, cache):
+        HEADING()
+        inspector = CacheInspector()
+        with PullMarker("docker://ubuntu"):
+            assert len(active_pulls()) >= 1
+            report = inspector.prune(0, pulls=[4500])
+        assert len(report["protected"]) == 21
+        assert [entry["category"] for entry in report["removed"]] == ["library"]
+        assert inspector.summary()["categories"]["oci-tmp"]["files"] == 1
+        assert os.listdir(os.path.expanduser("~/.cloudmesh/apptainer/pulls")) == []
+
+    def test_shared_markers(self, cache):
+        HEADING()
+        directory = os.path.expanduser("~/.cloudmesh/apptainer/pulls")
+        os.makedirs(directory)
+        now = time.time()
+        markers = {
+            "remote": {"hostname": "node1", "start": now - 60},
+            "stale": {"hostname": "node1", "start": now - 2 * PullMarker.MAX_AGE},
+            "local": {"hostname": os.uname()[1], "start": now - 60},
+        }
+        for name, marker in markers.items():
+            with open(os.path.join(directory, f"{name}.json"), "w") as f:
+                json.dump(dict(marker, pid=2**22 + 1, ticks=None, url=None), f)
+        Benchmark.Start()
+        pulls = active_pulls()
+        Benchmark.Stop()
+        assert now - 60 in pulls
+        assert now - 2 * PullMarker.MAX_AGE not in pulls
+        assert os.listdir(directory) == ["remote.json"]
+
+    def test_parse_size(self):
+        HEADING()
+        assert parse_size("10GB") == 10 * 10**9
+        assert parse_size("1.5GiB") == 3 * 2**29
+        assert parse_size("500m") == 500 * 10**6
+        assert parse_size(42) == 42
+        with pytest.raises(ValueError):
+            parse_size("lots")
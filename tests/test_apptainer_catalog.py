@@ -0,0 +1,94 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_catalog.py
+# pytest -v  tests/test_apptainer_catalog.py
+# pytest -v --capture=no  tests/test_apptainer_catalog.py::TestCatalog::<METHODNAME>
+###############################################################
+import os
+
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.catalog import ImageCatalog
+
+
+def create_sif(path, size=1024):
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+
+
+class TestCatalog:
+
+    def test_refresh(self, tmp_path):
+        HEADING()
+        images = tmp_path / "images"
+        images.mkdir()
+        create_sif(images / "a.sif")
+        create_sif(images / "b.txt")
+        Benchmark.Start()
+        catalog = ImageCatalog(hostname="localhost")
+        found = catalog.refresh([str(images)])
+        Benchmark.Stop()
+        assert len(found) == 1
+        assert found[0]["name"] == "a.sif"
+        assert found[0]["hostname"] == "localhost"
+        assert len(found[0]) == 5
+
+    def test_unchanged_directory_is_not_listed(self, tmp_path, monkeypatch):
+        HEADING()
+        images = tmp_path / "images"
+        images.mkdir()
+        create_sif(images / "a.sif")
+        catalog = ImageCatalog(hostname="localhost")
+        catalog.refresh([str(images)])
+
+        calls = []
+        scandir = os.scandir
+
+        def counting_scandir(path):
+            calls.append(path)
+            return scandir(path)
+
+        monkeypatch.setattr(os, "scandir", counting_scandir)
+
+        reloaded = ImageCatalog(hostname="localhost", state=catalog.state)
+        found = reloaded.refresh([str(images)])
+        assert calls == []
+        assert [image["name"] for image in found] == ["a.sif"]
+
+        create_sif(images / "b.sif")
+        os.utime(images, ns=(1, 1))
+        found = reloaded.refresh([str(images)])
+        assert len(calls) == 1
+        assert [image["name"] for image in found] == ["a.sif", "b.sif"]
+
+    def test_add_and_remove(self, tmp_path):
+        HEADING()
+        images = tmp_path / "images"
+        images.mkdir()
+        catalog = ImageCatalog(hostname="localhost")
+        catalog.refresh([str(images)])
+        assert catalog.images() == []
+
+        create_sif(images / "a.sif")
+        catalog.add(str(images / "a.sif"))
+        assert [image["name"] for image in catalog.images()] == ["a.sif"]
+
+        os.remove(images / "a.sif")
+        catalog.remove(str(images / "a.sif"))
+        assert catalog.images() == []
+
+    def test_add_concurrent(self, tmp_path):
+        HEADING()
+        images = tmp_path / "images"
+        images.mkdir()
+        catalog = ImageCatalog(hostname="localhost")
+        catalog.refresh([str(images)])
+        create_sif(images / "a.sif")
+        # b.sif is created by someone else while a.sif is added
+        create_sif(images / "b.sif")
+        catalog.add(str(images / "a.sif"))
+        assert [image["name"] for image in catalog.images()] == ["a.sif"]
+        Benchmark.Start()
+        found = catalog.refresh([str(images)])
+        Benchmark.Stop()
+        assert [image["name"] for image in found] == ["a.sif", "b.sif"]
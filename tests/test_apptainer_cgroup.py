@@ -0,0 +1,97 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_cgroup.py
+# pytest -v  tests/test_apptainer_cgroup.py
+# pytest -v --capture=no  tests/test_apptainer_cgroup.py::TestCgroup::<METHODNAME>
+###############################################################
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.cgroup import CgroupStats
+from cloudmesh.apptainer.stats import StatsCollector
+
+
+def process(proc, pid, ppid, path):
+    (proc / str(pid)).mkdir(parents=True)
+    (proc / str(pid) / "cgroup").write_text(f"0::{path}\n")
+    (proc / str(pid) / "stat").write_text(f"{pid} (sh) S {ppid} {pid} {pid} 0\n")
+
+
+def instance(root, proc, pid, path, usage, procs=None):
+    process(proc, pid, 1, path)
+    directory = root / path.lstrip("/")
+    directory.mkdir(parents=True)
+    procs = [pid] if procs is None else procs
+    (directory / "cgroup.procs").write_text("".join(f"{p}\n" for p in procs))
+    (directory / "cpu.stat").write_text(
+        f"usage_usec {usage}\nuser_usec {usage - 100}\nsystem_usec 100\n"
+    )
+    (directory / "memory.current").write_text("4096\n")
+    (directory / "memory.max").write_text("max\n")
+    (directory / "io.stat").write_text(
+        "8:0 rbytes=1000 wbytes=24 rios=3 wios=1 dbytes=0 dios=0\n"
+        "8:16 rbytes=0 wbytes=1000 rios=0 wios=2 dbytes=0 dios=0\n"
+    )
+    (directory / "pids.current").write_text("3\n")
+    return directory
+
+
+@pytest.fixture
+def cgroups(tmp_path):
+    root = tmp_path / "cgroup"
+    proc = tmp_path / "proc"
+    root.mkdir()
+    (root / "cgroup.controllers").write_text("cpu io memory pids\n")
+    instance(root, proc, 100, "/user.slice/app-a.scope", 5000)
+    # b runs a child, c shares the session scope with a shell
+    process(proc, 201, 200, "/user.slice/app-b.scope")
+    directory = instance(
+        root, proc, 200, "/user.slice/app-b.scope", 7000, procs=[200, 201]
+    )
+    (directory / "pids.current").unlink()
+    process(proc, 400, 1, "/user.slice/session-1.scope")
+    instance(
+        root, proc, 300, "/user.slice/session-1.scope", 9000, procs=[300, 400]
+    )
+    return CgroupStats(root=str(root), proc=str(proc))
+
+
+class TestCgroup:
+
+    def test_read(self, cgroups):
+        HEADING()
+        Benchmark.Start()
+        data = cgroups.read(100)
+        Benchmark.Stop()
+        assert data["cgroup"].endswith("user.slice/app-a.scope")
+        assert data["cpu"] == 5000 * 1000
+        assert data["cpu.stat"]["system_usec"] == 100
+        assert data["memory"] == 4096
+        assert data["memory.max"] is None
+        assert data["io"] == 2024
+        assert data["io.stat"]["8:0"]["rios"] == 3
+        assert data["pids"] == 3
+        assert cgroups.read(200)["pids"] is None
+        with pytest.raises(OSError):
+            cgroups.read(300)
+        with pytest.raises(OSError):
+            cgroups.read(500)
+
+    def test_stats(self, cgroups, fake_apptainer):
+        HEADING()
+        apptainer = Apptainer(ttl=0)
+        apptainer.cgroups = cgroups
+        apptainer.instance_files.list = lambda: [
+            {"instance": "a", "pid": 100, "img": "a.sif"},
+            {"instance": "b", "pid": 200, "img": "b.sif"},
+            {"instance": "c", "pid": 300, "img": "c.sif"},
+        ]
+        assert apptainer.stats(name="a", output="dict")["memory"] == 4096
+        with pytest.raises(ValueError):
+            apptainer.stats(name="x", output="dict")
+
+        collector = StatsCollector(apptainer)
+        assert collector.sample() == 2
+        assert sorted(collector.summary()) == ["a", "b"]
+        assert "c" in collector.errors
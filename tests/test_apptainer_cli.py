@@ -0,0 +1,56 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_cli.py
+# pytest -v  tests/test_apptainer_cli.py
+# pytest -v --capture=no  tests/test_apptainer_cli.py::TestCli::<METHODNAME>
+###############################################################
+import sys
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.command.apptainer import main
+
+
+@pytest.fixture
+def cma(images, monkeypatch, capsys):
+    capsys.readouterr()
+
+    def run(*arguments):
+        monkeypatch.setattr(sys, "argv", ["cma", *arguments])
+        main()
+        return capsys.readouterr().out
+
+    return run
+
+
+class TestCli:
+
+    def test_list(self, cma):
+        HEADING()
+        Benchmark.Start()
+        output = cma("list")
+        Benchmark.Stop()
+        assert "tf" not in output
+        cma("start", "tf", "tf.sif")
+        assert "tf.sif" in cma("list")
+        assert "tf" in cma("ps", "tf")
+        assert "hello\n" in cma("exec", "tf", "echo hello")
+
+    def test_scan(self, cma):
+        HEADING()
+        with open("images/new.sif", "wb") as f:
+            f.write(b"\0")
+        assert [image["name"] for image in Apptainer(scan=False).images] == ["tf.sif"]
+        cma("list")
+        assert [image["name"] for image in Apptainer(scan=False).images] == ["tf.sif"]
+        assert "new.sif" in cma("images")
+        assert [image["name"] for image in Apptainer(scan=False).images] == [
+            "new.sif",
+            "tf.sif",
+        ]
+
+    def test_usage(self, cma):
+        HEADING()
+        assert "Could not execute" in cma("unknown")
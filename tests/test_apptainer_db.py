@@ -0,0 +1,120 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_db.py
+# pytest -v  tests/test_apptainer_db.py
+# pytest -v --capture=no  tests/test_apptainer_db.py::TestDB::<METHODNAME>
+###############################################################
+import os
+import stat
+
+import pytest
+import yaml
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.db import get_database
+from cloudmesh.apptainer.db import migrate
+
+
+@pytest.mark.usefixtures("home")
+class TestDB:
+
+    def test_save_only_when_changed(self):
+        HEADING()
+        Benchmark.Start()
+        apptainer = Apptainer()
+        Benchmark.Stop()
+        assert apptainer.save() is False
+        apptainer.location.append("more-images")
+        assert apptainer.save() is True
+        assert apptainer.save() is False
+
+        reloaded = Apptainer()
+        assert reloaded.location == apptainer.location
+        assert reloaded.save() is False
+
+    def test_batch(self):
+        HEADING()
+        apptainer = Apptainer()
+        with apptainer.batch():
+            apptainer.location.append("a")
+            assert apptainer.save() is False
+            apptainer.location.append("b")
+            assert apptainer.save() is False
+            with open("apptainer.yaml") as f:
+                assert "b" not in yaml.safe_load(f)["cloudmesh"]["apptainer"]["location"]
+        with open("apptainer.yaml") as f:
+            location = yaml.safe_load(f)["cloudmesh"]["apptainer"]["location"]
+        assert location[-2:] == ["a", "b"]
+        assert [name for name in os.listdir(".") if name.endswith(".tmp")] == []
+
+    def test_mode(self, monkeypatch):
+        HEADING()
+        umask = os.umask(0o022)
+        set_umask = os.umask
+
+        def changed(mask):
+            raise AssertionError("the umask of the process was changed")
+
+        # other threads would create files under the temporary umask
+        monkeypatch.setattr(os, "umask", changed)
+        try:
+            apptainer = Apptainer()
+            assert stat.S_IMODE(os.stat("apptainer.yaml").st_mode) == 0o644
+            os.chmod("apptainer.yaml", 0o640)
+            Benchmark.Start()
+            apptainer.location.append("more-images")
+            assert apptainer.save() is True
+            Benchmark.Stop()
+            assert stat.S_IMODE(os.stat("apptainer.yaml").st_mode) == 0o640
+        finally:
+            set_umask(umask)
+
+    def test_sqlite(self):
+        HEADING()
+        os.mkdir("images")
+        with open("images/a.sif", "wb") as f:
+            f.write(b"\0" * 1024)
+        Benchmark.Start()
+        apptainer = Apptainer(filename="apptainer.db")
+        Benchmark.Stop()
+        assert [image["name"] for image in apptainer.images] == ["a.sif"]
+        assert apptainer.save() is False
+
+        reloaded = Apptainer(filename="apptainer.db")
+        assert reloaded.images == apptainer.images
+        assert reloaded.get_db("location") == ["images"]
+        assert reloaded.db.images(name="a.sif")[0]["name"] == "a.sif"
+
+    def test_migrate(self):
+        HEADING()
+        for hostname in ["node1", "node2"]:
+            with open(f"{hostname}.yaml", "w") as f:
+                yaml.safe_dump(
+                    {
+                        "cloudmesh": {
+                            "apptainer": {
+                                "hostname": hostname,
+                                "location": ["images"],
+                                "images": [{"name": f"{hostname}.sif"}],
+                                "instances": [{"instance": "tf", "pid": 1}],
+                            }
+                        }
+                    },
+                    f,
+                )
+        hosts = migrate(["node1.yaml", "node2.yaml"], "apptainer.db")
+        assert hosts == ["node1", "node2"]
+
+        db = get_database("apptainer.db")
+        assert db.hosts() == ["node1", "node2"]
+        assert db.load(hostname="node2")["images"] == [{"name": "node2.sif"}]
+        assert len(db.instances(name="tf")) == 2
+
+    def test_missing_hostname(self, monkeypatch):
+        HEADING()
+        monkeypatch.setenv("HOSTNAME", "node7")
+        with open("apptainer.yaml", "w") as f:
+            yaml.safe_dump({"cloudmesh": {"apptainer": {"location": []}}}, f)
+        apptainer = Apptainer(filename="apptainer.yaml", scan=False)
+        assert apptainer.hostname == "node7"
@@ -0,0 +1,140 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_download.py
+# pytest -v  tests/test_apptainer_download.py
+# pytest -v --capture=no  tests/test_apptainer_download.py::TestDownload::<METHODNAME>
+###############################################################
+import os
+import time
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.apptainer import ApptainerError
+from cloudmesh.apptainer.apptainer import read_manifest
+from cloudmesh.apptainer.store import file_digest
+
+
+@pytest.fixture
+def apptainer(fake_apptainer, monkeypatch):
+    monkeypatch.setenv("FAKE_APPTAINER_PULL_DELAY", "0.5")
+    app = Apptainer()
+    app.add_location(".")
+    return app
+
+
+def pulls():
+    with open("pulls.log") as f:
+        return sorted(line.split()[1] for line in f)
+
+
+class TestDownload:
+
+    def test_download_many(self, apptainer):
+        HEADING()
+        apptainer.download(name="old.sif", url="docker://old")
+        os.remove("pulls.log")
+        images = [(f"img{i}.sif", f"docker://img{i}") for i in range(4)] + [
+            ("copy.sif", "docker://img0"),
+            ("img0.sif", "docker://img0"),
+            ("old.sif", "docker://old"),
+            ("bad.sif", "fail://bad"),
+        ]
+        Benchmark.Start()
+        start = time.time()
+        results = apptainer.download_many(images, max_workers=8)
+        Benchmark.Stop()
+        assert time.time() - start < 1.5
+        status = {result["name"]: result["status"] for result in results}
+        assert status == {
+            "img0.sif": "pulled",
+            "img1.sif": "pulled",
+            "img2.sif": "pulled",
+            "img3.sif": "pulled",
+            "copy.sif": "linked",
+            "old.sif": "exists",
+            "bad.sif": "failed",
+        }
+        assert pulls() == [f"docker://img{i}" for i in range(4)] + ["fail://bad"]
+        assert os.stat("copy.sif").st_ino == os.stat("img0.sif").st_ino
+        assert "could not pull" in results[-1]["stderr"]
+        assert all(result["seconds"] >= 0 for result in results)
+        names = [image["name"] for image in apptainer.images]
+        assert "copy.sif" in names
+        assert "bad.sif" not in names
+
+    def test_limit(self, apptainer):
+        HEADING()
+        start = time.time()
+        images = [(f"img{i}.sif", f"docker://img{i}") for i in range(4)]
+        apptainer.download_many(images, max_workers=2)
+        assert time.time() - start >= 1.0
+
+    def test_download_exists(self, apptainer):
+        HEADING()
+        apptainer.download(name="old.sif", url="docker://old")
+        apptainer.download(name="old.sif", url="docker://old")
+        assert pulls() == ["docker://old"]
+
+    def test_manifest(self, fake_apptainer):
+        HEADING()
+        with open("images.txt", "w") as f:
+            f.write("# images\n\nubuntu docker://ubuntu\nalpine.sif docker://alpine\n")
+        assert read_manifest("images.txt") == [
+            {"name": "ubuntu.sif", "url": "docker://ubuntu", "digest": None},
+            {"name": "alpine.sif", "url": "docker://alpine", "digest": None},
+        ]
+        with open("images.yaml", "w") as f:
+            f.write("ubuntu: docker://ubuntu\n")
+        assert read_manifest("images.yaml") == [
+            {"name": "ubuntu.sif", "url": "docker://ubuntu", "digest": None}
+        ]
+        with open("bad.txt", "w") as f:
+            f.write("ubuntu\n")
+        with pytest.raises(ValueError):
+            read_manifest("bad.txt")
+
+    def test_verify(self, apptainer):
+        HEADING()
+        with pytest.raises(ApptainerError):
+            apptainer.download(name="fail.sif", url="fail://x")
+        with pytest.raises(ApptainerError):
+            apptainer.download(name="bad.sif", url="bad://x")
+        assert [name for name in os.listdir(".") if "fail" in name or "bad" in name] == []
+        assert "fail.sif" not in [image["name"] for image in apptainer.images]
+
+    def test_digest(self, apptainer):
+        HEADING()
+        apptainer.download(name="x.sif", url="docker://x")
+        digest = file_digest("x.sif")
+        wrong = "sha256:" + "0" * 64
+        apptainer.download(name="x.sif", url="docker://x", digest=digest)
+        assert pulls() == ["docker://x"]
+
+        with pytest.raises(ApptainerError):
+            apptainer.download(name="y.sif", url="docker://y", digest=digest)
+        assert not os.path.exists("y.sif")
+
+        with open("x.sif", "wb") as f:
+            f.write(b"SIF_")
+        Benchmark.Start()
+        results = apptainer.download_many([("x.sif", "docker://x", digest)])
+        Benchmark.Stop()
+        assert results[0]["status"] == "pulled"
+        assert file_digest("x.sif") == digest
+
+        results = apptainer.download_many([("x.sif", "docker://x", wrong)])
+        assert results[0]["status"] == "failed"
+        assert file_digest("x.sif") == digest
+
+    def test_resume(self, apptainer):
+        HEADING()
+        apptainer.download(name="x.sif", url="docker://x")
+        digest = file_digest("x.sif")
+        os.rename("x.sif", ".x.sif.partial")
+        os.remove("pulls.log")
+        apptainer.download(name="x.sif", url="docker://x", digest=digest)
+        assert not os.path.exists("pulls.log")
+        assert not os.path.exists(".x.sif.partial")
+        assert file_digest("x.sif") == digest
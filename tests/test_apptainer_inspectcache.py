@@ -0,0 +1,74 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_inspectcache.py
+# pytest -v  tests/test_apptainer_inspectcache.py
+# pytest -v --capture=no  tests/test_apptainer_inspectcache.py::TestInspectCache::<METHODNAME>
+###############################################################
+import os
+
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.inspectcache import InspectCache
+
+
+class TestInspectCache:
+
+    def test_hit_and_miss(self, tmp_path):
+        HEADING()
+        image = tmp_path / "a.sif"
+        image.write_bytes(b"a")
+        cache = InspectCache(filename=str(tmp_path / "inspect.json"))
+        assert cache.get(str(image)) is None
+        cache.put(str(image), {"type": "container"})
+        Benchmark.Start()
+        assert cache.get(str(image)) == {"type": "container"}
+        Benchmark.Stop()
+        assert cache.save()
+
+        reloaded = InspectCache(filename=str(tmp_path / "inspect.json"))
+        assert reloaded.get(str(image)) == {"type": "container"}
+        stats = reloaded.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+
+    def test_invalidation(self, tmp_path):
+        HEADING()
+        image = tmp_path / "a.sif"
+        image.write_bytes(b"a")
+        cache = InspectCache(filename=str(tmp_path / "inspect.json"))
+        cache.put(str(image), {"type": "container"})
+        image.write_bytes(b"ab")
+        assert cache.get(str(image)) is None
+        assert cache.stats()["invalidations"] == 1
+        assert cache.stats()["entries"] == 0
+
+    def test_eviction(self, tmp_path):
+        HEADING()
+        cache = InspectCache(filename=str(tmp_path / "inspect.json"), max_entries=2)
+        for name in ["a", "b", "c"]:
+            image = tmp_path / f"{name}.sif"
+            image.write_bytes(b"a")
+            cache.put(str(image), {"name": name})
+            if name == "b":
+                cache.get(str(tmp_path / "a.sif"))
+        assert cache.get(str(tmp_path / "b.sif")) is None
+        assert cache.get(str(tmp_path / "a.sif")) == {"name": "a"}
+        assert cache.stats()["evictions"] == 1
+        assert not os.path.exists(tmp_path / "inspect.json")
+
+    def test_hit_does_not_rewrite(self, tmp_path):
+        HEADING()
+        image = tmp_path / "a.sif"
+        image.write_bytes(b"a")
+        filename = tmp_path / "inspect.json"
+        cache = InspectCache(filename=str(filename))
+        cache.put(str(image), {"type": "container"})
+        assert cache.save()
+        inode = os.stat(filename).st_ino
+        Benchmark.Start()
+        for i in range(10):
+            assert cache.get(str(image)) == {"type": "container"}
+            assert not cache.save()
+        Benchmark.Stop()
+        assert os.stat(filename).st_ino == inode
+        assert InspectCache(filename=str(filename)).stats()["hits"] == 10
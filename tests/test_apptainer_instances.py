@@ -0,0 +1,94 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_instances.py
+# pytest -v  tests/test_apptainer_instances.py
+# pytest -v --capture=no  tests/test_apptainer_instances.py::TestInstances::<METHODNAME>
+###############################################################
+import json
+import os
+import subprocess
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.instances import InstanceFiles
+
+
+def write(files, name, content):
+    directory = os.path.join(files.directory, name)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+        if isinstance(content, dict):
+            json.dump(content, f)
+        else:
+            f.write(content)
+
+
+@pytest.fixture
+def process():
+    process = subprocess.Popen(["sleep", "60"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def files(fake_apptainer, process):
+    files = InstanceFiles()
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    write(
+        files,
+        "tf",
+        {
+            "pid": process.pid,
+            "ppid": 1,
+            "name": "tf",
+            "image": "/images/tf.sif",
+            "ip": "",
+            "logErrPath": "/tmp/tf.err",
+            "logOutPath": "/tmp/tf.out",
+        },
+    )
+    write(files, "stale", {"pid": dead.pid, "image": "/images/tf.sif"})
+    write(files, "broken", "{")
+    write(files, "nopid", {"image": "/images/tf.sif"})
+    return files
+
+
+class TestInstances:
+
+    def test_list(self, files, process):
+        HEADING()
+        Benchmark.Start()
+        instances = files.list()
+        Benchmark.Stop()
+        assert instances == [
+            {
+                "instance": "tf",
+                "pid": process.pid,
+                "img": "/images/tf.sif",
+                "ip": "",
+                "logErrPath": "/tmp/tf.err",
+                "logOutPath": "/tmp/tf.out",
+            }
+        ]
+
+    def test_unknown(self, fake_apptainer):
+        HEADING()
+        files = InstanceFiles()
+        assert not files.available()
+        assert files.list() is None
+
+    def test_info(self, files):
+        HEADING()
+        apptainer = Apptainer()
+        assert [i["instance"] for i in apptainer.list()] == ["tf"]
+        assert apptainer.list(native=False, fresh=True) == []
+
+    def test_fallback(self, fake_apptainer):
+        HEADING()
+        apptainer = Apptainer()
+        apptainer.system("apptainer instance start /images/tf.sif tf", name="tf")
+        assert [i["instance"] for i in apptainer.list()] == ["tf"]
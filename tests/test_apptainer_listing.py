@@ -0,0 +1,74 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_listing.py
+# pytest -v  tests/test_apptainer_listing.py
+# pytest -v --capture=no  tests/test_apptainer_listing.py::TestListing::<METHODNAME>
+###############################################################
+import time
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+
+
+@pytest.fixture
+def apptainer(images, monkeypatch):
+    app = Apptainer(ttl=60)
+    app.calls = []
+    system = app.system
+
+    def counting(command=None, **kwargs):
+        app.calls.append(command)
+        return system(command=command, **kwargs)
+
+    monkeypatch.setattr(app, "system", counting)
+    return app
+
+
+def listings(apptainer):
+    return len([call for call in apptainer.calls if "instance list" in call])
+
+
+class TestListing:
+
+    def test_cached(self, apptainer):
+        HEADING()
+        Benchmark.Start()
+        for i in range(100):
+            apptainer.list()
+        Benchmark.Stop()
+        assert listings(apptainer) == 1
+        apptainer.list(fresh=True)
+        assert listings(apptainer) == 2
+
+    def test_copy(self, apptainer):
+        HEADING()
+        apptainer.info()["instances"].append({"instance": "bad"})
+        assert apptainer.info()["instances"] == []
+
+    def test_invalidate(self, apptainer):
+        HEADING()
+        assert apptainer.list() == []
+        apptainer.start(name="tf", image="tf.sif")
+        assert [i["instance"] for i in apptainer.list()] == ["tf"]
+        apptainer.stop(name="tf")
+        assert apptainer.list() == []
+        apptainer.start_many([("tf0", "tf.sif"), ("tf1", "tf.sif")])
+        assert len(apptainer.list()) == 2
+        apptainer.stop_many(["tf*"])
+        assert apptainer.list() == []
+
+    def test_ttl(self, apptainer):
+        HEADING()
+        apptainer.ttl = 0.2
+        apptainer.list()
+        apptainer.list()
+        assert listings(apptainer) == 1
+        time.sleep(0.3)
+        apptainer.list()
+        assert listings(apptainer) == 2
+        apptainer.ttl = 0
+        apptainer.list()
+        apptainer.list()
+        assert listings(apptainer) == 4
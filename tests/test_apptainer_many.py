@@ -0,0 +1,120 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_many.py
+# pytest -v  tests/test_apptainer_many.py
+# pytest -v --capture=no  tests/test_apptainer_many.py::TestMany::<METHODNAME>
+###############################################################
+import time
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+
+@pytest.mark.usefixtures("images")
+class TestMany:
+
+    def test_start_many(self, apptainer):
+        HEADING()
+        names = [f"tf{i}" for i in range(8)]
+        Benchmark.Start()
+        results = apptainer.start_many(
+            [(name, "tf.sif") for name in names] + [("bad", "missing.sif")],
+            max_workers=4,
+        )
+        Benchmark.Stop()
+        status = {result["name"]: result["status"] for result in results}
+        assert [status[name] for name in names] == ["started"] * 8
+        assert status["bad"] == "failed"
+        assert all(result["seconds"] >= 0 for result in results)
+        assert sorted(i["instance"] for i in apptainer.list()) == sorted(names)
+
+        results = apptainer.start_many([("tf0", "tf.sif")])
+        assert results[0]["status"] == "started"
+        assert len(apptainer.list()) == 8
+
+    def test_start_dryrun(self, apptainer):
+        HEADING()
+        apptainer.start(name="tf", image="tf.sif")
+        Benchmark.Start()
+        apptainer.start(name="tf", image="tf.sif", dryrun=True)
+        Benchmark.Stop()
+        assert [i["instance"] for i in apptainer.list()] == ["tf"]
+
+    def test_stop_many(self, apptainer):
+        HEADING()
+        apptainer.start_many([(f"tf{i}", "tf.sif") for i in range(6)] + [("other", "tf.sif")])
+        Benchmark.Start()
+        results = apptainer.stop_many(["tf*", "missing"], max_workers=4, timeout=2)
+        Benchmark.Stop()
+        status = {result["name"]: result["status"] for result in results}
+        assert status == dict(
+            {f"tf{i}": "stopped" for i in range(6)}, missing="not found"
+        )
+        assert [i["instance"] for i in apptainer.list()] == ["other"]
+
+    def test_stop_many_force(self, apptainer, monkeypatch):
+        HEADING()
+        apptainer.start_many([(f"tf{i}", "tf.sif") for i in range(4)])
+        monkeypatch.setenv("FAKE_APPTAINER_STOP_DELAY", "3")
+        Benchmark.Start()
+        results = apptainer.stop_many("tf*", timeout=1, grace=0, force=True)
+        Benchmark.Stop()
+        assert [result["status"] for result in results] == ["killed"] * 4
+        assert max(result["seconds"] for result in results) < 3
+        assert apptainer.list() == []
+
+    def test_stop_many_queued(self, apptainer, monkeypatch):
+        HEADING()
+        apptainer.start_many([(f"tf{i}", "tf.sif") for i in range(4)])
+        monkeypatch.setenv("FAKE_APPTAINER_STOP_DELAY", "1")
+        Benchmark.Start()
+        results = apptainer.stop_many(
+            "tf*", max_workers=2, timeout=1, grace=0.5, force=False
+        )
+        Benchmark.Stop()
+        assert [result["status"] for result in results] == ["stopped"] * 4
+        assert apptainer.list() == []
+
+    def test_stop_many_deadline(self, apptainer, monkeypatch):
+        HEADING()
+        apptainer.start_many([(f"tf{i}", "tf.sif") for i in range(4)])
+        monkeypatch.setenv("FAKE_APPTAINER_STOP_DELAY", "1")
+        Benchmark.Start()
+        results = apptainer.stop_many(
+            "tf*", max_workers=2, timeout=2, deadline=0.5, force=False
+        )
+        Benchmark.Stop()
+        status = sorted(result["status"] for result in results)
+        assert status == ["not started"] * 2 + ["stopped"] * 2
+        assert len(apptainer.list()) == 2
+
+    def test_exec_many(self, apptainer):
+        HEADING()
+        apptainer.start_many([(f"tf{i}", "tf.sif") for i in range(6)] + [("other", "tf.sif")])
+        Benchmark.Start()
+        start = time.perf_counter()
+        results = apptainer.exec_many(
+            "tf*,missing", command=["sh", "-c", "sleep 1; echo ok"], max_workers=6
+        )
+        seconds = time.perf_counter() - start
+        Benchmark.Stop()
+        assert seconds < 3
+        assert sorted(result["name"] for result in results[:-1]) == [f"tf{i}" for i in range(6)]
+        assert results[-1]["name"] == "missing"
+        for result in results[:-1]:
+            assert result["status"] == "ok"
+            assert result["returncode"] == 0
+            assert result["stdout"] == "ok\n"
+            assert result["seconds"] >= 1
+        assert results[-1]["status"] == "not found"
+
+    def test_exec_many_failed(self, apptainer):
+        HEADING()
+        apptainer.start_many([("tf0", "tf.sif"), ("tf1", "tf.sif")])
+        results = apptainer.exec_many(None, command="sh -c 'echo err >&2; exit 3'")
+        assert [result["status"] for result in results] == ["failed"] * 2
+        assert [result["returncode"] for result in results] == [3, 3]
+        assert results[0]["stderr"] == "err\n"
+        results = apptainer.exec_many(["tf0"], command="sleep 5", timeout=0.5)
+        assert results[0]["status"] == "timeout"
+        assert results[0]["returncode"] is None
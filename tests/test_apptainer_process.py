@@ -0,0 +1,98 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_process.py
+# pytest -v  tests/test_apptainer_process.py
+# pytest -v --capture=no  tests/test_apptainer_process.py::TestProcess::<METHODNAME>
+###############################################################
+import json
+import os
+import subprocess
+
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.process import ProcessTable
+
+
+class TestProcess:
+
+    def test_register(self, apptainer):
+        HEADING()
+        Benchmark.Start()
+        apptainer.system("exit 3", name="a", register=True)
+        apptainer.system("true", name="b")
+        Benchmark.Stop()
+        processes = apptainer.ps()
+        assert len(processes) == 1
+        record = processes[0]
+        assert record["name"] == "a"
+        assert record["command"] == "exit 3"
+        assert record["status"] == "exited"
+        assert record["exit"] == 3
+        assert record["end"] >= record["start"]
+
+    def test_persist(self, apptainer):
+        HEADING()
+        apptainer.system("true", name="a", register=True)
+        Benchmark.Start()
+        processes = Apptainer().ps(name="a")
+        Benchmark.Stop()
+        assert [record["exit"] for record in processes] == [0]
+
+    def test_reap(self, fake_apptainer):
+        HEADING()
+        table = ProcessTable()
+        process = subprocess.Popen(["sleep", "30"])
+        table.register(process, name="a", command="sleep 30")
+        other = ProcessTable()
+        assert len(other.list(running=True)) == 1
+        process.kill()
+        process.wait()
+        Benchmark.Start()
+        assert other.list(running=True) == []
+        Benchmark.Stop()
+        assert table.list()[0]["exit"] == -9
+        assert ProcessTable().list()[0]["status"] == "exited"
+
+    def test_keep(self, fake_apptainer):
+        HEADING()
+        table = ProcessTable(keep=2)
+        for i in range(4):
+            process = subprocess.Popen(["true"])
+            process.wait()
+            table.register(process, name=str(i))
+            table.finish(process)
+        assert [record["name"] for record in ProcessTable().list()] == ["2", "3"]
+
+    def test_shared(self, fake_apptainer):
+        HEADING()
+        process = subprocess.Popen(["true"])
+        process.wait()
+        # a record of another host with the same pid
+        records = {
+            f"node1:{process.pid}": {
+                "pid": process.pid,
+                "hostname": "node1",
+                "name": "remote",
+                "command": None,
+                "start": 1.0,
+                "ticks": None,
+                "end": None,
+                "status": "running",
+                "exit": None,
+            }
+        }
+        table = ProcessTable()
+        os.makedirs(os.path.dirname(table.filename), exist_ok=True)
+        with open(table.filename, "w") as f:
+            json.dump(records, f)
+        table.register(process, name="local")
+        Benchmark.Start()
+        processes = ProcessTable().list()
+        Benchmark.Stop()
+        status = {record["name"]: record["status"] for record in processes}
+        assert status == {"remote": "running", "local": "exited"}
+        assert {record["hostname"] for record in processes} == {
+            "node1",
+            os.uname()[1],
+        }
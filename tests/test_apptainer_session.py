@@ -0,0 +1,84 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_session.py
+# pytest -v  tests/test_apptainer_session.py
+# pytest -v --capture=no  tests/test_apptainer_session.py::TestSession::<METHODNAME>
+###############################################################
+import time
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import ApptainerError
+from cloudmesh.apptainer.apptainer import ApptainerTimeout
+from cloudmesh.apptainer.session import ExecSession
+
+
+class TestSession:
+
+    def test_exec(self, apptainer):
+        HEADING()
+        with ExecSession(apptainer, name="tf") as session:
+            assert session.exec("echo hello") == ("hello\n", "")
+            assert session.returncode == 0
+            assert session.exec("printf 'a\\nb'; echo err >&2; exit_code() { return 3; }; exit_code") == (
+                "a\nb",
+                "err\n",
+            )
+            assert session.returncode == 3
+            session.exec("cd /tmp; X=42")
+            assert session.exec("pwd; echo $X") == ("/tmp\n42\n", "")
+            assert session.exec("cat") == ("", "")
+            stdout, stderr = session.exec("seq 1 100000")
+            assert stdout.splitlines()[-1] == "100000"
+
+    def test_same_as_exec(self, apptainer):
+        HEADING()
+        command = "echo out; echo err >&2"
+        with ExecSession(apptainer, name="tf") as session:
+            assert session.exec(command) == apptainer.system(
+                command=apptainer._command(apptainer._exec_command("tf", ["sh", "-c", command]))
+            )
+
+    def test_fast(self, apptainer):
+        HEADING()
+        n = 200
+        with ExecSession(apptainer, name="tf") as session:
+            Benchmark.Start()
+            start = time.perf_counter()
+            for i in range(n):
+                assert session.exec(f"echo {i}") == (f"{i}\n", "")
+            warm = time.perf_counter() - start
+            Benchmark.Stop()
+        start = time.perf_counter()
+        for i in range(20):
+            apptainer.system(command=apptainer._command(apptainer._exec_command("tf", ["echo", str(i)])))
+        cold = (time.perf_counter() - start) / 20 * n
+        assert warm < cold
+
+    def test_ended(self, apptainer):
+        HEADING()
+        session = ExecSession(apptainer, name="tf")
+        with pytest.raises(ApptainerError):
+            session.exec("exit 1")
+        assert session.process is None
+        assert session.exec("echo again") == ("again\n", "")
+        session.close()
+
+    def test_timeout(self, apptainer):
+        HEADING()
+        with ExecSession(apptainer, name="tf", timeout=0.5) as session:
+            with pytest.raises(ApptainerTimeout):
+                session.exec("echo partial; sleep 10")
+            assert session.process is None
+            assert session.exec("echo ok") == ("ok\n", "")
+
+    def test_large_output(self, apptainer):
+        HEADING()
+        size = 16 * 1024 * 1024
+        with ExecSession(apptainer, name="tf") as session:
+            Benchmark.Start()
+            stdout, stderr = session.exec(f"head -c {size} /dev/zero | tr '\\0' a")
+            Benchmark.Stop()
+            assert len(stdout) == size
+            assert session.exec("echo ok") == ("ok\n", "")
@@ -0,0 +1,153 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_sif.py
+# pytest -v  tests/test_apptainer_sif.py
+# pytest -v --capture=no  tests/test_apptainer_sif.py::TestSif::<METHODNAME>
+###############################################################
+import json
+import struct
+import uuid
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.sif import DESCRIPTOR
+from cloudmesh.apptainer.sif import HEADER
+from cloudmesh.apptainer.sif import SIF_MAGIC
+from cloudmesh.apptainer.sif import SifError
+from cloudmesh.apptainer.sif import SifImage
+from cloudmesh.apptainer.sif import is_sif
+
+
+def create_sif(path, labels=None):
+    """Writes a minimal SIF image with an optional labels data object."""
+    objects = [(0x4004, b"\0" * 64)]
+    if labels is not None:
+        objects.append((0x4003, json.dumps(labels).encode()))
+    descoff = HEADER.size
+    dataoff = descoff + len(objects) * DESCRIPTOR.size
+    descriptors = b""
+    data = b""
+    for i, (datatype, content) in enumerate(objects):
+        descriptors += DESCRIPTOR.pack(
+            datatype, 1, i + 1, 0, 0, dataoff + len(data), len(content),
+            len(content), 0, 0, 0, 0, b"", b"",
+        )
+        data += content
+    header = HEADER.pack(
+        b"#!/usr/bin/env run-singularity\n", SIF_MAGIC, b"01\0", b"02\0",
+        uuid.uuid4().bytes, 0, 0, 0, len(objects), descoff,
+        len(descriptors), dataoff, len(data),
+    )
+    with open(path, "wb") as f:
+        f.write(header + descriptors + data)
+
+
+def create_image(path, labels=None):
+    """
+    Writes a SIF image with the descriptor layout of apptainer build.
+
+    The table at 4096 has 48 slots of which the definition file, the
+    inspect metadata in a JSON.Generic object, and the squashfs partition
+    are used; the data follows the table, each object 4096 byte aligned,
+    and all objects are in one object group.
+    """
+    metadata = {
+        "data": {
+            "attributes": {
+                "labels": labels,
+                "deffile": "bootstrap: docker\nfrom: ubuntu\n",
+                "runscript": "#!/bin/sh\n",
+                "environment": {},
+            }
+        },
+        "type": "container",
+    }
+    objects = [
+        (0x4001, b"bootstrap: docker\nfrom: ubuntu\n", b""),
+        (0x4006, json.dumps(metadata).encode(), b""),
+        (0x4004, b"hsqs" + b"\0" * 4092, struct.pack("<ii3s", 1, 2, b"02\0")),
+    ]
+    slots = 48
+    descoff = 4096
+    dataoff = descoff + slots * DESCRIPTOR.size
+    descriptors = b""
+    data = b""
+    for i, (datatype, content, extra) in enumerate(objects):
+        data += b"\0" * (-(dataoff + len(data)) % 4096)
+        descriptors += DESCRIPTOR.pack(
+            datatype, 1, i + 1, 0xF0000001, 0, dataoff + len(data), len(content),
+            len(content), 0, 0, 0, 0, b"", extra,
+        )
+        data += content
+    descriptors += b"\0" * DESCRIPTOR.size * (slots - len(objects))
+    header = HEADER.pack(
+        b"#!/usr/bin/env run-singularity\n", SIF_MAGIC, b"01\0", b"02\0",
+        uuid.uuid4().bytes, 0, 0, slots - len(objects), slots, descoff,
+        len(descriptors), dataoff, len(data),
+    )
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(b"\0" * (descoff - len(header)))
+        f.write(descriptors)
+        f.write(b"\0" * (dataoff - descoff - len(descriptors)))
+        f.write(data)
+
+
+class TestSif:
+
+    def test_generic_metadata(self, tmp_path):
+        HEADING()
+        path = tmp_path / "a.sif"
+        create_image(path, labels={"org.label-schema.build-arch": "amd64"})
+        Benchmark.Start()
+        with SifImage(path) as image:
+            data = image.inspect()
+        Benchmark.Stop()
+        assert data == {
+            "type": "container",
+            "data": {
+                "attributes": {"labels": {"org.label-schema.build-arch": "amd64"}}
+            },
+        }
+        create_image(path)
+        with SifImage(path) as image:
+            assert image.labels() == {}
+            assert [d["type"] for d in image.descriptors] == [
+                "Def.FILE",
+                "JSON.Generic",
+                "FS",
+            ]
+
+    def test_labels(self, tmp_path):
+        HEADING()
+        path = tmp_path / "a.sif"
+        create_sif(path, labels={"org.label-schema.schema-version": "1.0"})
+        Benchmark.Start()
+        with SifImage(path) as image:
+            data = image.inspect()
+        Benchmark.Stop()
+        assert data["type"] == "container"
+        assert data["data"]["attributes"]["labels"] == {
+            "org.label-schema.schema-version": "1.0"
+        }
+        assert is_sif(path)
+
+    def test_no_labels(self, tmp_path):
+        HEADING()
+        path = tmp_path / "a.sif"
+        create_sif(path)
+        with SifImage(path) as image:
+            assert image.labels() is None
+            with pytest.raises(SifError):
+                image.inspect()
+
+    def test_not_a_sif(self, tmp_path):
+        HEADING()
+        path = tmp_path / "a.sif"
+        path.write_bytes(b"x" * 200)
+        with pytest.raises(SifError):
+            SifImage(path)
+        assert not is_sif(path)
+        path.write_bytes(b"")
+        assert not is_sif(path)
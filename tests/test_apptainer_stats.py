@@ -0,0 +1,100 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_stats.py
+# pytest -v  tests/test_apptainer_stats.py
+# pytest -v --capture=no  tests/test_apptainer_stats.py::TestStats::<METHODNAME>
+###############################################################
+import time
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.stats import RingBuffer
+from cloudmesh.apptainer.stats import StatsCollector
+
+
+@pytest.fixture
+def apptainer(fake_apptainer):
+    app = Apptainer(ttl=0)
+    for name in ["a", "b"]:
+        app.system(f"apptainer instance start /images/tf.sif {name}", name=name)
+    return app
+
+
+class TestStats:
+
+    def test_ring_buffer(self):
+        HEADING()
+        buffer = RingBuffer(size=100)
+        Benchmark.Start()
+        for i in range(250):
+            buffer.append(i, i)
+        Benchmark.Stop()
+        assert len(buffer) == 100
+        assert buffer.window() == list(range(150, 250))
+        assert buffer.window(seconds=9.5, now=249) == list(range(240, 250))
+        summary = buffer.summary()
+        assert summary["min"] == 150
+        assert summary["max"] == 249
+        assert summary["last"] == 249
+        assert summary["mean"] == 199.5
+        assert summary["p50"] == 199
+        assert summary["p90"] == 239
+        assert summary["p99"] == 248
+        assert RingBuffer(10).summary()["count"] == 0
+
+    def test_sample(self, apptainer):
+        HEADING()
+        collector = StatsCollector(apptainer, size=10)
+        Benchmark.Start()
+        assert collector.sample() == 2
+        time.sleep(0.2)
+        assert collector.sample() == 2
+        Benchmark.Stop()
+        summary = collector.summary(window=60)
+        assert sorted(summary) == ["a", "b"]
+        assert summary["a"]["memory"]["last"] == 1024 * 1024
+        assert summary["a"]["pids"]["count"] == 2
+        assert summary["a"]["cpu"]["count"] == 1
+        assert 40 < summary["a"]["cpu"]["last"] < 60
+        assert 0.8e6 < summary["a"]["io"]["last"] < 1.2e6
+
+        apptainer.system("apptainer instance stop a")
+        collector.sample()
+        assert list(collector.summary()) == ["b"]
+        assert [row["metric"] for row in collector.table(name="b")] == [
+            "cpu",
+            "memory",
+            "io",
+            "pids",
+        ]
+
+    def test_thread(self, apptainer):
+        HEADING()
+        counters = {"cpu": 0}
+
+        def source(instance):
+            counters["cpu"] += 10**8
+            return {"cpu": counters["cpu"], "memory": 1, "io": 0, "pids": 1}
+
+        with StatsCollector(apptainer, interval=0.05, size=5, source=source) as c:
+            time.sleep(0.5)
+        summary = c.summary()
+        assert summary["a"]["memory"]["count"] == 5
+        assert summary["b"]["pids"]["max"] == 1
+        assert c._thread is None
+
+    def test_thread_sqlite(self, fake_apptainer, capsys):
+        HEADING()
+        app = Apptainer("apptainer.db", ttl=0)
+        app.system("apptainer instance start /images/tf.sif a", name="a")
+        Benchmark.Start()
+        with StatsCollector(app, interval=0.05, size=5) as c:
+            time.sleep(0.2)
+            app.system("apptainer instance start /images/tf.sif b", name="b")
+            time.sleep(0.2)
+        Benchmark.Stop()
+        assert c.error is None
+        assert sorted(c.summary()) == ["a", "b"]
+        assert "could not be written" not in capsys.readouterr().out
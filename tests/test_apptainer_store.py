@@ -0,0 +1,112 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_store.py
+# pytest -v  tests/test_apptainer_store.py
+# pytest -v --capture=no  tests/test_apptainer_store.py::TestStore::<METHODNAME>
+###############################################################
+import hashlib
+import os
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.store import file_digest
+
+CONTENT = os.urandom(3 * 1024 * 1024 + 17)
+DIGEST = f"sha256:{hashlib.sha256(CONTENT).hexdigest()}"
+COPIES = ["images/tf.sif", "images/tf-copy.sif", "project/tf.sif"]
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def apptainer(fake_apptainer):
+    write("images/tf.sif", CONTENT)
+    write("images/tf-copy.sif", CONTENT)
+    write("project/tf.sif", CONTENT)
+    write("images/other.sif", b"other")
+    app = Apptainer(digest=True)
+    with app.batch():
+        app.add_location("images")
+        app.add_location("project")
+    return app
+
+
+class TestStore:
+
+    def test_file_digest(self, fake_apptainer):
+        HEADING()
+        write("a.sif", CONTENT)
+        write("empty.sif", b"")
+        Benchmark.Start()
+        assert file_digest("a.sif", chunk=1024 * 1024) == DIGEST
+        Benchmark.Stop()
+        assert file_digest("empty.sif") == f"sha256:{hashlib.sha256().hexdigest()}"
+
+    def test_digest(self, apptainer):
+        HEADING()
+        digests = {image["location"]: image.get("digest") for image in apptainer.images}
+        assert digests["images/tf.sif"] == DIGEST
+        assert digests["project/tf.sif"] == DIGEST
+        assert digests["images/other.sif"] != DIGEST
+        assert apptainer.find_image(DIGEST[:20])["digest"] == DIGEST
+        with pytest.raises(ValueError):
+            apptainer.find_image("sha256:0000")
+
+        reloaded = Apptainer()
+        assert reloaded.catalog.hash() == 0
+        assert reloaded.images == apptainer.images
+
+    def test_dedup(self, apptainer):
+        HEADING()
+        assert apptainer.dedup(dry_run=True)
+        assert os.stat("images/tf.sif").st_nlink == 1
+        Benchmark.Start()
+        results = apptainer.dedup()
+        Benchmark.Stop()
+        assert len(results) == 2
+        assert sum(result["bytes"] for result in results) == 2 * len(CONTENT)
+        inodes = {os.stat(path).st_ino for path in COPIES}
+        assert len(inodes) == 1
+        assert apptainer.catalog.hash() == 0
+        assert len(apptainer.images) == 4
+        assert all("digest" in image for image in apptainer.images)
+        assert apptainer.dedup() == []
+
+    def test_symlink(self, apptainer):
+        HEADING()
+        results = apptainer.dedup(mode="symlink")
+        assert {result["mode"] for result in results} == {"symlink"}
+        links = [path for path in COPIES if os.path.islink(path)]
+        assert len(links) == 2
+        with open(links[0], "rb") as f:
+            assert f.read() == CONTENT
+        assert apptainer.dedup(mode="symlink") == []
+
+    def test_rewritten(self, apptainer):
+        HEADING()
+        mtime = os.stat("images").st_mtime_ns
+        with open("images/tf-copy.sif", "r+b") as f:
+            f.write(b"new")
+        assert os.stat("images").st_mtime_ns == mtime
+        results = apptainer.dedup()
+        assert [result["path"] for result in results] == ["project/tf.sif"]
+        with open("images/tf-copy.sif", "rb") as f:
+            assert f.read(3) == b"new"
+        assert os.stat("images/tf-copy.sif").st_nlink == 1
+        digests = {image["location"]: image["digest"] for image in apptainer.images}
+        assert digests["images/tf-copy.sif"] == file_digest("images/tf-copy.sif")
+
+    def test_find_rewritten(self, apptainer):
+        HEADING()
+        with open("images/tf.sif", "r+b") as f:
+            f.write(b"new")
+        image = apptainer.find_image(DIGEST)
+        assert image["location"] in ["images/tf-copy.sif", "project/tf.sif"]
+        digest = file_digest("images/tf.sif")
+        assert apptainer.find_image(digest)["location"] == "images/tf.sif"
@@ -0,0 +1,51 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_stream.py
+# pytest -v  tests/test_apptainer_stream.py
+# pytest -v --capture=no  tests/test_apptainer_stream.py::TestStream::<METHODNAME>
+###############################################################
+import time
+
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+
+class TestStream:
+
+    def test_stream(self, apptainer):
+        HEADING()
+        Benchmark.Start()
+        lines = list(apptainer.stream("echo a; echo b >&2; printf c"))
+        Benchmark.Stop()
+        assert ("stdout", "a\n") in lines
+        assert ("stderr", "b\n") in lines
+        assert ("stdout", "c") in lines
+
+    def test_stream_is_incremental(self, apptainer):
+        HEADING()
+        start = time.time()
+        generator = apptainer.stream("echo first; sleep 5; echo second")
+        assert next(generator) == ("stdout", "first\n")
+        assert time.time() - start < 4
+        generator.close()
+        assert time.time() - start < 4
+
+    def test_long_line_is_split(self, apptainer):
+        HEADING()
+        lines = list(apptainer.stream("yes x | head -c 100000 | tr -d '\\n'", chunk=1024))
+        assert "".join(line for stream, line in lines) == "x" * 50000
+        assert max(len(line) for stream, line in lines) < 2 * 1024
+
+    def test_callback(self, apptainer):
+        HEADING()
+        lines = []
+        stdout, stderr = apptainer.system(
+            "echo a; echo b >&2", callback=lambda stream, line: lines.append((stream, line))
+        )
+        assert (stdout, stderr) == ("", "")
+        assert sorted(lines) == [("stderr", "b\n"), ("stdout", "a\n")]
+
+    def test_exec_stream(self, apptainer):
+        HEADING()
+        apptainer.system("apptainer instance start images/tf.sif tf")
+        lines = list(apptainer.exec(name="tf", command="echo hello", stream=True))
+        assert lines == [("stdout", "hello\n")]
@@ -0,0 +1,61 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_timeout.py
+# pytest -v  tests/test_apptainer_timeout.py
+# pytest -v --capture=no  tests/test_apptainer_timeout.py::TestTimeout::<METHODNAME>
+###############################################################
+import os
+import threading
+import time
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.apptainer import ApptainerCancelled
+from cloudmesh.apptainer.apptainer import ApptainerTimeout
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().split()[2] != "Z"
+
+
+class TestTimeout:
+
+    def test_timeout(self, apptainer):
+        HEADING()
+        Benchmark.Start()
+        start = time.time()
+        with pytest.raises(ApptainerTimeout) as e:
+            apptainer.system("echo partial; sleep 30 & echo $! > child; wait", timeout=1)
+        Benchmark.Stop()
+        assert time.time() - start < 10
+        assert e.value.stdout == "partial\n"
+        with open("child") as f:
+            pid = int(f.read())
+        time.sleep(0.2)
+        assert not alive(pid)
+
+    def test_default_timeout(self, fake_apptainer):
+        HEADING()
+        apptainer = Apptainer(timeout=1)
+        with pytest.raises(ApptainerTimeout):
+            apptainer.system("sleep 30")
+        with pytest.raises(ApptainerTimeout):
+            list(apptainer.stream("echo a; sleep 30"))
+
+    def test_cancel(self, apptainer):
+        HEADING()
+        timer = threading.Timer(0.5, apptainer.cancel, kwargs={"name": "sleeper"})
+        timer.start()
+        start = time.time()
+        with pytest.raises(ApptainerCancelled) as e:
+            apptainer.system("echo partial; sleep 30", name="sleeper")
+        assert time.time() - start < 10
+        assert e.value.stdout == "partial\n"
+        assert apptainer.cancel() == 0
@@ -0,0 +1,169 @@
+###############################################################
+# pytest -v --capture=no tests/test_apptainer_transport.py
+# pytest -v  tests/test_apptainer_transport.py
+# pytest -v --capture=no  tests/test_apptainer_transport.py::TestTransport::<METHODNAME>
+###############################################################
+import asyncio
+import os
+import stat
+import sys
+
+import pytest
+from cloudmesh.common.Benchmark import Benchmark
+from cloudmesh.common.util import HEADING
+
+from cloudmesh.apptainer.apptainer import Apptainer
+from cloudmesh.apptainer.asyncapptainer import AsyncApptainer
+from cloudmesh.apptainer.session import ExecSession
+from cloudmesh.apptainer.transport import LocalTransport
+from cloudmesh.apptainer.transport import SshTransport
+from cloudmesh.apptainer.transport import get_transport
+
+FAKE_SSH = '''#!{python}
+"""A stand-in for ssh that runs the command on this host.
+
+The master connection of a ControlPath is a file at that path; every
+call is logged to $FAKE_APPTAINER_STATE/ssh.log as connect if it had to
+open the master connection and as mux otherwise.
+"""
+import os
+import subprocess
+import sys
+
+arguments = sys.argv[1:]
+options = {{}}
+operation = None
+while arguments and arguments[0].startswith("-"):
+    flag = arguments.pop(0)
+    value = arguments.pop(0)
+    if flag == "-o":
+        key, value = value.split("=", 1)
+        options[key] = value
+    elif flag == "-O":
+        operation = value
+destination, command = arguments[0], arguments[1:]
+host = destination.split("@")[-1]
+control = options["ControlPath"].replace("%C", host)
+if operation == "check":
+    sys.exit(0 if os.path.exists(control) else 255)
+if operation == "exit":
+    os.remove(control)
+    sys.exit(0)
+with open(os.path.join(os.environ["FAKE_APPTAINER_STATE"], "ssh.log"), "a") as log:
+    if os.path.exists(control):
+        log.write(f"mux {{host}}\\n")
+    else:
+        open(control, "w").close()
+        log.write(f"connect {{host}}\\n")
+sys.exit(subprocess.call(["sh", "-c", " ".join(command)]))
+'''
+
+
+@pytest.fixture
+def fake_ssh(fake_apptainer, tmp_path):
+    script = tmp_path / "bin" / "ssh"
+    script.write_text(FAKE_SSH.format(python=sys.executable))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+
+def log():
+    with open("ssh.log") as f:
+        return f.read().split("\n")[:-1]
+
+
+class TestTransport:
+
+    def test_get_transport(self):
+        HEADING()
+        assert isinstance(get_transport(), LocalTransport)
+        assert isinstance(get_transport(host="localhost"), LocalTransport)
+        assert isinstance(get_transport(host=os.uname()[1]), LocalTransport)
+        assert isinstance(get_transport(host="node1"), SshTransport)
+        assert isinstance(get_transport("local", host="node1"), LocalTransport)
+        transport = SshTransport("node1")
+        assert get_transport(transport, host="node1") is transport
+        with pytest.raises(ValueError):
+            get_transport("telnet", host="node1")
+
+    def test_wrap(self, tmp_path):
+        HEADING()
+        transport = SshTransport(
+            "node1", user="alice", port=2222, persist=60, control_dir=str(tmp_path)
+        )
+        arguments, shell = transport.wrap("apptainer instance list --json")
+        assert not shell
+        assert arguments[0] == "ssh"
+        assert arguments[-2:] == ["alice@node1", "apptainer instance list --json"]
+        assert "ControlMaster=auto" in arguments
+        assert "ControlPersist=60" in arguments
+        assert f"ControlPath={tmp_path}/%C" in arguments
+        assert arguments[arguments.index("-p") + 1] == "2222"
+        assert LocalTransport().wrap("ls -l") == ("ls -l", True)
+
+    def test_remote(self, fake_ssh):
+        HEADING()
+        os.mkdir("images")
+        with open("images/tf.sif", "wb") as f:
+            f.write(b"\0")
+        Apptainer(host="node1", transport="local").add_location("images")
+        app = Apptainer(host="node1", ttl=0)
+        assert app.hostname == "node1"
+        assert isinstance(app.transport, SshTransport)
+        Benchmark.Start()
+        app.start(name="tf", image="tf.sif")
+        assert [i["instance"] for i in app.list()] == ["tf"]
+        assert app.exec(name="tf", command="echo hello") == ("hello\n", "")
+        results = app.exec_many("tf", command="sh -c 'exit 3'")
+        assert results[0]["returncode"] == 3
+        app.stop(name="tf")
+        assert app.list() == []
+        Benchmark.Stop()
+        assert log()[0] == "connect node1"
+        assert set(log()[1:]) == {"mux node1"}
+        assert app.transport.connected()
+        app.transport.close()
+        assert not app.transport.connected()
+        app.list()
+        assert log()[-1] == "connect node1"
+
+    def test_remote_session(self, fake_ssh):
+        HEADING()
+        app = Apptainer(host="node1")
+        with ExecSession(app, name="tf") as session:
+            assert session.exec("echo hello; pwd") == (f"hello\n{os.getcwd()}\n", "")
+            assert session.exec("false") == ("", "")
+            assert session.returncode == 1
+        assert log() == ["connect node1"]
+
+    def test_remote_async(self, fake_ssh):
+        HEADING()
+        app = AsyncApptainer(Apptainer(host="node1"))
+        stdout, stderr = asyncio.run(
+            app.system(command=["sh", "-c", "echo $X"], env={"X": "remote"})
+        )
+        assert stdout == "remote\n"
+        assert log() == ["connect node1"]
+
+    def test_remote_local_files(self, fake_ssh):
+        HEADING()
+        os.mkdir("images")
+        with open("images/tf.sif", "wb") as f:
+            f.write(b"\0")
+        app = Apptainer(host="node1", transport="local")
+        app.add_location("images")
+        with open("images/new.sif", "wb") as f:
+            f.write(b"\0")
+        Benchmark.Start()
+        app = Apptainer(host="node1")
+        assert [image["name"] for image in app.images] == ["tf.sif"]
+        with pytest.raises(ValueError):
+            app.add_location("images")
+        with pytest.raises(ValueError):
+            app.download_many([("images/pulled.sif", "docker://pulled")])
+        with pytest.raises(ValueError):
+            app.dedup()
+        with pytest.raises(ValueError):
+            Apptainer(host="node2")
+        Benchmark.Stop()
+        assert not os.path.exists("images/pulled.sif")
+        assert not os.path.exists("ssh.log")